@@ -1,22 +1,61 @@
 import asyncio
 import json
+import os
 import random
+import threading
+import time
+from collections import namedtuple
+from typing import TYPE_CHECKING
 from dotenv import load_dotenv
-from langchain_text_splitters import NLTKTextSplitter
 import pygame
 import sys
-import pysqlite3
-import sys
 
 from JayceResponse import JayceResponse
-sys.modules["sqlite3"] = sys.modules.pop("pysqlite3")
-from langchain_chroma import Chroma
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain.chains.retrieval_qa.base import RetrievalQA
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
+from camera import Camera
+from collision_grid import CollisionGrid
+from conversation_memory import ConversationMemory
+from chat_log import ChatLayout, ChatLog, StreamingMessage
+from fov import DarknessOverlay, FieldOfView
+from frame_scheduler import FrameScheduler
+from map_renderer import MapRenderer
+from perf_hud import PerfHud
+from response_cache import ResponseCache
+from sprite_atlas import SpriteAtlas
+from dialogue_scheduler import GREETING, MESSAGE, DialogueScheduler
+from dungeon_generator import generate_dungeon
+from greeting_prefetch import GreetingPrefetcher
+from enemies import EnemySwarm
+from fragment_index import FragmentIndex, FragmentSampler
+from ingestion_manifest import MANIFEST_FILE, IngestionManifest, settings_fingerprint
+from ingestion_pipeline import IngestionPipeline
+from startup_timings import StartupTimings
+from telemetry import telemetry
+
+# LangChain, Chroma, OpenAI y NLTK tardan segundos en importarse: se cargan
+# en segundo plano (init_dialogue) mientras el mapa ya es jugable
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+    from dialogue_engine import DialogueEngine
 
 TILE_SIZE = 48
+FPS = 60
+# Tamaño máximo de la ventana; los mapas más grandes se recorren con la cámara
+MAX_WINDOW_WIDTH = 1632
+MAX_WINDOW_HEIGHT = 816
+# Frecuencia fija de simulación (movimiento, colisiones); sin definir, un paso por frame
+FIXED_UPDATE_HZ = int(os.getenv('FIXED_UPDATE_HZ', '0')) or None
+# Telemetría (OpenTelemetry): "none", "console", "file" (TELEMETRY_FILE) u "otlp"
+TELEMETRY_EXPORTER = os.getenv('TELEMETRY_EXPORTER', 'none')
+TELEMETRY_FILE = os.getenv('TELEMETRY_FILE', 'telemetry.jsonl')
+FRAME_HITCH_MS = 2 * 1000 / FPS  # Los frames más lentos dejan un span con el desglose por fases
+# Overlay de rendimiento (F3); con PERF_HUD=1 empieza visible
+PERF_HUD = os.getenv('PERF_HUD', '0') == '1'
+# Campo de visión y niebla de guerra
+FOG_OF_WAR = os.getenv('FOG_OF_WAR', '1') == '1'
+FOV_RADIUS = 8
+# Mazmorra generada (por ejemplo "80x50"); sin definir se usa level.txt
+DUNGEON_SIZE = os.getenv('DUNGEON_SIZE')
+DUNGEON_SEED = int(os.getenv('DUNGEON_SEED')) if os.getenv('DUNGEON_SEED') else None
 TEXT_COLOR = (255, 255, 255)
 
 BOOK_FILES = [
@@ -30,6 +69,40 @@ BOOK_FILES = [
     }
 ]
 
+# Backend de los modelos: "openai" o "offline" (modelos locales deterministas, sin red)
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'openai')
+OFFLINE_LATENCY = float(os.getenv('OFFLINE_LATENCY', '0.5'))
+OFFLINE_JITTER = float(os.getenv('OFFLINE_JITTER', '0.2'))
+OFFLINE_TOKEN_DELAY = float(os.getenv('OFFLINE_TOKEN_DELAY', '0.02'))
+# Servicio de diálogo compartido (dialogue_service.py); sin definir, los NPCs se ejecutan en el juego
+DIALOGUE_SERVICE_URL = os.getenv('DIALOGUE_SERVICE_URL')
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+# Cada backend tiene su propia colección: los embeddings no son compatibles entre sí
+CHROMA_DIRECTORY = "chroma_db" if LLM_BACKEND == 'openai' else f"chroma_db_{LLM_BACKEND}"
+# Vector store de los libros: "chroma" o "numpy" (índice en memoria con mmap, sin SQLite)
+VECTORSTORE_BACKEND = os.getenv('VECTORSTORE_BACKEND', 'chroma')
+# El índice NumPy tiene su propio manifiesto de ingesta, dentro del directorio de datos
+VECTORSTORE_DIRECTORY = CHROMA_DIRECTORY if VECTORSTORE_BACKEND == 'chroma' else os.path.join(CHROMA_DIRECTORY, "numpy_index")
+
+# Configuración del splitter: forma parte de la huella del manifiesto de ingesta
+SPLITTER_SETTINGS = {
+    'chunk_size': 4000,
+    'chunk_overlap': 200,
+    'separator': '\n\n',
+    'language': 'english'
+}
+# Ingesta: procesos para dividir los libros (sin definir, uno por CPU) y lotes de embeddings
+INGESTION_WORKERS = int(os.getenv('INGESTION_WORKERS', '0')) or None
+INGESTION_BATCH_SIZE = 64
+INGESTION_MAX_BATCH_TOKENS = 8000  # Tokens por petición de embeddings
+INGESTION_CONCURRENCY = 4  # Peticiones de embeddings a la vez
+
+# Caché de respuestas de los NPCs (nivel exacto siempre, semántico opcional)
+RESPONSE_CACHE_PATH = os.path.join(CHROMA_DIRECTORY, "response_cache.json")
+# Desactivado por defecto: cada fallo de la caché exacta de Ekko costaría una petición de embeddings más
+RESPONSE_CACHE_SEMANTIC = os.getenv('RESPONSE_CACHE_SEMANTIC', '0') == '1'
+
 load_dotenv()
 
 SYSTEM_TEMPLATE_NPC1 = """Eres un NPC llamado Jayce que está tratando de recordar un libro. Estás un poco confundido y frustrado porque 
@@ -109,22 +182,86 @@ Y estos fragmentos del libro:
 Genera una respuesta apropiada.
 """
 
-BOOK_REMEMBERED = False
+SUMMARY_TEMPLATE = """Actualiza el resumen de una conversación entre un jugador y un NPC con los mensajes nuevos.
+Mantén los detalles útiles para adivinar el libro (fragmentos, pistas, títulos mencionados) y escribe como mucho cinco frases.
+
+<summary>
+{summary}
+</summary>
+
+<new_messages>
+{new_messages}
+</new_messages>
+
+Devuelve solo el resumen actualizado.
+"""
+
+def window_size(level_data):
+    """
+    Tamaño de la ventana para un nivel: el del mapa, limitado al máximo
+    """
+    rows = len(level_data)
+    cols = len(level_data[0]) if rows > 0 else 0
+    return min(cols * TILE_SIZE, MAX_WINDOW_WIDTH), min(rows * TILE_SIZE, MAX_WINDOW_HEIGHT)
+
 
 def load_map(filename):
     with open(filename, 'r') as f:
         lines = [line.strip('\n') for line in f]
     return lines
 
-def init_embeddings():
+
+def load_level():
+    """
+    Nivel de la partida: una mazmorra generada si DUNGEON_SIZE está definido,
+    si no el mapa de level.txt
+    """
+    if DUNGEON_SIZE:
+        cols, rows = (int(v) for v in DUNGEON_SIZE.lower().split('x'))
+        return generate_dungeon(cols, rows, seed=DUNGEON_SEED)
+    return load_map('level.txt')
+
+def use_pysqlite3():
+    """
+    Chroma necesita un sqlite3 más reciente que el de algunos sistemas
+    """
+    import pysqlite3
+    sys.modules["sqlite3"] = pysqlite3
+
+def init_embeddings(http_async_client=None):
+    """
+    Sin http_async_client, las llamadas asíncronas usan el cliente HTTP compartido
+    """
+    if LLM_BACKEND == 'offline':
+        from offline_backends import HashingEmbeddings
+        return HashingEmbeddings()
+
+    from dialogue_engine import shared_http_clients
+    from langchain_openai import OpenAIEmbeddings
+    http_client, shared_async_client = shared_http_clients()
     return OpenAIEmbeddings(
-        model="text-embedding-ada-002"
+        model=EMBEDDING_MODEL,
+        http_client=http_client,
+        http_async_client=http_async_client or shared_async_client
     )
 
 def init_llm():
+    if LLM_BACKEND == 'offline':
+        from offline_backends import ScriptedChatModel
+        return ScriptedChatModel(
+            latency=OFFLINE_LATENCY,
+            jitter=OFFLINE_JITTER,
+            token_delay=OFFLINE_TOKEN_DELAY
+        )
+
+    from dialogue_engine import shared_http_clients
+    from langchain_openai import ChatOpenAI
+    http_client, http_async_client = shared_http_clients()
     return ChatOpenAI(
         model="gpt-4o",
-        temperature=0
+        temperature=0,
+        http_client=http_client,
+        http_async_client=http_async_client
     )
 
 def load_random_book():
@@ -132,70 +269,91 @@ def load_random_book():
     return book_file
 
 def init_vectorstore(embeddings):
-    vectorstore = Chroma(
-        embedding_function=embeddings,
-        collection_name="books",
-        persist_directory="chroma_db"
-    )
-
-    for book in BOOK_FILES:
-        book_docs = load_text_as_documents(book['file'], book['name'])
-        vectorstore.add_documents(book_docs)
-
-    return vectorstore
-
-def load_text_as_documents(file_path, book_name):
-    with open(file_path, 'r', encoding='utf-8') as f:
-        full_text = f.read()
+    if VECTORSTORE_BACKEND == 'numpy':
+        from numpy_vector_index import NumpyVectorIndex
+        vectorstore = NumpyVectorIndex(embeddings, VECTORSTORE_DIRECTORY)
+    else:
+        use_pysqlite3()
+        from langchain_chroma import Chroma
 
-    # Aplicas el splitter para obtener "Document" con .page_content en cada trozo
-    text_splitter = NLTKTextSplitter()
-    metadatas = [{"book": book_name}]
-    docs = text_splitter.create_documents([full_text], metadatas)
+        vectorstore = Chroma(
+            embedding_function=embeddings,
+            collection_name="books",
+            persist_directory=CHROMA_DIRECTORY
+        )
 
-    return docs
+    # Solo se embeben los libros nuevos o modificados desde el último arranque
+    manifest = IngestionManifest(
+        os.path.join(VECTORSTORE_DIRECTORY, MANIFEST_FILE),
+        settings_fingerprint(SPLITTER_SETTINGS, getattr(embeddings, 'model', EMBEDDING_MODEL))
+    )
 
-async def get_random_fragment(vectorstore: Chroma, book_name: str):
-    filter_dict = {"book": {"$eq": book_name}}
+    async def ingest():
+        # La ingesta tiene su propio bucle (asyncio.run en el hilo de carga): sus embeddings usan
+        # un cliente HTTP propio que se cierra con ella, sin dejar conexiones de este bucle abiertas
+        from dialogue_engine import dedicated_async_client
+        async with dedicated_async_client() as http_async_client:
+            pipeline = IngestionPipeline(
+                vectorstore,
+                init_embeddings(http_async_client),
+                manifest,
+                SPLITTER_SETTINGS,
+                workers=INGESTION_WORKERS,
+                batch_size=INGESTION_BATCH_SIZE,
+                max_batch_tokens=INGESTION_MAX_BATCH_TOKENS,
+                concurrency=INGESTION_CONCURRENCY
+            )
+            return await pipeline.run(BOOK_FILES)
 
-    document = vectorstore.get(
-        limit=3,
-        where=filter_dict
+    stats = asyncio.run(ingest())
+    print(
+        f"Ingesta: {stats['skipped']} libros sin cambios, {stats['added']} chunks añadidos, "
+        f"{stats['deleted']} chunks borrados ({stats['chunks_per_sec']:.1f} chunks/s, {stats['batches']} lotes, "
+        f"{stats['retries']} reintentos)"
     )
 
-    paragraph = random.choice(document["documents"])
+    # Las frases de cada libro quedan en memoria para los fragmentos de Jayce
+    fragment_index = FragmentIndex.from_manifest(manifest)
 
-    sentences = paragraph.split("\n") # This is the first sentence
-    # Remove empty strings
-    sentences = [s for s in sentences if s.strip()]
-    #print(f"Sentencias: {sentences}")
+    return vectorstore, fragment_index
 
-    random_fragment = random.choice(sentences)
-    return random_fragment
+def get_random_fragment(fragments: FragmentSampler, peek=False):
+    """
+    Frase al azar de todo el libro, sacada del índice en memoria
+    """
+    return fragments.next(peek)
 
-async def get_summary(conversation, llm: ChatOpenAI):
+async def get_summary(summary, new_messages, llm: "ChatOpenAI"):
     """
-    Genera un resumen de la conversación utilizando el LLM.
+    Actualiza el resumen de la conversación con los mensajes nuevos utilizando el LLM.
     """
-    summary_prompt = f"Resume la siguiente conversación:\n{conversation}"
-    response = await llm.ainvoke([summary_prompt])
+    new_messages = "\n".join(new_messages)
+    summary_prompt = SUMMARY_TEMPLATE.format(summary=summary or "(vacío)", new_messages=new_messages)
+    with telemetry.measure("npc.summary") as summary_call:
+        summary_call.set("messages", new_messages.count("\n") + 1)
+        response = await llm.ainvoke([summary_prompt])
     return response.content.strip()
 
-async def get_npc2_response_v2(messages, vectorstore: Chroma, llm: ChatOpenAI):
+def conversation_context(messages, memory=None, offset=0):
     """
-    Genera una respuesta asíncrona de NPC2 para deducir el nombre del libro basado en la conversación.
+    Historial para el prompt: resumen más mensajes recientes si el NPC tiene
+    memoria, y si no los últimos 5 mensajes. offset es la posición del
+    primer mensaje en la conversación, si messages son solo los últimos
     """
-    # Extraer el historial de la conversación (últimos 5 mensajes)
-    conversation = "\n".join(messages[-5:])
-
-    # Fase 1: Generar un resumen de la conversación
-    summary = await get_summary(conversation, llm)
+    if memory is not None:
+        return memory.context(messages, offset)
+    return "\n".join(messages[-5:])
 
-    # Configurar el retriever
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
+async def get_npc2_response_v2(messages, engine: "DialogueEngine", memory=None):
+    """
+    Genera una respuesta asíncrona de NPC2 para deducir el nombre del libro basado en la conversación.
+    """
+    # Fase 1: El historial ya resumido (el resumen se actualiza fuera del turno)
+    summary = conversation_context(messages, memory)
 
     # Fase 2: Recuperar documentos relevantes usando el resumen
-    retrieved_docs = retriever.invoke(summary)
+    with telemetry.measure("npc.retrieval", npc="Ekko"):
+        retrieved_docs = engine.retriever.invoke(summary)
 
     # Fase 3: Formatear los fragmentos para el prompt
     fragments_info = "\n".join([f"{doc.metadata.get('name', 'Título desconocido')}: {doc.page_content}" for doc in retrieved_docs])
@@ -207,7 +365,8 @@ async def get_npc2_response_v2(messages, vectorstore: Chroma, llm: ChatOpenAI):
 
     try:
         # Invocar al LLM de forma asíncrona
-        response = await llm.ainvoke([system_message])
+        with telemetry.measure("npc.llm", npc="Ekko"):
+            response = await engine.llm.ainvoke([system_message])
 
         # Procesar la respuesta
         messages.append(f"Ekko: {response.content}")
@@ -218,540 +377,952 @@ async def get_npc2_response_v2(messages, vectorstore: Chroma, llm: ChatOpenAI):
 
     # Procesar la respuesta
 
-async def get_npc2_response(messages, vectorstore: Chroma, llm: ChatOpenAI):
-    # Extraer el historial de la conversación (últimos 5 mensajes)
-    conversation = ""
-    if messages:
-        conversation = "\n".join([msg for msg in messages[-5:]])
-
-    if conversation:
-        # Configurar el retriever
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
-
-        # Crear la cadena de RetrievalQA
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            chain_type="stuff",  # Puedes ajustar el tipo de cadena según tus necesidades
-            retriever=retriever
-        )
-
-        # Formatear el prompt con la conversación
-        system_message = SYSTEM_TEMPLATE_NPC2.format(conversation=conversation)
+async def get_npc2_response(messages, engine: "DialogueEngine", memory=None, offset=0):
+    # Historial de la conversación (resumen y mensajes recientes)
+    conversation = conversation_context(messages, memory, offset)
+
+    # La respuesta se va mostrando en el chat a medida que llegan los tokens
+    # Si la petición se cancela a medias (saludo sustituido), la respuesta se quita del chat
+    with StreamingMessage(messages, "Ekko") as reply:
+
+        if conversation:
+            # Formatear el prompt con la conversación
+            system_message = SYSTEM_TEMPLATE_NPC2.format(conversation=conversation)
+
+            # Preguntas iguales o casi iguales se responden desde la caché
+            with telemetry.measure("npc.cache", npc="Ekko") as lookup:
+                cached = await engine.cached_reply(system_message, semantic_text=conversation)
+                lookup.set("hit", cached is not None)
+            if cached is not None:
+                reply.finish(cached)
+                return
+
+            try:
+                # Escuchamos los eventos de la cadena para recibir los tokens del LLM; npc.chain mide la
+                # cadena entera y los eventos de inicio y fin separan la recuperación (npc.retrieval)
+                # de la llamada al LLM (npc.llm), que así no incluye el tiempo del retriever
+                with telemetry.measure("npc.chain", npc="Ekko") as chain_call:
+                    llm_start = None
+                    async for event in engine.ekko_qa_chain.astream_events({"query": system_message}, version="v2"):
+                        if event["event"] == "on_chat_model_stream":
+                            if chain_call.ttft_ms is None:
+                                chain_call.first_token()
+                                telemetry.record("npc.llm.ttft", (time.time_ns() - llm_start) / 1e6, npc="Ekko", retrieval=True)
+                            reply.append(event["data"]["chunk"].content)
+                        elif event["event"] == "on_chat_model_start":
+                            llm_start = time.time_ns()
+                        elif event["event"] == "on_chat_model_end":
+                            telemetry.interval("npc.llm", llm_start, time.time_ns(), npc="Ekko", retrieval=True)
+                        elif event["event"] == "on_retriever_start":
+                            retrieval_start = time.time_ns()
+                        elif event["event"] == "on_retriever_end":
+                            telemetry.interval("npc.retrieval", retrieval_start, time.time_ns(), npc="Ekko")
+
+                reply.finish(reply.text)
+                await engine.store_reply(system_message, reply.text, semantic_text=conversation)
+
+            except Exception as e:
+                print(f"Error en get_npc2_response: {e}")
+                reply.finish("Mmm... ¿qué me decías? Estaba pensando en el libro...")
+
+        # If no conversation, then no relevant documents can be retrieved
+        # Invoke LLM without RetrievalQA
+        else:
+        
+            try:
+                system_message = SYSTEM_TEMPLATE_NPC2_FULL.format(conversation=conversation, fragments="")
+                with telemetry.measure("npc.cache", npc="Ekko") as lookup:
+                    cached = await engine.cached_reply(system_message)
+                    lookup.set("hit", cached is not None)
+                if cached is not None:
+                    reply.finish(cached)
+                    return
+
+                with telemetry.measure("npc.llm", npc="Ekko", retrieval=False) as llm_call:
+                    async for chunk in engine.llm.astream([system_message]):
+                        llm_call.first_token()
+                        reply.append(chunk.content)
+                reply.finish(reply.text)
+                await engine.store_reply(system_message, reply.text)
+            except Exception as e:
+                print(f"Error en get_npc2_response: {e}")
+                reply.finish("Mmm... ¿qué me decías? Estaba pensando en el libro...")
+
+# Lo que un turno de Jayce cambia en la sesión: la frase que ha usado y si ha recordado el libro.
+# get_npc1_response lo devuelve en vez de aplicarlo, así un turno especulativo no toca la sesión
+NpcTurn = namedtuple('NpcTurn', ['fragment', 'book_remembered'])
+
+async def get_npc1_response(messages, session: "DialogueSession", engine: "DialogueEngine", memory=None, offset=0, speculative=False):
+
+    book_name = session.book['name']
+    if session.book_remembered:
+        messages.append(f"Jayce: ¡Ya lo recuerdo! El título del libro es {book_name}.")
+        return None
+    
+    # Convertimos los mensajes a un formato más legible 
+    # If no messages, return empty string
+    conversation = conversation_context(messages, memory, offset)  # Resumen y mensajes recientes
 
+    # Si la petición se cancela a medias (saludo sustituido), la respuesta se quita del chat
+    with StreamingMessage(messages, "Jayce") as reply:
+        
+        fragment = ""
         try:
-            # Invocar al LLM de forma asíncrona
-            response = await qa_chain.ainvoke({"query": system_message})
+            fragment = get_random_fragment(session.fragments, peek=speculative)
+
+            #print(f"Conversation: {conversation}")
+            #print(f"Fragmento: {fragment}")
+            #print(f"Book name: {book_name}")
+
+            system_message = SYSTEM_TEMPLATE_NPC1.format(conversation=conversation, fragment=fragment, book_name=book_name)
+
+            #print(f"System message: {system_message}")
+
+            # El fragmento forma parte del prompt, así que aquí solo sirve la caché exacta
+            with telemetry.measure("npc.cache", npc="Jayce") as lookup:
+                partial = await engine.cached_reply(system_message)
+                lookup.set("hit", partial is not None)
+            if partial is None:
+                with telemetry.measure("npc.llm", npc="Jayce") as llm_call:
+                    llm_call.set("fragment", fragment)
+                    async for partial in engine.jayce_structured.astream([system_message]):
+                        llm_call.first_token()
+                        reply.update(partial.get("response", ""))
+                await engine.store_reply(system_message, partial)
+
+            # book_remembered solo se conoce cuando el JSON está completo
+            with telemetry.measure("npc.parse", npc="Jayce") as parse:
+                response = JayceResponse.model_validate(partial)
+                parse.set("book_remembered", response.book_remembered)
+            reply.finish(response.response)
+            return NpcTurn(fragment, response.book_remembered)
+        except Exception as e:
+            print(f"Error: {e}")
+            # Si algo falla, damos una respuesta segura
+            reply.finish("Mmm... ¿qué me decías? Estaba pensando en el libro...")
+            return NpcTurn(fragment, False)
+
+# Hojas de sprites: nombre -> (ruta, ancho del tile, alto del tile)
+SPRITE_SHEETS = {
+    'player': ('assets/Player.png', 48, 48),
+    'enemies': ('assets/Enemies.png', 32, 32),
+    'floor': ('assets/Sand.png', 32, 32),
+    'wall': ('assets/Wall2.png', 32, 32),
+    'npcs': ('assets/Npcs4.png', 96, 96),
+    'items': ('assets/Items.png', 32, 32)
+}
+# Tiles del atlas (hoja, fila, columna); el resto se carga bajo demanda
+ATLAS_SPRITES = [
+    *[('player', row, col) for row in range(4) for col in range(3)],
+    ('enemies', 0, 0),
+    ('floor', 0, 0),
+    ('wall', 0, 0),
+    ('npcs', 0, 1),
+    ('npcs', 4, 1),
+    ('items', 0, 12)
+]
+ATLAS_DIRECTORY = "sprite_cache"
+
+# Jugador
+ANIMATION_SPEED = 100
+PLAYER_SPEED = 5
+# Margen de la caja de colisión del jugador, para que la colisión sea más permisiva
+PLAYER_HITBOX_MARGIN = 10
+
+# Enemigos
+ENEMY_SPEED = 2  # Píxeles por frame a FPS, como PLAYER_SPEED
+ENEMY_SIGHT = 30  # Distancia máxima (en tiles) a la que persiguen al jugador
+NPC_INTERACTION_COOLDOWN = 2000  # 2 segundos en milisegundos
+# El saludo de un NPC se empieza a generar cuando el jugador está a este radio (en tiles); 0 lo desactiva
+GREETING_PREFETCH_RADIUS = int(os.getenv('GREETING_PREFETCH_RADIUS', '3'))
+GREETING_PREFETCH_COOLDOWN = 5.0  # Segundos entre saludos especulativos del mismo NPC
+
+# NPCs con los que se habla: tile del mapa -> nombre en el chat
+NPC_NAMES = {'1': "Jayce", '2': "Ekko"}
+
+# Memoria de las conversaciones: mensajes recientes tal cual (en tokens) y el resto resumido
+MEMORY_TAIL_TOKENS = 300
+MEMORY_CONTEXT_TOKENS = 600
+
+# Chat
+CHAT_HEIGHT = 200
+CHAT_MARGIN = 20
+LINE_HEIGHT = 30
+INPUT_HEIGHT = 40
+SCROLLBAR_WIDTH = 20
+MAX_VISIBLE_LINES = (CHAT_HEIGHT - INPUT_HEIGHT - CHAT_MARGIN) // LINE_HEIGHT
+
+
+class DialogueSession:
+    """
+    Estado del diálogo de una partida: el libro que intenta recordar Jayce,
+    sus fragmentos, la memoria de cada conversación y si ya ha recordado el
+    libro. El juego tiene una; el servicio de diálogo, una por cliente sobre
+    el mismo engine (vector store, LLM y caché de respuestas compartidos)
+    """
 
-            # Procesar la respuesta
-            messages.append(f"Ekko: {response['result']}")
+    def __init__(self, engine: "DialogueEngine", fragment_index: FragmentIndex, book=None):
+        self.engine = engine
+        self.book = book or load_random_book()
+        # Jayce no repite fragmentos hasta haber recordado todo el libro
+        self.fragments = fragment_index.sampler(self.book['name'], no_repeat=True)
+        self.book_remembered = False
+        # Cada NPC resume lo antiguo de su conversación en segundo plano
+        self.memories = {
+            npc: ConversationMemory(self._summarize, MEMORY_TAIL_TOKENS, MEMORY_CONTEXT_TOKENS)
+            for npc in NPC_NAMES
+        }
+
+    def _summarize(self, summary, new_messages):
+        return get_summary(summary, new_messages, self.engine.llm)
+
+    async def respond(self, npc, messages, offset=0, speculative=False):
+        """
+        Escribe en messages la siguiente respuesta del NPC y devuelve lo que
+        el turno cambia en la sesión (NpcTurn, o None si no cambia nada).
+        Un turno normal lo aplica ya; uno especulativo (saludo anticipado) no
+        toca la sesión y se aplica con commit solo si el saludo se usa.
+        offset: mensajes de la conversación anteriores a messages (el servicio solo recibe los últimos)
+        """
+        memory = self.memories[npc]
+        if npc == '1':
+            turn = await get_npc1_response(messages, self, self.engine, memory, offset, speculative)
+        else:
+            turn = await get_npc2_response(messages, self.engine, memory, offset)
+        if not speculative:
+            self._apply(turn)
+        return turn
+
+    def _apply(self, turn):
+        if turn is None:
+            return
+        self.fragments.take(turn.fragment)
+        if turn.book_remembered:
+            self.book_remembered = True
+
+    async def commit(self, npc, turn):
+        """
+        Aplica un turno especulativo que se ha pasado al chat
+        """
+        self._apply(turn)
+
+    def remember(self, npc, messages, offset=0):
+        """
+        Tras un turno confirmado: resume en segundo plano lo que se sale de los mensajes recientes
+        """
+        self.memories[npc].update(messages, offset)
+
+    async def close(self):
+        for memory in self.memories.values():
+            memory.cancel()
+
+
+class Game:
+    """
+    Estado del juego y las fases de cada frame: eventos, actualización,
+    pintado del mapa y pintado del chat. main() y el modo headless
+    ejecutan exactamente el mismo código.
+    """
 
-        except Exception as e:
-            print(f"Error en get_npc2_response: {e}")
-            messages.append("Ekko: Mmm... ¿qué me decías? Estaba pensando en el libro...")
+    def __init__(self, screen, level_data, engine=None, fragment_index=None, step_speed=PLAYER_SPEED, clock=pygame.time.get_ticks):
+        self.screen = screen
+        self.screen_width, self.screen_height = screen.get_size()
+        self.level_data = level_data
+        self.engine = engine
+        # Píxeles por paso; puede ser fraccionario (paso fijo a otra frecuencia que FPS)
+        self.step_speed = step_speed
+        self._step_carry = 0.0
+        # Milisegundos desde el arranque; el modo headless usa un reloj simulado
+        self.clock = clock
+
+        self.running = True
+        self.game_over = False
+        self.font_large = pygame.font.Font(None, 64)  # Fuente más grande para el mensaje final
+
+        # Cargamos los tilesets
+        # Solo los tiles que usamos, recortados y escalados en un atlas cacheado en disco
+        self.atlas = SpriteAtlas(SPRITE_SHEETS, TILE_SIZE, ATLAS_DIRECTORY)
+        self.atlas.preload(ATLAS_SPRITES)
+        sprite = self.atlas.tile
+
+        # Variables del jugador
+        self.player_pos = None
+        self.player_direction = 'right'
+        self.animation_frame = 0
+        self.animation_timer = 0
+
+        self.last_npc_interaction_time = 0
+
+        # Overlay de rendimiento y blits del frame en curso
+        self.perf_hud = PerfHud(pygame.font.Font(None, 22), 1000 / FPS)
+        if PERF_HUD:
+            self.perf_hud.toggle()
+        self.frame_blits = 0
+
+        # Configuración de fuentes y chat
+        self.font = pygame.font.Font(None, 32)
+        self.chat_active = False
+        self.chat_text = ""
+        self.messages_npc1 = ChatLog()
+        self.messages_npc2 = ChatLog()
+        # Cada conversación se maqueta de forma incremental al recibir mensajes
+        self.chat_layouts = {
+            '1': ChatLayout(self.font, self.screen_width - CHAT_MARGIN * 3 - SCROLLBAR_WIDTH, TEXT_COLOR),
+            '2': ChatLayout(self.font, self.screen_width - CHAT_MARGIN * 3 - SCROLLBAR_WIDTH, TEXT_COLOR)
+        }
+        self.total_lines = []
+        self.scroll_offset = 0
+        self.dragging_scrollbar = False
+        self.last_message_count = 0  # Para detectar nuevos mensajes
+        self.should_autoscroll = True  # Nueva variable para controlar el autoscroll
+
+        # Variables para el estado del diálogo
+        self.npc_type = None
+
+        self.npc1_book = load_random_book()
+
+        # El motor de diálogo puede llegar más tarde (se carga en segundo plano)
+        # dialogue es la sesión de diálogo: local (DialogueSession) o en el servicio (RemoteSession)
+        self.dialogue = None
+        self.dialogue_ready = asyncio.Event()
+        self.dialogue_error = None
+        self.dialogue_scheduler = DialogueScheduler()
+        self.greetings = GreetingPrefetcher(GREETING_PREFETCH_RADIUS, GREETING_PREFETCH_COOLDOWN)
+        if engine is not None:
+            self.set_dialogue(engine, fragment_index)
+
+        # Diccionario de animaciones del jugador
+        self.player_animations = {
+            'right': [sprite('player', 2, 0), sprite('player', 2, 1), sprite('player', 2, 2)],
+            'left': [sprite('player', 1, 0), sprite('player', 1, 1), sprite('player', 1, 2)],
+            'up': [sprite('player', 3, 0), sprite('player', 3, 1), sprite('player', 3, 2)],
+            'down': [sprite('player', 0, 0), sprite('player', 0, 1), sprite('player', 0, 2)],
+        }
+
+        # Mapeamos símbolos a tiles
+        tile_mapping = {
+            '#': sprite('wall', 0, 0),
+            '.': sprite('floor', 0, 0),
+            '1': sprite('npcs', 0, 1),
+            '2': sprite('npcs', 4, 1),
+            'W': sprite('items', 0, 12)
+        }
+
+        self.map_renderer = MapRenderer(level_data, tile_mapping, sprite('floor', 0, 0), TILE_SIZE, conditional_tiles={'W'})
+
+        # Nivel compilado para colisiones; de ahí sale también la posición inicial
+        self.collision = CollisionGrid(level_data, TILE_SIZE)
+        self.player_pos = self.collision.spawn('P')
+        self.npc_tiles = {
+            npc: [(entity.col, entity.row) for entity in self.collision.entities_by_kind.get(npc, [])]
+            for npc in ('1', '2')
+        }
+
+        # La cámara sigue al jugador cuando el mapa no cabe en la ventana
+        self.world_width, self.world_height = self.map_renderer.world_size
+        self.camera = Camera(self.screen_width, self.screen_height, self.world_width, self.world_height)
+
+        # Los 'E' del mapa son puntos de aparición de enemigos que persiguen al jugador
+        self.enemy_sprite = sprite('enemies', 0, 0)
+        self.enemies = EnemySwarm.from_entities(
+            self.collision.entities_by_kind.get('E', []),
+            ~self.collision.class_mask('#'),
+            TILE_SIZE,
+            speed=ENEMY_SPEED * step_speed / PLAYER_SPEED,
+            sight=ENEMY_SIGHT
+        )
 
-    # If no conversation, then no relevant documents can be retrieved
-    # Invoke LLM without RetrievalQA
-    else:
-        
-        try:
-            system_message = SYSTEM_TEMPLATE_NPC2_FULL.format(conversation=conversation, fragments="")
-            response = await llm.ainvoke([system_message])
-            messages.append(f"Ekko: {response.content}")
-        except Exception as e:
-            print(f"Error en get_npc2_response: {e}")
-            messages.append("Ekko: Mmm... ¿qué me decías? Estaba pensando en el libro...")
+        # Niebla de guerra: la visión solo se recalcula al cambiar de tile
+        self.fov = None
+        self.darkness = None
+        if FOG_OF_WAR:
+            self.fov = FieldOfView(self.collision.class_mask('#'), FOV_RADIUS)
+            self.darkness = DarknessOverlay(self.fov, TILE_SIZE, (self.screen_width, self.screen_height))
+            self.fov.update(self.player_tile())
+
+    def _autoscroll_when_done(self, task):
+        # Cuando la tarea termine, activamos el autoscroll
+        task.add_done_callback(lambda _: setattr(self, 'should_autoscroll', True))
+
+    def set_dialogue(self, engine, fragment_index):
+        """
+        Conecta el motor de diálogo cuando termina de cargarse
+        """
+        self.engine = engine
+        self.dialogue = DialogueSession(engine, fragment_index, self.npc1_book)
+        self.dialogue_ready.set()
+
+    def set_remote_dialogue(self, session):
+        """
+        Conecta una sesión del servicio de diálogo (los NPCs se ejecutan en el servicio)
+        """
+        self.dialogue = session
+        self.dialogue_ready.set()
+
+    @property
+    def book_remembered(self):
+        return self.dialogue is not None and self.dialogue.book_remembered
+
+    def dialogue_failed(self, error):
+        self.dialogue_error = error
+        self.dialogue_ready.set()
+
+    async def _respond_when_ready(self, messages, speaker, respond):
+        """
+        Lanza la respuesta del NPC; si el motor de diálogo aún se está cargando,
+        el NPC se queda "pensando" y la petición espera a que esté listo
+        """
+        if not self.dialogue_ready.is_set():
+            with StreamingMessage(messages, speaker) as thinking:
+                thinking.update("(pensando...)")
+                await self.dialogue_ready.wait()
+            if self.dialogue is None:
+                thinking.finish("Mmm... ¿qué me decías? Estaba pensando en el libro...")
+                return
+            thinking.discard()
+        elif self.dialogue is None:
+            messages.append(f"{speaker}: Mmm... ¿qué me decías? Estaba pensando en el libro...")
+            return
+        await respond()
+
+    def _npc_response(self, npc, messages, speculative=False):
+        return self.dialogue.respond(npc, messages, speculative=speculative)
+
+    def _talk(self, npc, messages, speaker, kind):
+        async def request():
+            with telemetry.measure("npc.turn", npc=speaker, kind=kind) as turn:
+                # Al tocar al NPC el saludo puede estar ya generado desde que el jugador se acercó
+                prefetch = await self.greetings.claim(npc, messages) if kind == GREETING else None
+                turn.set("prefetched", prefetch is not None)
+                if prefetch is not None:
+                    # El saludo anticipado no tocó la sesión: se aplica ahora que se usa
+                    await self.dialogue.commit(npc, prefetch.result())
+                else:
+                    await self._respond_when_ready(messages, speaker, lambda: self._npc_response(npc, messages))
+            if self.dialogue is not None:
+                self.dialogue.remember(npc, messages)
+
+        # Una sola petición en curso por NPC; los mensajes escritos mientras tanto se agrupan
+        return self.dialogue_scheduler.submit(npc, request, kind)
+
+    def talk_to_npc1(self, kind=MESSAGE):
+        return self._talk('1', self.messages_npc1, NPC_NAMES['1'], kind)
+
+    def talk_to_npc2(self, kind=MESSAGE):
+        return self._talk('2', self.messages_npc2, NPC_NAMES['2'], kind)
+
+    def prefetch_greetings(self):
+        """
+        Empieza a generar el saludo de los NPCs cercanos antes de que el jugador los toque
+        """
+        if self.dialogue is None or self.chat_active:
+            return
+        col, row = self.player_tile()
+        for npc, messages in (('1', self.messages_npc1), ('2', self.messages_npc2)):
+            tiles = self.npc_tiles[npc]
+            # Con una respuesta aún escribiéndose en el chat, la conversación no es definitiva
+            if not tiles or self.dialogue_scheduler.busy(npc):
+                continue
+            distance = min(max(abs(col - npc_col), abs(row - npc_row)) for npc_col, npc_row in tiles)
+            self.greetings.update(npc, distance, messages, lambda scratch, npc=npc: self._npc_response(npc, scratch, speculative=True))
 
-async def get_npc1_response(messages, vectorstore, llm: ChatOpenAI, book_name: str):
+    def handle_event(self, event):
+        if event.type == pygame.QUIT:
+            self.running = False
 
-    global BOOK_REMEMBERED
+        # F3 muestra u oculta el overlay de rendimiento, también con el chat abierto
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+            self.perf_hud.toggle()
+            return
 
-    if BOOK_REMEMBERED:
-        messages.append(f"Jayce: ¡Ya lo recuerdo! El título del libro es {book_name}.")
-        return
-    
-    # Convertimos los mensajes a un formato más legible 
-    # If no messages, return empty string
-    conversation = ""
-    if messages:
-        conversation = "\n".join([msg for msg in messages[-5:]])  # Últimos 5 mensajes
+        # Si el juego ha terminado, solo procesar el evento de salida
+        if self.game_over:
+            return
 
-    fragment = await get_random_fragment(vectorstore, book_name)
+        # Manejo de eventos del chat
+        if not self.chat_active:
+            return
 
-    print(f"Fragmento aleatorio: {fragment}")
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            if event.button == 1:  # Clic izquierdo
+                mouse_pos = pygame.mouse.get_pos()
+                scrollbar_rect = pygame.Rect(
+                    self.screen_width - SCROLLBAR_WIDTH - CHAT_MARGIN,
+                    self.screen_height - CHAT_HEIGHT + CHAT_MARGIN,
+                    SCROLLBAR_WIDTH,
+                    CHAT_HEIGHT - INPUT_HEIGHT - CHAT_MARGIN
+                )
+                if scrollbar_rect.collidepoint(mouse_pos):
+                    self.dragging_scrollbar = True
+                    self.should_autoscroll = False  # Desactivamos autoscroll al usar scrollbar
+
+        elif event.type == pygame.MOUSEBUTTONUP:
+            if event.button == 1:
+                self.dragging_scrollbar = False
+
+        elif event.type == pygame.MOUSEMOTION:
+            if self.dragging_scrollbar:
+                # Calcular la nueva posición del scroll basada en la posición del ratón
+                mouse_y = event.pos[1]
+                scrollbar_top = self.screen_height - CHAT_HEIGHT + CHAT_MARGIN
+                scrollbar_height = CHAT_HEIGHT - INPUT_HEIGHT - CHAT_MARGIN
+                relative_y = mouse_y - scrollbar_top
+
+                # Convertir la posición del ratón a índice de scroll
+                if len(self.total_lines) > MAX_VISIBLE_LINES:
+                    scroll_ratio = relative_y / scrollbar_height
+                    scroll_offset = int(scroll_ratio * (len(self.total_lines) - MAX_VISIBLE_LINES))
+                    self.scroll_offset = max(0, min(scroll_offset, len(self.total_lines) - MAX_VISIBLE_LINES))
+
+        elif event.type == pygame.MOUSEWHEEL:
+            self.should_autoscroll = False  # Desactivamos autoscroll al usar la rueda
+            if event.y > 0:  # Scroll arriba
+                self.scroll_offset = max(0, self.scroll_offset - 1)
+            else:  # Scroll abajo
+                if len(self.total_lines) > MAX_VISIBLE_LINES:
+                    self.scroll_offset = min(self.scroll_offset + 1, len(self.total_lines) - MAX_VISIBLE_LINES)
+
+        elif event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_RETURN:  # Enviar mensaje
+                if self.chat_text.strip():  # Si el mensaje no está vacío
+                    # Añadimos el mensaje del jugador
+                    if self.npc_type == '1':  # Si estamos hablando con NPC1
+                        self.messages_npc1.append(f"Jugador: {self.chat_text}")
+                        self._autoscroll_when_done(self.talk_to_npc1())
+                    elif self.npc_type == '2':  # Si estamos hablando con NPC2
+                        self.messages_npc2.append(f"Jugador: {self.chat_text}")
+                        self._autoscroll_when_done(self.talk_to_npc2())
+                    self.chat_text = ""
+                    self.should_autoscroll = True  # Activamos autoscroll al enviar mensaje
+            elif event.key == pygame.K_ESCAPE:  # Cerrar chat
+                self.chat_active = False
+                self.chat_text = ""
+                self.npc_type = None
+                self.last_npc_interaction_time = self.clock()  # Actualizar el tiempo al cerrar el chat
+            elif event.key == pygame.K_BACKSPACE:  # Borrar
+                self.chat_text = self.chat_text[:-1]
+            else:
+                # Añadir caracteres al mensaje (limitado a 200 caracteres)
+                if event.unicode.isprintable() and len(self.chat_text) < 200:
+                    self.chat_text += event.unicode
+
+    @staticmethod
+    def player_hitbox(pos):
+        return (
+            pos[0] + PLAYER_HITBOX_MARGIN,
+            pos[1] + PLAYER_HITBOX_MARGIN,
+            TILE_SIZE - PLAYER_HITBOX_MARGIN * 2,
+            TILE_SIZE - PLAYER_HITBOX_MARGIN * 2
+        )
 
-    llm_structured = llm.with_structured_output(JayceResponse)
+    def player_tile(self):
+        # Tile (columna, fila) del centro del jugador
+        half = TILE_SIZE // 2
+        return (self.player_pos[0] + half) // TILE_SIZE, (self.player_pos[1] + half) // TILE_SIZE
+
+    def _step(self):
+        # La posición del jugador sigue en píxeles enteros: la fracción del paso se acumula
+        self._step_carry += self.step_speed
+        step = int(self._step_carry)
+        self._step_carry -= step
+        return step
+
+    def update(self, keys, current_time):
+        """
+        Un paso de simulación: movimiento, colisiones y encuentros con NPCs
+        """
+        # Manejo del movimiento
+        moving = False
+        new_pos = self.player_pos.copy()
+
+        if keys[pygame.K_LEFT]:
+            new_pos[0] -= self._step()
+            self.player_direction = 'left'
+            moving = True
+        elif keys[pygame.K_RIGHT]:
+            new_pos[0] += self._step()
+            self.player_direction = 'right'
+            moving = True
+        elif keys[pygame.K_UP]:
+            new_pos[1] -= self._step()
+            self.player_direction = 'up'
+            moving = True
+        elif keys[pygame.K_DOWN]:
+            new_pos[1] += self._step()
+            self.player_direction = 'down'
+            moving = True
+
+        # Verificar colisiones y actualizar posición
+        new_pos[0] = max(0, min(new_pos[0], self.world_width - TILE_SIZE))
+        new_pos[1] = max(0, min(new_pos[1], self.world_height - TILE_SIZE))
+
+        # Una sola consulta a la rejilla para las paredes, y otra al hash espacial
+        # para los NPCs y objetos que toca la caja del jugador
+        hitbox = self.player_hitbox(new_pos)
+        if '#' not in self.collision.classes_at(*hitbox):
+            self.player_pos = new_pos
+            hits = {entity.kind for entity in self.collision.entities_at(*hitbox)}
+
+            # Check collision with the item
+            if 'W' in hits:
+                self.game_over = True
+
+            # Verificar colisión con NPCs solo si ha pasado suficiente tiempo
+            elif current_time - self.last_npc_interaction_time >= NPC_INTERACTION_COOLDOWN:
+                if '1' in hits:
+                    self.chat_active = True
+                    self.npc_type = '1'  # Marcamos que estamos hablando con NPC1
+                    self.talk_to_npc1(GREETING)
+                elif '2' in hits:
+                    self.chat_active = True
+                    self.npc_type = '2'  # Marcamos que estamos hablando con NPC2
+                    self.talk_to_npc2(GREETING)
+
+        if self.fov is not None:
+            self.fov.update(self.player_tile())
+
+        self.prefetch_greetings()
+
+        # Todos los enemigos avanzan a la vez siguiendo el mismo campo de distancias
+        self.enemies.update(self.player_pos)
+
+        # Actualizar animación
+        if moving:
+            if current_time - self.animation_timer > ANIMATION_SPEED:
+                self.animation_frame = (self.animation_frame + 1) % len(self.player_animations[self.player_direction])
+                self.animation_timer = current_time
+        else:
+            self.animation_frame = 1
 
-    #print(f"Conversation: {conversation}")
-    #print(f"Fragmento: {fragment}")
-    #print(f"Book name: {book_name}")
+    def draw_map(self):
+        self.camera.follow(self.player_pos[0], self.player_pos[1], TILE_SIZE)
 
-    system_message = SYSTEM_TEMPLATE_NPC1.format(conversation=conversation, fragment=fragment, book_name=book_name)
+        # Dibujamos los chunks visibles del mapa (cubren toda la ventana, no hace falta limpiar el fondo)
+        # El cofre solo aparece cuando Jayce recuerda el libro
+        blits = self.map_renderer.draw(self.screen, {'W'} if self.book_remembered else (), self.camera.offset)
 
-    #print(f"System message: {system_message}")
-        
-    try:
-        response: JayceResponse = await llm_structured.ainvoke([system_message])
-        print(f"Response: {response}")
-        messages.append(f"Jayce: {response.response}")
-        if response.book_remembered:
-            BOOK_REMEMBERED = True
-    except Exception as e:
-        print(f"Error: {e}")
-        # Si algo falla, damos una respuesta segura
-        messages.append("Jayce: Mmm... ¿qué me decías? Estaba pensando en el libro...")
+        # Dibujamos los enemigos que caen dentro de la vista (y del campo de visión)
+        offset_x, offset_y = self.camera.offset
+        half = TILE_SIZE // 2
+        for x, y in self.enemies.visible(self.camera.view_rect):
+            if self.fov is None or self.fov.is_visible((x + half) // TILE_SIZE, (y + half) // TILE_SIZE):
+                self.screen.blit(self.enemy_sprite, (x - offset_x, y - offset_y))
+                blits += 1
 
-def load_tileset(path, tile_width, tile_height):
-    sheet = pygame.image.load(path).convert_alpha()
-    sheet_rect = sheet.get_rect()
-    
-    # Calculamos filas y columnas basándonos en el tamaño original del tile
-    rows = sheet_rect.height // tile_height
-    cols = sheet_rect.width // tile_width
-    
-    tiles = []
-    for row in range(rows):
-        row_tiles = []
-        for col in range(cols):
-            # Cortamos el tile usando las dimensiones originales
-            rect = pygame.Rect(col * tile_width, row * tile_height, tile_width, tile_height)
-            image = sheet.subsurface(rect).convert_alpha()
-            # Escalamos el tile individual a TILE_SIZE
-            if tile_width != TILE_SIZE or tile_height != TILE_SIZE:
-                image = pygame.transform.scale(image, (TILE_SIZE, TILE_SIZE))
-            row_tiles.append(image)
-        tiles.append(row_tiles)
-
-    return tiles
-
-def check_collision(level_data, x, y, tile_size, object_type):
+        # Oscuridad de lo no visible, en un solo blit desde la caché
+        if self.darkness is not None:
+            self.darkness.draw(self.screen, self.camera.offset)
+            blits += 1
+
+        # Dibujamos al jugador
+        current_frame = self.player_animations[self.player_direction][self.animation_frame]
+        self.screen.blit(current_frame, self.camera.to_screen(self.player_pos))
+        self.frame_blits = blits + 1
+
+    def draw_chat(self):
+        screen = self.screen
+
+        # Fondo del chat
+        chat_surface = pygame.Surface((self.screen_width, CHAT_HEIGHT))
+        chat_surface.fill((0, 0, 0))
+        chat_surface.set_alpha(180)
+        screen.blit(chat_surface, (0, self.screen_height - CHAT_HEIGHT))
+
+        # Actualizamos solo la maquetación de los mensajes nuevos o modificados
+        messages = self.messages_npc1 if self.npc_type == '1' else self.messages_npc2
+        chat_layout = self.chat_layouts[self.npc_type]
+        chat_layout.sync(messages)
+        total_lines = self.total_lines = chat_layout.lines
+
+        # Detectar nuevos mensajes para autoscroll
+        if len(messages) > self.last_message_count:
+            self.scroll_offset = 0  # Reset al fondo
+            self.last_message_count = len(messages)
+
+        # Autoscroll si está activado y hay suficientes líneas
+        if self.should_autoscroll and len(total_lines) > MAX_VISIBLE_LINES:
+            self.scroll_offset = len(total_lines) - MAX_VISIBLE_LINES
+
+        # Asegurar que el scroll_offset es válido
+        if len(total_lines) > MAX_VISIBLE_LINES:
+            self.scroll_offset = max(0, min(self.scroll_offset, len(total_lines) - MAX_VISIBLE_LINES))
+        else:
+            self.scroll_offset = 0
+
+        # Área de mensajes (con margen para el scrollbar)
+        messages_rect = pygame.Rect(
+            CHAT_MARGIN,
+            self.screen_height - CHAT_HEIGHT + CHAT_MARGIN,
+            self.screen_width - CHAT_MARGIN * 2 - SCROLLBAR_WIDTH,
+            CHAT_HEIGHT - INPUT_HEIGHT - CHAT_MARGIN
+        )
+
+        # Dibujar los mensajes visibles
+        y_offset = messages_rect.top
+        for line_index in range(self.scroll_offset, min(self.scroll_offset + MAX_VISIBLE_LINES, len(total_lines))):
+            screen.blit(chat_layout.line_surface(line_index), (messages_rect.left, y_offset))
+            y_offset += LINE_HEIGHT
+            self.frame_blits += 1
+
+        # Dibujar scrollbar si hay más líneas que las visibles
+        if len(total_lines) > MAX_VISIBLE_LINES:
+            scrollbar_height = messages_rect.height
+            scroll_thumb_height = max(20, scrollbar_height * (MAX_VISIBLE_LINES / len(total_lines)))
+            scroll_thumb_pos = scrollbar_height * (self.scroll_offset / (len(total_lines) - MAX_VISIBLE_LINES))
+
+            # Fondo del scrollbar
+            scrollbar_rect = pygame.Rect(
+                self.screen_width - SCROLLBAR_WIDTH - CHAT_MARGIN,
+                messages_rect.top,
+                SCROLLBAR_WIDTH,
+                scrollbar_height
+            )
+            pygame.draw.rect(screen, (50, 50, 50), scrollbar_rect)
+
+            # Thumb del scrollbar
+            thumb_rect = pygame.Rect(
+                self.screen_width - SCROLLBAR_WIDTH - CHAT_MARGIN,
+                messages_rect.top + scroll_thumb_pos,
+                SCROLLBAR_WIDTH,
+                scroll_thumb_height
+            )
+            pygame.draw.rect(screen, (150, 150, 150), thumb_rect)
+
+        # Área de input (con fondo más oscuro para distinguirla)
+        input_rect = pygame.Rect(
+            CHAT_MARGIN,
+            self.screen_height - INPUT_HEIGHT - CHAT_MARGIN,
+            self.screen_width - CHAT_MARGIN * 2,
+            INPUT_HEIGHT
+        )
+        pygame.draw.rect(screen, (30, 30, 30), input_rect)
+
+        # Texto del input
+        input_text = self.font.render(f"> {self.chat_text}", True, TEXT_COLOR)
+        screen.blit(input_text, (
+            input_rect.left + 5,
+            input_rect.top + (input_rect.height - self.font.get_height()) // 2
+        ))
+        # Fondo y texto del input
+        self.frame_blits += 2
+
+    def hud_stats(self):
+        """
+        Estadísticas del juego para el overlay de rendimiento
+        """
+        hits = sum(layout.cache_hits for layout in self.chat_layouts.values())
+        misses = sum(layout.cache_misses for layout in self.chat_layouts.values())
+        stats = {
+            'blits': self.frame_blits,
+            'caché del chat': f"{hits / (hits + misses):.0%} ({hits}/{hits + misses})" if hits + misses else "-",
+            'tareas de NPCs': self.dialogue_scheduler.in_flight(),
+            'chunks del mapa': self.map_renderer.chunks_built,
+            'campos de flujo': self.enemies.fields_built,
+            'atlas': f"{'caché' if self.atlas.loaded_from_cache else 'construido'}, {self.atlas.lazy_loads} sprites sueltos"
+        }
+        if self.darkness is not None:
+            stats['tiles de niebla'] = self.darkness.tiles_filled
+        for npc, name in NPC_NAMES.items():
+            channel = self.dialogue_scheduler.channels.get(npc)
+            prefetch = self.greetings.entries.get(npc)
+            pending = (int(channel.busy) + channel.queue_depth) if channel else 0
+            latency = f"{channel.latencies[-1] * 1000:.0f} ms" if channel and channel.latencies else "-"
+            speculative = " + saludo" if prefetch is not None and not prefetch.done else ""
+            stats[name] = f"{pending} pendientes{speculative}, última respuesta {latency}"
+            # La sesión remota resume en el servicio; solo la local tiene la memoria aquí
+            memory = getattr(self.dialogue, 'memories', {}).get(npc)
+            if memory is not None:
+                stats[name] += f", {memory.updates} resúmenes ({memory.failures} fallidos)"
+        return stats
+
+    def draw_hud(self):
+        self.perf_hud.draw(self.screen, self.clock(), self.hud_stats)
+
+    def draw_game_over(self):
+        # Fondo negro semi-transparente
+        overlay = pygame.Surface((self.screen_width, self.screen_height))
+        overlay.fill((0, 0, 0))
+        overlay.set_alpha(180)
+        self.screen.blit(overlay, (0, 0))
+
+        # Texto de victoria
+        victory_text = "¡Enhorabuena, has ayudado a Jayce a recordar el libro!"
+        text_surface = self.font_large.render(victory_text, True, (255, 255, 255))
+        text_rect = text_surface.get_rect(center=(self.screen_width/2, self.screen_height/2))
+        self.screen.blit(text_surface, text_rect)
+
+
+def init_dialogue(timings=None):
     """
-    Verifica colisiones en las cuatro esquinas del sprite del jugador
-    Retorna True si hay colisión con una pared
+    Modelos, vector store, índice de fragmentos y engine de diálogo.
+    Importa el stack de IA, así que es lo más lento del arranque
     """
-    # Añadimos un pequeño margen para hacer la colisión más permisiva
-    margin = 10
-    
-    # Ajustamos las coordenadas con el margen
-    check_x = x + margin
-    check_y = y + margin
-    check_size = tile_size - (margin * 2)
-
-    # Convertimos las coordenadas de píxeles a coordenadas de tile
-    tile_positions = [
-        (check_x // tile_size, check_y // tile_size),                          # Esquina superior izquierda
-        ((check_x + check_size - 1) // tile_size, check_y // tile_size),       # Esquina superior derecha
-        (check_x // tile_size, (check_y + check_size - 1) // tile_size),       # Esquina inferior izquierda
-        ((check_x + check_size - 1) // tile_size, (check_y + check_size - 1) // tile_size)  # Esquina inferior derecha
-    ]
-    
-    # Verificamos cada esquina
-    for tile_x, tile_y in tile_positions:
-        # Verificamos que las coordenadas estén dentro de los límites del mapa
-        if (0 <= tile_x < len(level_data[0]) and 
-            0 <= tile_y < len(level_data) and 
-            level_data[tile_y][tile_x] == object_type):
-            return True
-    
-    return False
+    timings = timings or StartupTimings()
+    with timings.phase("importar stack de IA"):
+        from dialogue_engine import DialogueEngine
+    with timings.phase("embeddings"):
+        embeddings = init_embeddings()
+    with timings.phase("llm"):
+        llm = init_llm()
+    with timings.phase("vector store e ingesta"):
+        vectorstore, fragment_index = init_vectorstore(embeddings)
+    with timings.phase("engine de diálogo"):
+        response_cache = ResponseCache(
+            embeddings=embeddings if RESPONSE_CACHE_SEMANTIC else None,
+            path=RESPONSE_CACHE_PATH
+        )
+        # Los runnables de los NPCs se construyen una vez y se reutilizan en cada turno
+        engine = DialogueEngine(llm, vectorstore, fragment_index, response_cache=response_cache)
+    return engine, fragment_index
 
 
-def wrap_text(text, font, max_width):
+async def load_dialogue(game, timings):
     """
-    Divide el texto en líneas que no excedan max_width
+    Carga el motor de diálogo en un hilo aparte y lo conecta al juego al
+    terminar. El hilo es daemon para que cerrar la ventana no espere a la carga
     """
-    words = text.split(' ')
-    lines = []
-    current_line = []
-    current_width = 0
-
-    for word in words:
-        word_surface = font.render(word + ' ', True, TEXT_COLOR)
-        word_width = word_surface.get_width()
-
-        if current_width + word_width <= max_width:
-            current_line.append(word)
-            current_width += word_width
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def run():
+        try:
+            result = init_dialogue(timings)
+        except Exception as e:
+            loop.call_soon_threadsafe(future.set_exception, e)
         else:
-            lines.append(' '.join(current_line))
-            current_line = [word]
-            current_width = word_width
+            loop.call_soon_threadsafe(future.set_result, result)
+
+    threading.Thread(target=run, name="dialogue-init", daemon=True).start()
+    try:
+        engine, fragment_index = await future
+    except Exception as e:
+        print(f"Error cargando el motor de diálogo: {e}")
+        game.dialogue_failed(e)
+        return
+
+    game.set_dialogue(engine, fragment_index)
+    timings.mark("diálogo listo")
+    timings.report()
+
+
+async def connect_dialogue_service(game, client, timings):
+    """
+    Abre una sesión en el servicio de diálogo en lugar de cargar el stack de IA en el juego
+    """
+    try:
+        session = await client.create_session()
+    except Exception as e:
+        print(f"Error conectando con el servicio de diálogo ({DIALOGUE_SERVICE_URL}): {e}")
+        game.dialogue_failed(e)
+        return
+
+    game.set_remote_dialogue(session)
+    timings.mark("diálogo listo (servicio)")
+    timings.report()
 
-    if current_line:
-        lines.append(' '.join(current_line))
-    
-    return lines
 
 async def main():
-    pygame.init()
+    timings = StartupTimings()
+    if TELEMETRY_EXPORTER != 'none':
+        with timings.phase("telemetría"):
+            telemetry.configure(TELEMETRY_EXPORTER, path=TELEMETRY_FILE)
 
-    game_over = False
-    font_large = pygame.font.Font(None, 64)  # Fuente más grande para el mensaje final
+    with timings.phase("pygame"):
+        pygame.init()
 
     # Cargamos el nivel
-    level_data = load_map('level.txt')
-    rows = len(level_data)
-    cols = len(level_data[0]) if rows > 0 else 0
+    with timings.phase("nivel"):
+        level_data = load_level()
 
     # Creamos la ventana
-    screen_width = cols * TILE_SIZE
-    screen_height = rows * TILE_SIZE
-    screen = pygame.display.set_mode((screen_width, screen_height))
-    pygame.display.set_caption("Mi Primer Mapa Tileado")
-
-    # Cargamos los tilesets
-    player = load_tileset('assets/Player.png', 48, 48)
-    enemies = load_tileset('assets/Enemies.png', 32, 32)
-    floor = load_tileset('assets/Sand.png', 32, 32)
-    wall = load_tileset('assets/Wall2.png', 32, 32)
-    npcs = load_tileset('assets/Npcs4.png', 96, 96)
-    items = load_tileset('assets/Items.png', 32, 32)
-
-    embeddings = init_embeddings()
-    llm = init_llm()
-    vectorstore = init_vectorstore(embeddings)
-
-    # Variables del jugador
-    player_pos = None
-    player_direction = 'right'
-    animation_frame = 0
-    animation_timer = 0
-    ANIMATION_SPEED = 100
-    PLAYER_SPEED = 5
-
-    last_npc_interaction_time = 0
-    NPC_INTERACTION_COOLDOWN = 2000  # 2 segundos en milisegundos
-
-    # Configuración de fuentes y chat
-    font = pygame.font.Font(None, 32)
-    chat_active = False
-    chat_text = ""
-    messages_npc1 = []
-    messages_npc2 = []
-    TEXT_COLOR = (255, 255, 255)
-    CHAT_HEIGHT = 200
-    CHAT_MARGIN = 20
-    LINE_HEIGHT = 30
-    INPUT_HEIGHT = 40
-    SCROLLBAR_WIDTH = 20
-    MAX_VISIBLE_LINES = (CHAT_HEIGHT - INPUT_HEIGHT - CHAT_MARGIN) // LINE_HEIGHT
-    scroll_offset = 0
-    dragging_scrollbar = False
-    last_message_count = 0  # Para detectar nuevos mensajes
-    should_autoscroll = True  # Nueva variable para controlar el autoscroll
-
-    # Variables para el estado del diálogo
-    npc_type = None
-
-    npc1_book = load_random_book()
-
-    # Diccionario de animaciones del jugador
-    player_animations = {
-        'right': [player[2][0], player[2][1], player[2][2]],
-        'left': [player[1][0], player[1][1], player[1][2]],
-        'up': [player[3][0], player[3][1], player[3][2]],
-        'down': [player[0][0], player[0][1], player[0][2]],
-    }
-
-    # Mapeamos símbolos a tiles
-    tile_mapping = {
-        '#': wall[0][0],
-        '.': floor[0][0],
-        'E': enemies[0][0],
-        '1': npcs[0][1],
-        '2': npcs[4][1],
-        'W': items[0][12]
-    }
+    with timings.phase("ventana"):
+        screen = pygame.display.set_mode(window_size(level_data))
+        pygame.display.set_caption("Mi Primer Mapa Tileado")
+
+    scheduler = FrameScheduler(FPS, FIXED_UPDATE_HZ)
+    # PLAYER_SPEED está expresado en píxeles por frame a FPS; con paso fijo se reescala
+    step_speed = PLAYER_SPEED * FPS * scheduler.update_dt
+    with timings.phase("juego"):
+        game = Game(screen, level_data, step_speed=step_speed)
+
+    # El mapa ya es jugable; el stack de IA se carga mientras tanto (o se conecta al servicio)
+    dialogue_client = None
+    if DIALOGUE_SERVICE_URL:
+        from dialogue_client import DialogueClient
+        dialogue_client = DialogueClient(DIALOGUE_SERVICE_URL)
+        dialogue_task = asyncio.create_task(connect_dialogue_service(game, dialogue_client, timings))
+    else:
+        dialogue_task = asyncio.create_task(load_dialogue(game, timings))
+    first_frame = True
 
-    # Encontrar la posición inicial del jugador
-    for row_index, row in enumerate(level_data):
-        for col_index, tile_char in enumerate(row):
-            if tile_char == 'P':
-                player_pos = [col_index * TILE_SIZE, row_index * TILE_SIZE]
-                break
+    while game.running:
+        update_steps = scheduler.begin_frame()
+        current_time = game.clock()
+        frame_start = time.perf_counter()
 
-    clock = pygame.time.Clock()
-    running = True
-    
-    while running:
-        current_time = pygame.time.get_ticks()
-               
         # Manejo de eventos
         for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-
-            # Si el juego ha terminado, solo procesar el evento de salida
-            if game_over:
-                continue
-
-            # Manejo de eventos del chat
-            if chat_active:
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    if event.button == 1:  # Clic izquierdo
-                        mouse_pos = pygame.mouse.get_pos()
-                        scrollbar_rect = pygame.Rect(
-                            screen_width - SCROLLBAR_WIDTH - CHAT_MARGIN,
-                            screen_height - CHAT_HEIGHT + CHAT_MARGIN,
-                            SCROLLBAR_WIDTH,
-                            CHAT_HEIGHT - INPUT_HEIGHT - CHAT_MARGIN
-                        )
-                        if scrollbar_rect.collidepoint(mouse_pos):
-                            dragging_scrollbar = True
-                            should_autoscroll = False  # Desactivamos autoscroll al usar scrollbar
-
-                elif event.type == pygame.MOUSEBUTTONUP:
-                    if event.button == 1:
-                        dragging_scrollbar = False
-
-                elif event.type == pygame.MOUSEMOTION:
-                    if dragging_scrollbar:
-                        # Calcular la nueva posición del scroll basada en la posición del ratón
-                        mouse_y = event.pos[1]
-                        scrollbar_top = screen_height - CHAT_HEIGHT + CHAT_MARGIN
-                        scrollbar_height = CHAT_HEIGHT - INPUT_HEIGHT - CHAT_MARGIN
-                        relative_y = mouse_y - scrollbar_top
-                        
-                        # Convertir la posición del ratón a índice de scroll
-                        if len(total_lines) > MAX_VISIBLE_LINES:
-                            scroll_ratio = relative_y / scrollbar_height
-                            scroll_offset = int(scroll_ratio * (len(total_lines) - MAX_VISIBLE_LINES))
-                            scroll_offset = max(0, min(scroll_offset, len(total_lines) - MAX_VISIBLE_LINES))
-
-                elif event.type == pygame.MOUSEWHEEL:
-                    should_autoscroll = False  # Desactivamos autoscroll al usar la rueda
-                    if event.y > 0:  # Scroll arriba
-                        scroll_offset = max(0, scroll_offset - 1)
-                    else:  # Scroll abajo
-                        if len(total_lines) > MAX_VISIBLE_LINES:
-                            scroll_offset = min(scroll_offset + 1, len(total_lines) - MAX_VISIBLE_LINES)
-                
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_RETURN:  # Enviar mensaje
-                        if chat_text.strip():  # Si el mensaje no está vacío
-                            # Añadimos el mensaje del jugador
-                            if npc_type == '1':  # Si estamos hablando con NPC1
-                                messages_npc1.append(f"Jugador: {chat_text}")
-                                # Creamos la tarea asíncrona y esperamos su resultado
-                                task = asyncio.create_task(get_npc1_response(messages_npc1, vectorstore, llm, npc1_book['name']))
-                                # Cuando la tarea termine, activamos el autoscroll
-                                task.add_done_callback(lambda _: setattr(sys.modules[__name__], 'should_autoscroll', True))
-                            elif npc_type == '2':  # Si estamos hablando con NPC2
-                                messages_npc2.append(f"Jugador: {chat_text}")
-                                # Creamos la tarea asíncrona y esperamos su resultado
-                                task = asyncio.create_task(get_npc2_response(messages_npc2, vectorstore, llm))
-                                # Cuando la tarea termine, activamos el autoscroll
-                                task.add_done_callback(lambda _: setattr(sys.modules[__name__], 'should_autoscroll', True))
-                            chat_text = ""
-                            should_autoscroll = True  # Activamos autoscroll al enviar mensaje
-                    elif event.key == pygame.K_ESCAPE:  # Cerrar chat
-                        chat_active = False
-                        chat_text = ""
-                        npc_type = None
-                        last_npc_interaction_time = pygame.time.get_ticks()  # Actualizar el tiempo al cerrar el chat
-                        continue
-                    elif event.key == pygame.K_BACKSPACE:  # Borrar
-                        chat_text = chat_text[:-1]
-                    else:
-                        # Añadir caracteres al mensaje (limitado a 50 caracteres)
-                        if event.unicode.isprintable() and len(chat_text) < 200:
-                            chat_text += event.unicode
-
-        # Dar tiempo al bucle de eventos para procesar tareas asíncronas
-        await asyncio.sleep(0)
+            game.handle_event(event)
+        t_events = time.perf_counter()
 
         # Si el juego ha terminado, mostrar la pantalla de fin
-        if game_over:
-            # Fondo negro semi-transparente
-            overlay = pygame.Surface((screen_width, screen_height))
-            overlay.fill((0, 0, 0))
-            overlay.set_alpha(180)
-            screen.blit(overlay, (0, 0))
-            
-            # Texto de victoria
-            victory_text = "¡Enhorabuena, has ayudado a Jayce a recordar el libro!"
-            text_surface = font_large.render(victory_text, True, (255, 255, 255))
-            text_rect = text_surface.get_rect(center=(screen_width/2, screen_height/2))
-            screen.blit(text_surface, text_rect)
-            
+        if game.game_over:
+            game.draw_game_over()
             pygame.display.flip()
+            await scheduler.end_frame()
             continue
-        
-        # Solo procesamos movimiento si no estamos en chat
-        if not chat_active:
-            # Manejo del movimiento
-            keys = pygame.key.get_pressed()
-            moving = False
-            new_pos = player_pos.copy()
-
-            if keys[pygame.K_LEFT]:
-                new_pos[0] -= PLAYER_SPEED
-                player_direction = 'left'
-                moving = True
-            elif keys[pygame.K_RIGHT]:
-                new_pos[0] += PLAYER_SPEED
-                player_direction = 'right'
-                moving = True
-            elif keys[pygame.K_UP]:
-                new_pos[1] -= PLAYER_SPEED
-                player_direction = 'up'
-                moving = True
-            elif keys[pygame.K_DOWN]:
-                new_pos[1] += PLAYER_SPEED
-                player_direction = 'down'
-                moving = True
-
-            # Verificar colisiones y actualizar posición
-            new_pos[0] = max(0, min(new_pos[0], screen_width - TILE_SIZE))
-            new_pos[1] = max(0, min(new_pos[1], screen_height - TILE_SIZE))
-
-            if not check_collision(level_data, new_pos[0], new_pos[1], TILE_SIZE, '#'):
-                player_pos = new_pos
-
-                # Check collision with the item
-                if check_collision(level_data, player_pos[0], player_pos[1], TILE_SIZE, 'W'):
-                    game_over = True
-
-                # Verificar colisión con NPCs solo si ha pasado suficiente tiempo
-                elif current_time - last_npc_interaction_time >= NPC_INTERACTION_COOLDOWN:
-                    npc1_collision = check_collision(level_data, player_pos[0], player_pos[1], TILE_SIZE, '1')
-                    npc2_collision = check_collision(level_data, player_pos[0], player_pos[1], TILE_SIZE, '2')
-                    if npc1_collision:
-                        chat_active = True
-                        npc_type = '1'  # Marcamos que estamos hablando con NPC1
-                        asyncio.create_task(get_npc1_response(messages_npc1, vectorstore, llm, npc1_book['name']))
-                    elif npc2_collision:
-                        chat_active = True
-                        npc_type = '2'  # Marcamos que estamos hablando con NPC2
-                        asyncio.create_task(get_npc2_response(messages_npc2, vectorstore, llm))
-
-                
-
-            # Actualizar animación
-            if moving:
-                if current_time - animation_timer > ANIMATION_SPEED:
-                    animation_frame = (animation_frame + 1) % len(player_animations[player_direction])
-                    animation_timer = current_time
-            else:
-                animation_frame = 1
-
-        # Pintamos el fondo
-        screen.fill((135, 206, 235))
-
-        # Dibujamos todo el mapa y entidades en un solo bucle
-        for row_index, row in enumerate(level_data):
-            for col_index, tile_char in enumerate(row):
-                x = col_index * TILE_SIZE
-                y = row_index * TILE_SIZE
-                
-                # Siempre dibujamos el suelo
-                screen.blit(floor[0][0], (x, y))
-                
-                # Dibujamos paredes y enemigos, pero no el cofre
-                if tile_char in tile_mapping:
-                    if tile_char != 'W' or BOOK_REMEMBERED:
-                        screen.blit(tile_mapping[tile_char], (x, y))
 
-        # Dibujamos al jugador
-        current_frame = player_animations[player_direction][animation_frame]
-        screen.blit(current_frame, player_pos)
+        # Pasos de simulación de este frame (uno por frame salvo con paso fijo)
+        keys = pygame.key.get_pressed()
+        for _ in range(update_steps):
+            # Solo procesamos movimiento si no estamos en chat
+            if game.chat_active or game.game_over:
+                break
+            game.update(keys, current_time)
+        t_update = time.perf_counter()
+
+        game.draw_map()
+        t_map = time.perf_counter()
 
         # Dibujar interfaz de chat si está activo
-        if chat_active:
-            # Fondo del chat
-            chat_surface = pygame.Surface((screen_width, CHAT_HEIGHT))
-            chat_surface.fill((0, 0, 0))
-            chat_surface.set_alpha(180)
-            screen.blit(chat_surface, (0, screen_height - CHAT_HEIGHT))
-
-            # Calcular todas las líneas
-            total_lines = []
-            if npc_type == '1':
-                # Detectar nuevos mensajes para autoscroll
-                if len(messages_npc1) > last_message_count:
-                    scroll_offset = 0  # Reset al fondo
-                    last_message_count = len(messages_npc1)
-
-                for msg in messages_npc1:
-                    wrapped_lines = wrap_text(msg, font, screen_width - CHAT_MARGIN * 3 - SCROLLBAR_WIDTH)
-                    total_lines.extend(wrapped_lines)
-            elif npc_type == '2':
-                # Detectar nuevos mensajes para autoscroll
-                if len(messages_npc2) > last_message_count:
-                    scroll_offset = 0  # Reset al fondo
-                    last_message_count = len(messages_npc2)
-
-                for msg in messages_npc2:
-                    wrapped_lines = wrap_text(msg, font, screen_width - CHAT_MARGIN * 3 - SCROLLBAR_WIDTH)
-                    total_lines.extend(wrapped_lines)
-
-            # Autoscroll si está activado y hay suficientes líneas
-            if should_autoscroll and len(total_lines) > MAX_VISIBLE_LINES:
-                scroll_offset = len(total_lines) - MAX_VISIBLE_LINES
-            
-            # Asegurar que el scroll_offset es válido
-            if len(total_lines) > MAX_VISIBLE_LINES:
-                scroll_offset = max(0, min(scroll_offset, len(total_lines) - MAX_VISIBLE_LINES))
-            else:
-                scroll_offset = 0
-            
-            # Área de mensajes (con margen para el scrollbar)
-            messages_rect = pygame.Rect(
-                CHAT_MARGIN, 
-                screen_height - CHAT_HEIGHT + CHAT_MARGIN,
-                screen_width - CHAT_MARGIN * 2 - SCROLLBAR_WIDTH,
-                CHAT_HEIGHT - INPUT_HEIGHT - CHAT_MARGIN
-            )
+        if game.chat_active:
+            game.draw_chat()
+        t_chat = time.perf_counter()
 
-            # Dibujar los mensajes visibles
-            y_offset = messages_rect.top
-            visible_lines = total_lines[scroll_offset:scroll_offset + MAX_VISIBLE_LINES]
-            for line in visible_lines:
-                text_surface = font.render(line, True, TEXT_COLOR)
-                screen.blit(text_surface, (messages_rect.left, y_offset))
-                y_offset += LINE_HEIGHT
-
-            # Dibujar scrollbar si hay más líneas que las visibles
-            if len(total_lines) > MAX_VISIBLE_LINES:
-                scrollbar_height = messages_rect.height
-                scroll_thumb_height = max(20, scrollbar_height * (MAX_VISIBLE_LINES / len(total_lines)))
-                scroll_thumb_pos = scrollbar_height * (scroll_offset / (len(total_lines) - MAX_VISIBLE_LINES))
-                
-                # Fondo del scrollbar
-                scrollbar_rect = pygame.Rect(
-                    screen_width - SCROLLBAR_WIDTH - CHAT_MARGIN,
-                    messages_rect.top,
-                    SCROLLBAR_WIDTH,
-                    scrollbar_height
-                )
-                pygame.draw.rect(screen, (50, 50, 50), scrollbar_rect)
-                
-                # Thumb del scrollbar
-                thumb_rect = pygame.Rect(
-                    screen_width - SCROLLBAR_WIDTH - CHAT_MARGIN,
-                    messages_rect.top + scroll_thumb_pos,
-                    SCROLLBAR_WIDTH,
-                    scroll_thumb_height
-                )
-                pygame.draw.rect(screen, (150, 150, 150), thumb_rect)
-
-            # Área de input (con fondo más oscuro para distinguirla)
-            input_rect = pygame.Rect(
-                CHAT_MARGIN,
-                screen_height - INPUT_HEIGHT - CHAT_MARGIN,
-                screen_width - CHAT_MARGIN * 2,
-                INPUT_HEIGHT
-            )
-            pygame.draw.rect(screen, (30, 30, 30), input_rect)
-            
-            # Texto del input
-            input_text = font.render(f"> {chat_text}", True, TEXT_COLOR)
-            screen.blit(input_text, (
-                input_rect.left + 5,
-                input_rect.top + (input_rect.height - font.get_height()) // 2
-            ))
+        game.draw_hud()
+        t_hud = time.perf_counter()
 
         pygame.display.flip()
-        clock.tick(60)
+        frame_end = time.perf_counter()
+        telemetry.frame({
+            'events': (t_events - frame_start) * 1000,
+            'update': (t_update - t_events) * 1000,
+            'map': (t_map - t_update) * 1000,
+            'chat': (t_chat - t_map) * 1000,
+            'hud': (t_hud - t_chat) * 1000,
+            'flip': (frame_end - t_hud) * 1000,
+            'frame': (frame_end - frame_start) * 1000
+        }, FRAME_HITCH_MS)
+        if first_frame:
+            timings.mark("primer frame")
+            first_frame = False
+        # Esperamos al siguiente frame sin bloquear las tareas de los NPCs
+        frame_ms = await scheduler.end_frame()
+        game.perf_hud.record_frame(frame_ms, scheduler.work_time * 1000)
+
+    dialogue_task.cancel()
+    game.dialogue_scheduler.cancel_all()
+    game.greetings.cancel_all()
+    print(f"Peticiones de diálogo: {game.dialogue_scheduler.stats()}")
+    print(f"Saludos anticipados: {game.greetings.stats()}")
+    if game.engine is not None:
+        game.engine.response_cache.save()
+        print(f"Caché de respuestas: {game.engine.response_cache.stats()}")
+    if game.dialogue is not None:
+        await game.dialogue.close()
+    if dialogue_client is not None:
+        await dialogue_client.aclose()
+    telemetry.shutdown()
 
     pygame.quit()
     sys.exit()
@@ -0,0 +1,86 @@
+"""
+Micro-benchmark de un turno de diálogo completo sin red.
+
+Cada turno hace lo mismo en los dos casos: una consulta de Ekko por la
+cadena RetrievalQA (retriever sobre un vector store en memoria) y una
+respuesta estructurada de Jayce, con ainvoke sobre el modelo offline sin
+latencia simulada. La diferencia es de dónde salen los runnables:
+
+- Antes: se reconstruyen en cada turno (retriever, RetrievalQA y salida
+  estructurada).
+- Después: los de DialogueEngine, construidos una vez.
+
+    python benchmarks/bench_dialogue_engine.py [turnos]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.chains.retrieval_qa.base import RetrievalQA
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.vectorstores import InMemoryVectorStore
+
+from JayceResponse import JayceResponse
+from dialogue_engine import DialogueEngine
+from fragment_index import FragmentIndex
+from offline_backends import ScriptedChatModel
+
+EKKO_QUERY = "Jugador: ¿Conoces algún libro sobre un bosque que susurra?"
+JAYCE_PROMPT = (
+    "<conversation>Jugador: Hola, ¿qué tal?</conversation>"
+    "<fragment>Las hojas hablaban en voz baja.</fragment>"
+    "<book_name>El Susurro del Bosque</book_name>"
+)
+
+
+def rebuild_per_turn(llm, vectorstore):
+    retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
+    qa_chain = RetrievalQA.from_chain_type(llm=llm, chain_type="stuff", retriever=retriever)
+    llm_structured = llm.with_structured_output(JayceResponse.model_json_schema())
+    return qa_chain, llm_structured
+
+
+def reuse_engine(engine):
+    return engine.ekko_qa_chain, engine.jayce_structured
+
+
+async def turn(runnables):
+    qa_chain, llm_structured = runnables()
+    await qa_chain.ainvoke({"query": EKKO_QUERY})
+    await llm_structured.ainvoke([JAYCE_PROMPT])
+
+
+async def measure(runnables, turns):
+    await turn(runnables)  # Calentamiento
+    start = time.perf_counter()
+    for _ in range(turns):
+        await turn(runnables)
+    return (time.perf_counter() - start) / turns
+
+
+async def main():
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    llm = ScriptedChatModel(latency=0, jitter=0, token_delay=0)
+    vectorstore = InMemoryVectorStore(DeterministicFakeEmbedding(size=64))
+    vectorstore.add_texts([f"Fragmento {i} de uno de los libros." for i in range(200)])
+
+    engine_start = time.perf_counter()
+    engine = DialogueEngine(llm, vectorstore, FragmentIndex())
+    engine_setup = time.perf_counter() - engine_start
+
+    before = await measure(lambda: rebuild_per_turn(llm, vectorstore), turns)
+    after = await measure(lambda: reuse_engine(engine), turns)
+
+    print(f"Turnos medidos:              {turns}")
+    print(f"Construcción del engine:     {engine_setup * 1e3:.3f} ms (una vez)")
+    print(f"Antes (reconstruir/turno):   {before * 1e3:.3f} ms por turno")
+    print(f"Después (reutilizar):        {after * 1e3:.3f} ms por turno")
+    print(f"Ahorro por turno:            {(before - after) * 1e3:.3f} ms ({(before - after) / before:.0%})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,36 @@
+"""
+Tiempo de generación de mazmorras según el tamaño del mapa.
+
+    python benchmarks/bench_dungeon_generator.py [repeticiones]
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dungeon_generator import generate_dungeon
+
+SIZES = [(34, 13), (64, 64), (128, 128), (256, 256), (512, 512), (1024, 1024)]
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    print(f"{'mapa':>10}{'tiles':>10}{'mediana':>12}{'mínimo':>12}{'µs/tile':>10}")
+    for cols, rows in SIZES:
+        times = []
+        for seed in range(repeats):
+            start = time.perf_counter()
+            generate_dungeon(cols, rows, seed=seed)
+            times.append(time.perf_counter() - start)
+        median = statistics.median(times)
+        print(
+            f"{f'{cols}x{rows}':>10}{cols * rows:>10}{median * 1e3:>10.2f}ms{min(times) * 1e3:>10.2f}ms"
+            f"{median * 1e6 / (cols * rows):>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
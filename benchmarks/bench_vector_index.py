@@ -0,0 +1,153 @@
+"""
+Latencia de consulta y memoria de NumpyVectorIndex frente a Chroma según
+crece el corpus. Usa vectores aleatorios (sin red ni embeddings reales).
+La ingesta y las consultas de cada backend y tamaño van en procesos
+aparte, así la memoria medida es la de abrir el índice ya persistido
+(incluida la importación del backend, que también cuenta en "abrir").
+
+    python benchmarks/bench_vector_index.py [libros ...]
+"""
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import psutil
+from langchain_core.embeddings import Embeddings
+
+BOOKS = [10, 100, 1000, 2000]
+CHUNKS_PER_BOOK = 20
+DIMENSIONS = 256
+QUERIES = 200
+BATCH = 64
+K = 3
+
+
+class PrecomputedEmbeddings(Embeddings):
+    """
+    Devuelve vectores ya calculados, para que solo se mida el vector store
+    """
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed_documents(self, texts):
+        return [self.vectors[text] for text in texts]
+
+    def embed_query(self, text):
+        return self.vectors[text]
+
+
+def rss_mb():
+    return psutil.Process().memory_info().rss / 2 ** 20
+
+
+def open_store(backend, embeddings, directory):
+    if backend == 'numpy':
+        from numpy_vector_index import NumpyVectorIndex
+        return NumpyVectorIndex(embeddings, directory)
+
+    from app import use_pysqlite3
+    use_pysqlite3()
+    from langchain_chroma import Chroma
+    return Chroma(embedding_function=embeddings, collection_name="books", persist_directory=directory)
+
+
+def corpus(books):
+    rng = np.random.default_rng(0)
+    count = books * CHUNKS_PER_BOOK
+    vectors = rng.standard_normal((count, DIMENSIONS)).astype(np.float32)
+    texts = [f"chunk-{i}" for i in range(count)]
+    metadatas = [{'book': f"libro-{i // CHUNKS_PER_BOOK}"} for i in range(count)]
+    queries = rng.standard_normal((QUERIES, DIMENSIONS)).astype(np.float32).tolist()
+    return vectors, texts, metadatas, queries
+
+
+def build(backend, books, directory):
+    vectors, texts, metadatas, _ = corpus(books)
+    start = time.perf_counter()
+    store = open_store(backend, PrecomputedEmbeddings(dict(zip(texts, vectors.tolist()))), directory)
+    # Lotes por debajo del máximo que admite Chroma en una sola llamada
+    for i in range(0, len(texts), 5000):
+        store.add_texts(texts[i:i + 5000], metadatas[i:i + 5000], ids=texts[i:i + 5000])
+    if hasattr(store, 'persist'):
+        store.persist()
+    return {'build_s': time.perf_counter() - start}
+
+
+def query(backend, books, directory):
+    _, _, _, queries = corpus(books)
+    gc.collect()
+
+    baseline = rss_mb()
+    start = time.perf_counter()
+    store = open_store(backend, None, directory)
+    store.similarity_search_by_vector(queries[0], k=K)
+    open_time = time.perf_counter() - start
+
+    latencies = []
+    filtered = []
+    for i, vector in enumerate(queries):
+        start = time.perf_counter()
+        store.similarity_search_by_vector(vector, k=K)
+        latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        store.similarity_search_by_vector(vector, k=K, filter={'book': f"libro-{i % books}"})
+        filtered.append(time.perf_counter() - start)
+    memory = rss_mb() - baseline
+
+    batch = None
+    if backend == 'numpy':
+        start = time.perf_counter()
+        store.search_by_vectors(queries[:BATCH], k=K)
+        batch = (time.perf_counter() - start) / BATCH
+
+    return {
+        'open_ms': open_time * 1e3,
+        'p50_ms': float(np.percentile(latencies, 50)) * 1e3,
+        'p95_ms': float(np.percentile(latencies, 95)) * 1e3,
+        'filtered_p50_ms': float(np.percentile(filtered, 50)) * 1e3,
+        'batch_ms': batch * 1e3 if batch is not None else None,
+        'memory_mb': memory
+    }
+
+
+def run_worker(mode, backend, books, directory):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker', mode, backend, str(books), directory],
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        mode, backend, books, directory = sys.argv[2:6]
+        print(json.dumps((build if mode == 'build' else query)(backend, int(books), directory)))
+        return
+
+    sizes = [int(arg) for arg in sys.argv[1:]] or BOOKS
+    print(f"{CHUNKS_PER_BOOK} chunks por libro, {DIMENSIONS} dimensiones, k={K}")
+    print(f"{'backend':<8}{'libros':>8}{'chunks':>9}{'ingesta':>10}{'abrir':>10}{'p50':>9}{'p95':>9}"
+          f"{'p50 libro':>11}{'lote/q':>9}{'memoria':>10}")
+    for books in sizes:
+        for backend in ('numpy', 'chroma'):
+            with tempfile.TemporaryDirectory() as directory:
+                r = run_worker('build', backend, books, directory)
+                r.update(run_worker('query', backend, books, directory))
+            batch = f"{r['batch_ms']:.3f}" if r['batch_ms'] is not None else "-"
+            print(
+                f"{backend:<8}{books:>8}{books * CHUNKS_PER_BOOK:>9}{r['build_s']:>9.2f}s{r['open_ms']:>8.1f}ms"
+                f"{r['p50_ms']:>9.3f}{r['p95_ms']:>9.3f}{r['filtered_p50_ms']:>11.3f}{batch:>9}{r['memory_mb']:>8.1f}MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
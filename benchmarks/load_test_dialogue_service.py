@@ -0,0 +1,237 @@
+"""
+Prueba de carga del servicio de diálogo: N sesiones simultáneas contra el
+modelo offline (sin red, con la latencia simulada de OFFLINE_LATENCY y
+OFFLINE_TOKEN_DELAY). Cada sesión saluda a Ekko y a Jayce, les escribe unos
+mensajes y al final le dice a Jayce uno de los títulos; el estado de cada
+sesión (si Jayce ha recordado el libro) tiene que ser solo suyo.
+
+Arranca el servicio en un proceso aparte (LLM_BACKEND=offline) salvo que se
+indique --url. Cada sesión es un juego distinto, con su propio DialogueClient
+(y su pool de conexiones keep-alive) o, con --transport ws, su WebSocket.
+
+    python benchmarks/load_test_dialogue_service.py --sessions 50 --turns 4
+    python benchmarks/load_test_dialogue_service.py --sessions 200 --transport ws
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import httpx
+import numpy as np
+import psutil
+
+from dialogue_client import DialogueClient
+
+# Los mismos que app.BOOK_FILES, sin importar el juego
+BOOK_NAMES = ["El Susurro del Bosque", "El Último Archivo"]
+PLAYER_LINES = [
+    "Hola, ¿qué tal?",
+    "¿De qué trata el libro?",
+    "¿Recuerdas algún personaje?",
+    "Habla de un bosque y de un archivo, ¿no?",
+    "¿Cómo empieza la historia?",
+    "Cuéntame otro fragmento"
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def start_service(port, latency, token_delay, timeout=300):
+    env = dict(
+        os.environ,
+        LLM_BACKEND='offline',
+        OFFLINE_LATENCY=str(latency),
+        OFFLINE_TOKEN_DELAY=str(token_delay)
+    )
+    process = subprocess.Popen([sys.executable, 'dialogue_service.py', '--port', str(port)], cwd=ROOT, env=env)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=url) as http:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"El servicio ha terminado al arrancar (código {process.returncode})")
+            try:
+                if (await http.get("/health")).status_code == 200:
+                    return process, url
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("El servicio no ha arrancado a tiempo")
+
+
+class HttpTransport:
+    def __init__(self, client):
+        self.client = client
+
+    async def open(self):
+        self.session = await self.client.create_session()
+        return self.session.session_id
+
+    async def turn(self, npc, messages):
+        async for event in self.session.stream(npc, messages):
+            yield event
+
+    async def close(self):
+        await self.session.close()
+
+
+class WebSocketTransport:
+    def __init__(self, client, url):
+        self.client = client
+        self.url = url.replace('http', 'ws', 1)
+        self.turns = 0
+
+    async def open(self):
+        import websockets
+
+        session = await self.client.create_session()
+        self.session = session
+        self.socket = await websockets.connect(f"{self.url}/sessions/{session.session_id}/ws", max_size=None)
+        return session.session_id
+
+    async def turn(self, npc, messages):
+        # Un turno en curso por sesión: todos los eventos recibidos son de este turno
+        self.turns += 1
+        await self.socket.send(json.dumps({'id': self.turns, 'npc': npc, 'messages': list(messages)}))
+        while True:
+            event = json.loads(await self.socket.recv())
+            yield event
+            if event.get('done'):
+                return
+
+    async def close(self):
+        await self.socket.close()
+        await self.session.close()
+
+
+async def run_session(index, transport, turns, results):
+    """
+    Conversación de una sesión; guarda en results la latencia de cada turno
+    """
+    session_id = await transport.open()
+    # Los nombres de los NPCs los da el servicio al crear la sesión
+    speakers = transport.session.npcs
+    conversations = {npc: [] for npc in speakers}
+    remembered = False
+
+    async def turn(npc, text=None):
+        nonlocal remembered
+        messages = conversations[npc]
+        if text is not None:
+            messages.append(f"Jugador: {text}")
+        started = time.perf_counter()
+        first = None
+        async for event in transport.turn(npc, messages):
+            if first is None:
+                first = time.perf_counter() - started
+            if event.get('done'):
+                if 'error' in event:
+                    results['errors'] += 1
+                    return
+                messages.append(f"{speakers[npc]}: {event['reply']}")
+                remembered = event['book_remembered']
+        results['ttft'].append(first)
+        results['latency'].append(time.perf_counter() - started)
+
+    await turn('2')
+    await turn('1')
+    for i in range(turns):
+        npc = '2' if i % 2 else '1'
+        await turn(npc, PLAYER_LINES[(index + i) % len(PLAYER_LINES)])
+    # Solo acierta la mitad de las sesiones, según el libro que le tocó a su Jayce
+    await turn('1', f"¡Ya sé! El libro es {BOOK_NAMES[index % len(BOOK_NAMES)]}")
+
+    # El estado guardado en el servicio tiene que coincidir con el de los eventos de esta sesión
+    state = (await transport.client.http.get(f"/sessions/{session_id}")).json()
+    if state['book_remembered'] != remembered:
+        results['mismatches'] += 1
+    results['remembered'] += remembered
+    await transport.close()
+
+
+async def load_test(url, sessions, turns, transport_name, ramp):
+    results = {'ttft': [], 'latency': [], 'errors': 0, 'failed_sessions': 0, 'mismatches': 0, 'remembered': 0}
+
+    async def session(index):
+        await asyncio.sleep(ramp * index / sessions)
+        async with DialogueClient(url) as client:
+            transport = WebSocketTransport(client, url) if transport_name == 'ws' else HttpTransport(client)
+            try:
+                await run_session(index, transport, turns, results)
+            except Exception as e:
+                print(f"Sesión {index}: {type(e).__name__}: {e}")
+                results['failed_sessions'] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(i) for i in range(sessions)))
+    results['seconds'] = time.perf_counter() - started
+    async with DialogueClient(url) as client:
+        results['service'] = await client.stats()
+    return results
+
+
+def percentiles(values):
+    if not values:
+        return "-"
+    ms = np.array(values) * 1000
+    return " / ".join(f"{np.percentile(ms, p):.0f}" for p in (50, 95, 99))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del servicio de diálogo")
+    parser.add_argument('--sessions', type=int, default=50)
+    parser.add_argument('--turns', type=int, default=4, help="Mensajes del jugador por sesión, además de saludos y la respuesta final")
+    parser.add_argument('--transport', choices=('http', 'ws'), default='http')
+    parser.add_argument('--ramp', type=float, default=0.0, help="Segundos en los que se reparten los arranques de sesión")
+    parser.add_argument('--url', help="Servicio ya arrancado; sin él se arranca uno offline")
+    parser.add_argument('--latency', type=float, default=0.5, help="Latencia simulada hasta el primer token (s)")
+    parser.add_argument('--token-delay', type=float, default=0.02)
+    args = parser.parse_args()
+
+    process = None
+    url = args.url
+    if url is None:
+        process, url = await start_service(free_port(), args.latency, args.token_delay)
+    try:
+        service = psutil.Process(process.pid) if process else None
+        rss_before = service.memory_info().rss / 2 ** 20 if service else None
+        cpu_before = sum(service.cpu_times()[:2]) if service else None
+        client_cpu = time.process_time()
+        r = await load_test(url, args.sessions, args.turns, args.transport, args.ramp)
+        client_cpu = time.process_time() - client_cpu
+        rss_after = service.memory_info().rss / 2 ** 20 if service else None
+        service_cpu = sum(service.cpu_times()[:2]) - cpu_before if service else None
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    total = len(r['latency'])
+    print(f"{args.sessions} sesiones x {args.turns + 3} turnos por {args.transport} en {r['seconds']:.1f} s")
+    print(f"Turnos completados: {total} ({total / r['seconds']:.1f}/s), errores: {r['errors']}, sesiones fallidas: {r['failed_sessions']}")
+    print(f"Primer evento p50/p95/p99: {percentiles(r['ttft'])} ms")
+    print(f"Turno completo p50/p95/p99: {percentiles(r['latency'])} ms")
+    print(f"Jayce recordó el libro en {r['remembered']} sesiones; estado incoherente en {r['mismatches']}")
+    service = r['service']
+    print(f"Servicio: {service['turns']}, caché de respuestas {service['response_cache']}")
+    if rss_before is not None:
+        print(f"Memoria del servicio: {rss_before:.0f} MB antes de la prueba, {rss_after:.0f} MB después")
+        print(f"CPU: servicio {service_cpu:.1f} s ({service_cpu * 1000 / max(total, 1):.1f} ms por turno), "
+              f"clientes {client_cpu:.1f} s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,33 @@
+class Camera:
+    """
+    Vista del tamaño de la ventana sobre un mapa que puede ser más grande.
+    Sigue a un objetivo (el jugador) centrándolo, sin salirse de los bordes del mapa.
+    """
+
+    def __init__(self, view_width, view_height, world_width, world_height):
+        self.view_width = view_width
+        self.view_height = view_height
+        self.world_width = world_width
+        self.world_height = world_height
+        self.x = 0
+        self.y = 0
+
+    @property
+    def offset(self):
+        return self.x, self.y
+
+    @property
+    def view_rect(self):
+        return self.x, self.y, self.view_width, self.view_height
+
+    def follow(self, target_x, target_y, target_size=0):
+        """
+        Centra la cámara en el objetivo (coordenadas del mundo, en píxeles)
+        """
+        x = target_x + target_size // 2 - self.view_width // 2
+        y = target_y + target_size // 2 - self.view_height // 2
+        self.x = max(0, min(x, self.world_width - self.view_width))
+        self.y = max(0, min(y, self.world_height - self.view_height))
+
+    def to_screen(self, pos):
+        return pos[0] - self.x, pos[1] - self.y
@@ -0,0 +1,224 @@
+import asyncio
+from collections import OrderedDict
+
+
+class ChatLog(list):
+    """
+    Lista de mensajes que recuerda desde qué índice ha cambiado.
+
+    Se usa igual que una lista normal (append, slicing, join...), pero
+    ChatLayout puede re-maquetar solo los mensajes nuevos o modificados.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.dirty_from = 0
+
+    def _mark(self, index):
+        if index < 0:
+            index += len(self)
+        self.dirty_from = max(0, min(self.dirty_from, index))
+
+    def append(self, item):
+        self._mark(len(self))
+        super().append(item)
+
+    def extend(self, items):
+        self._mark(len(self))
+        super().extend(items)
+
+    def __iadd__(self, items):
+        self._mark(len(self))
+        return super().__iadd__(items)
+
+    def __imul__(self, count):
+        self._mark(len(self) if count >= 1 else 0)
+        return super().__imul__(count)
+
+    def insert(self, index, item):
+        self._mark(min(index, len(self)) if index >= 0 else index)
+        super().insert(index, item)
+
+    def pop(self, index=-1):
+        self._mark(index)
+        return super().pop(index)
+
+    def remove(self, item):
+        del self[self.index(item)]
+
+    def clear(self):
+        self.dirty_from = 0
+        super().clear()
+
+    def sort(self, *args, **kwargs):
+        self.dirty_from = 0
+        super().sort(*args, **kwargs)
+
+    def reverse(self):
+        self.dirty_from = 0
+        super().reverse()
+
+    def __setitem__(self, index, value):
+        self._mark(index.start or 0 if isinstance(index, slice) else index)
+        super().__setitem__(index, value)
+
+    def __delitem__(self, index):
+        self._mark(index.start or 0 if isinstance(index, slice) else index)
+        super().__delitem__(index)
+
+
+class StreamingMessage:
+    """
+    Entrada en curso de un NPC dentro de una lista de mensajes.
+
+    La entrada se crea con el primer texto recibido y se va reescribiendo
+    en su sitio a medida que llegan más tokens.
+    """
+
+    def __init__(self, messages, speaker):
+        self.messages = messages
+        self.speaker = speaker
+        self.index = None
+        self.text = ""
+
+    def update(self, text):
+        if not text or text == self.text:
+            return
+        self.text = text
+        if self.index is None:
+            self.messages.append(f"{self.speaker}: {text}")
+            self.index = len(self.messages) - 1
+        else:
+            self.messages[self.index] = f"{self.speaker}: {text}"
+
+    def append(self, delta):
+        self.update(self.text + delta)
+
+    def finish(self, text):
+        """
+        Fija el texto definitivo (también sirve para respuestas de error)
+        """
+        if self.index is None:
+            self.messages.append(f"{self.speaker}: {text}")
+            self.index = len(self.messages) - 1
+        else:
+            self.messages[self.index] = f"{self.speaker}: {text}"
+        self.text = text
+
+    def discard(self):
+        """
+        Quita la entrada del chat (respuesta cancelada a medias)
+        """
+        if self.index is not None:
+            del self.messages[self.index]
+            self.index = None
+        self.text = ""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and issubclass(exc_type, asyncio.CancelledError):
+            self.discard()
+        return False
+
+
+class ChatLayout:
+    """
+    Maquetación incremental de un ChatLog.
+
+    Cada mensaje se divide en líneas una sola vez, cuando se añade o cambia,
+    midiendo las palabras con font.size y una caché LRU de anchos. Las líneas
+    se guardan en un índice plano para el scroll, y las superficies
+    renderizadas de cada línea se guardan en otra caché LRU, de modo que
+    pintar la ventana visible solo cuesta las líneas visibles.
+    """
+
+    def __init__(self, font, max_width, color, surface_cache_size=256, word_cache_size=4096):
+        self.font = font
+        self.max_width = max_width
+        self.color = color
+        self.surface_cache_size = surface_cache_size
+        self.word_cache_size = word_cache_size
+
+        self.lines = []
+        self._message_starts = []  # Índice de la primera línea de cada mensaje
+        self._word_widths = OrderedDict()
+        self._surfaces = OrderedDict()
+
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def measure(self, word):
+        width = self._word_widths.get(word)
+        if width is not None:
+            self._word_widths.move_to_end(word)
+            return width
+
+        width = self.font.size(word + ' ')[0]
+        self._word_widths[word] = width
+        if len(self._word_widths) > self.word_cache_size:
+            self._word_widths.popitem(last=False)
+        return width
+
+    def sync(self, log):
+        """
+        Re-maqueta los mensajes del log a partir del primer índice modificado
+        """
+        start = min(log.dirty_from, len(self._message_starts))
+        if start < len(self._message_starts):
+            del self.lines[self._message_starts[start]:]
+            del self._message_starts[start:]
+
+        for msg in log[start:]:
+            self._message_starts.append(len(self.lines))
+            self.lines.extend(wrap_text(msg, self.font, self.max_width, self.measure))
+
+        log.dirty_from = len(log)
+
+    def line_surface(self, index):
+        """
+        Superficie renderizada de la línea index, servida desde la caché LRU
+        """
+        line = self.lines[index]
+        surface = self._surfaces.get(line)
+        if surface is not None:
+            self._surfaces.move_to_end(line)
+            self.cache_hits += 1
+            return surface
+
+        self.cache_misses += 1
+        surface = self.font.render(line, True, self.color)
+        self._surfaces[line] = surface
+        if len(self._surfaces) > self.surface_cache_size:
+            self._surfaces.popitem(last=False)
+        return surface
+
+
+def wrap_text(text, font, max_width, measure=None):
+    """
+    Divide el texto en líneas que no excedan max_width
+    """
+    if measure is None:
+        measure = lambda word: font.size(word + ' ')[0]
+
+    words = text.split(' ')
+    lines = []
+    current_line = []
+    current_width = 0
+
+    for word in words:
+        word_width = measure(word)
+
+        if current_width + word_width <= max_width:
+            current_line.append(word)
+            current_width += word_width
+        else:
+            lines.append(' '.join(current_line))
+            current_line = [word]
+            current_width = word_width
+
+    if current_line:
+        lines.append(' '.join(current_line))
+
+    return lines
@@ -0,0 +1,143 @@
+from collections import defaultdict, namedtuple
+
+import numpy as np
+
+# Tiles que no son entidades (paredes y suelo van solo en la rejilla)
+STATIC_TILES = frozenset('#.')
+
+Entity = namedtuple('Entity', ['id', 'kind', 'col', 'row', 'rect'])
+
+
+class SpatialHash:
+    """
+    Hash espacial de rectángulos (x, y, w, h) en cubos de cell_size píxeles.
+    Una consulta solo mira los cubos que toca el rectángulo, así que su coste
+    no depende del número total de entidades.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self._buckets = defaultdict(set)
+        self._rects = {}
+
+    def _cells(self, rect):
+        x, y, w, h = rect
+        size = self.cell_size
+        for cy in range(int(y) // size, int(y + h - 1) // size + 1):
+            for cx in range(int(x) // size, int(x + w - 1) // size + 1):
+                yield cx, cy
+
+    def insert(self, item, rect):
+        self._rects[item] = rect
+        for cell in self._cells(rect):
+            self._buckets[cell].add(item)
+
+    def query(self, rect):
+        """
+        Elementos cuyo rectángulo se solapa con rect
+        """
+        x, y, w, h = rect
+        found = set()
+        for cell in self._cells(rect):
+            for item in self._buckets.get(cell, ()):
+                if item in found:
+                    continue
+                ix, iy, iw, ih = self._rects[item]
+                if ix < x + w and x < ix + iw and iy < y + h and y < iy + ih:
+                    found.add(item)
+        return found
+
+    def __len__(self):
+        return len(self._rects)
+
+
+class CollisionGrid:
+    """
+    Nivel compilado al cargarlo: una rejilla de bits (un bit por clase de
+    tile) y un hash espacial con las entidades interactivas (NPCs, objetos,
+    puntos de aparición).
+
+    classes_at() responde con una sola consulta qué clases de tile se solapan
+    con una caja (las paredes); antes hacía falta una comprobación de esquinas
+    por clase. entities_at() da las entidades con las que choca el jugador.
+    """
+
+    def __init__(self, level_data, tile_size, bucket_tiles=4):
+        self.tile_size = tile_size
+        self.rows = len(level_data)
+        self.cols = len(level_data[0]) if self.rows > 0 else 0
+
+        classes = sorted({char for row in level_data for char in row} - {'.'})
+        self.class_bits = {char: 1 << i for i, char in enumerate(classes)}
+        dtype = np.uint8 if len(classes) <= 8 else np.uint16 if len(classes) <= 16 else np.uint32
+
+        chars = np.array([list(row) for row in level_data], dtype='<U1').reshape(self.rows, self.cols)
+        self.bits = np.zeros((self.rows, self.cols), dtype=dtype)
+        for char, bit in self.class_bits.items():
+            self.bits[chars == char] |= bit
+        # Copia en listas para las consultas puntuales, más rápidas que indexar numpy
+        self._rows = self.bits.tolist()
+        self._class_sets = {}
+
+        self.entities = {}
+        self.entities_by_kind = defaultdict(list)
+        self.spatial = SpatialHash(tile_size * bucket_tiles)
+        for row_index, row in enumerate(level_data):
+            for col_index, char in enumerate(row):
+                if char not in STATIC_TILES:
+                    self.add_entity(char, col_index, row_index)
+
+    def class_mask(self, char):
+        """
+        Máscara booleana de una clase de tile a partir de la rejilla compilada
+        """
+        bit = self.class_bits.get(char, 0)
+        return (self.bits & bit) != 0 if bit else np.zeros(self.bits.shape, dtype=bool)
+
+    def add_entity(self, kind, col, row):
+        entity_id = len(self.entities)
+        rect = (col * self.tile_size, row * self.tile_size, self.tile_size, self.tile_size)
+        entity = Entity(entity_id, kind, col, row, rect)
+        self.entities[entity_id] = entity
+        self.entities_by_kind[kind].append(entity)
+        self.spatial.insert(entity_id, rect)
+        return entity
+
+    def spawn(self, kind='P'):
+        """
+        Posición en píxeles de la primera entidad de ese tipo, o None
+        """
+        entities = self.entities_by_kind.get(kind)
+        if not entities:
+            return None
+        return [entities[0].rect[0], entities[0].rect[1]]
+
+    def _classes(self, bits):
+        classes = self._class_sets.get(bits)
+        if classes is None:
+            classes = frozenset(char for char, bit in self.class_bits.items() if bits & bit)
+            self._class_sets[bits] = classes
+        return classes
+
+    def classes_at(self, x, y, w, h):
+        """
+        Conjunto de clases de tile ('#', '1', 'W'...) que se solapan con la caja
+        (x, y, w, h) en píxeles. Las celdas fuera del mapa se ignoran.
+        """
+        size = self.tile_size
+        col0 = max(0, int(x) // size)
+        col1 = min(self.cols - 1, int(x + w - 1) // size)
+        row0 = max(0, int(y) // size)
+        row1 = min(self.rows - 1, int(y + h - 1) // size)
+
+        bits = 0
+        for row in self._rows[row0:row1 + 1]:
+            for col in range(col0, col1 + 1):
+                bits |= row[col]
+        return self._classes(bits)
+
+    def entities_at(self, x, y, w, h):
+        """
+        Entidades interactivas cuya celda se solapa con la caja
+        """
+        return [self.entities[entity_id] for entity_id in self.spatial.query((x, y, w, h))]
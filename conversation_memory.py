@@ -0,0 +1,87 @@
+import asyncio
+
+
+def approx_tokens(text):
+    # Aproximación de ~4 caracteres por token, suficiente para acotar prompts
+    return (len(text) + 3) // 4
+
+
+class ConversationMemory:
+    """
+    Memoria de la conversación con un NPC: un resumen acumulado de lo antiguo
+    más los mensajes recientes tal cual, acotados en tokens.
+
+    - context(messages) da el texto para el prompt, de tamaño constante.
+    - update(messages) se llama tras cada respuesta: si hay mensajes que ya
+      no caben en la cola, se añaden al resumen en segundo plano, fuera del
+      turno del jugador. Mientras el resumen se pone al día, esos mensajes
+      siguen entrando en el contexto tal cual (hasta max_context_tokens).
+
+    summarize(resumen, mensajes) es la corrutina que devuelve el resumen
+    actualizado con los mensajes nuevos.
+
+    Si solo se pasan los últimos mensajes de la conversación (el servicio de
+    diálogo acota los de cada turno), offset es la posición de messages[0]
+    en la conversación completa: summarized cuenta desde el principio.
+    """
+
+    def __init__(self, summarize, max_tail_tokens=300, max_context_tokens=600, count_tokens=approx_tokens):
+        self.summarize = summarize
+        self.max_tail_tokens = max_tail_tokens
+        self.max_context_tokens = max_context_tokens
+        self.count_tokens = count_tokens
+
+        self.summary = ""
+        self.summarized = 0  # Mensajes ya incluidos en el resumen
+        self._task = None
+
+        self.updates = 0
+        self.failures = 0
+
+    def _tail_start(self, messages, start, budget):
+        # Primer índice desde el que los mensajes más recientes caben en budget (al menos el último)
+        index = len(messages)
+        used = 0
+        while index > start:
+            used += self.count_tokens(messages[index - 1])
+            if used > budget and index < len(messages):
+                break
+            index -= 1
+        return index
+
+    def _start(self, messages, offset):
+        # Primer mensaje de messages que aún no está en el resumen
+        return min(max(self.summarized - offset, 0), len(messages))
+
+    def context(self, messages, offset=0):
+        start = self._start(messages, offset)
+        tail = messages[self._tail_start(messages, start, self.max_context_tokens):]
+        lines = [f"(Resumen de lo anterior: {self.summary})"] if self.summary else []
+        return "\n".join(lines + list(tail))
+
+    def update(self, messages, offset=0):
+        """
+        Lanza la actualización del resumen si hay mensajes fuera de la cola
+        """
+        if self._task is not None and not self._task.done():
+            return
+        start = self._start(messages, offset)
+        end = self._tail_start(messages, start, self.max_tail_tokens)
+        if end > start:
+            self._task = asyncio.create_task(self._summarize(list(messages[start:end]), offset + end))
+
+    async def _summarize(self, new_messages, summarized):
+        try:
+            self.summary = await self.summarize(self.summary, new_messages)
+            self.summarized = summarized
+            self.updates += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Se reintenta tras la siguiente respuesta; mientras, el contexto usa los mensajes tal cual
+            self.failures += 1
+            print(f"Error al resumir la conversación: {e}")
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
@@ -0,0 +1,116 @@
+import json
+
+import httpx
+
+from chat_log import StreamingMessage
+
+# El juego abre pocas conexiones; el test de carga comparte un cliente entre muchas sesiones
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60)
+# Sin límite de lectura: el servicio puede tardar en dar el primer token con el LLM ocupado
+HTTP_TIMEOUT = httpx.Timeout(10.0, read=None)
+
+
+class DialogueClient:
+    """
+    Cliente asíncrono del servicio de diálogo (dialogue_service.py).
+
+    Un solo httpx.AsyncClient con pool de conexiones keep-alive para todas
+    las sesiones y turnos, así cada turno no paga una conexión nueva
+    """
+
+    def __init__(self, base_url, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT):
+        self.http = httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout)
+
+    async def create_session(self):
+        response = await self.http.post("/sessions")
+        response.raise_for_status()
+        session = response.json()
+        return RemoteSession(self, session['session_id'], session['npcs'])
+
+    async def stats(self):
+        response = await self.http.get("/stats")
+        response.raise_for_status()
+        return response.json()
+
+    async def aclose(self):
+        await self.http.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+
+class RemoteSession:
+    """
+    Sesión de diálogo que vive en el servicio. Tiene la misma interfaz que
+    DialogueSession, así el juego no distingue si los NPCs son locales
+    """
+
+    def __init__(self, client, session_id, npcs):
+        self.client = client
+        self.session_id = session_id
+        # Número -> nombre de los NPCs, tal como los define el servicio (app.NPC_NAMES)
+        self.npcs = npcs
+        self.book_remembered = False
+
+    async def stream(self, npc, messages, speculative=False):
+        """
+        Eventos del turno tal como los envía el servicio: {"delta"}, {"text"} y al final {"done"}
+        """
+        async with self.client.http.stream(
+            "POST",
+            f"/sessions/{self.session_id}/npcs/{npc}/turn",
+            json={'messages': list(messages), 'speculative': speculative}
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line:
+                    yield json.loads(line)
+
+    async def respond(self, npc, messages, speculative=False):
+        # Escribe en messages la respuesta del NPC a medida que llega, como DialogueSession.respond;
+        # un turno especulativo devuelve lo que hay que enviar a commit si se usa
+        # Si la petición se cancela a medias (saludo sustituido), la respuesta se quita del chat
+        turn = None
+        with StreamingMessage(messages, self.npcs[npc]) as reply:
+            try:
+                async for event in self.stream(npc, messages, speculative):
+                    if 'delta' in event:
+                        reply.append(event['delta'])
+                    elif 'text' in event:
+                        reply.update(event['text'])
+                    elif event.get('done'):
+                        if 'error' in event:
+                            raise RuntimeError(event['error'])
+                        self.book_remembered = event['book_remembered']
+                        turn = event.get('turn')
+                        reply.finish(event['reply'])
+            except (httpx.HTTPError, RuntimeError) as e:
+                print(f"Error del servicio de diálogo: {e}")
+                reply.finish("Mmm... ¿qué me decías? Estaba pensando en el libro...")
+        return turn
+
+    async def commit(self, npc, turn):
+        """
+        Aplica en el servicio un turno especulativo que se ha pasado al chat
+        """
+        if turn is None:
+            return
+        try:
+            response = await self.client.http.post(f"/sessions/{self.session_id}/npcs/{npc}/commit", json=turn)
+            response.raise_for_status()
+            self.book_remembered = response.json()['book_remembered']
+        except httpx.HTTPError as e:
+            print(f"Error del servicio de diálogo: {e}")
+
+    def remember(self, npc, messages):
+        # La memoria de la conversación se actualiza en el servicio tras cada turno
+        pass
+
+    async def close(self):
+        try:
+            await self.client.http.delete(f"/sessions/{self.session_id}")
+        except httpx.HTTPError:
+            pass
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import weakref
+
+import httpx
+from langchain.chains.retrieval_qa.base import RetrievalQA
+
+from JayceResponse import JayceResponse
+
+# Límites del pool de conexiones compartido por el chat y los embeddings
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+_http_clients = None
+_http_clients_lock = threading.Lock()
+
+
+class LoopLocalTransport(httpx.AsyncBaseTransport):
+    """
+    Transporte asíncrono con un pool de conexiones por bucle de eventos.
+
+    Las conexiones de un pool solo sirven en el bucle que las abrió: el
+    motor de diálogo se carga en otro hilo (y la ingesta en su propio
+    asyncio.run), pero los turnos se ejecutan en el bucle del juego o del
+    servicio. El pool de un bucle se libera con él
+    """
+
+    def __init__(self, limits=HTTP_LIMITS):
+        self.limits = limits
+        self._transports = weakref.WeakKeyDictionary()
+
+    def _transport(self):
+        loop = asyncio.get_running_loop()
+        transport = self._transports.get(loop)
+        if transport is None:
+            transport = self._transports[loop] = httpx.AsyncHTTPTransport(limits=self.limits)
+        return transport
+
+    async def handle_async_request(self, request):
+        return await self._transport().handle_async_request(request)
+
+    async def aclose(self):
+        transport = self._transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
+
+
+def shared_http_clients():
+    """
+    Clientes HTTP (síncrono y asíncrono) compartidos por todos los clientes de
+    OpenAI, para reutilizar las conexiones entre turnos y entre modelos. El
+    asíncrono abre sus conexiones en el bucle que lo usa (LoopLocalTransport)
+    """
+    global _http_clients
+    with _http_clients_lock:
+        if _http_clients is None:
+            _http_clients = (
+                httpx.Client(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT),
+                httpx.AsyncClient(transport=LoopLocalTransport(HTTP_LIMITS), timeout=HTTP_TIMEOUT)
+            )
+    return _http_clients
+
+
+def dedicated_async_client():
+    """
+    Cliente asíncrono con su propio pool, para trabajo con principio y fin
+    (la ingesta) que debe cerrar sus conexiones al terminar
+    """
+    return httpx.AsyncClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+
+
+class DialogueEngine:
+    """
+    Runnables de los NPCs, construidos una sola vez al arrancar y reutilizados
+    en cada turno de diálogo
+    """
+
+    def __init__(self, llm, vectorstore, fragment_index, retriever_k=3, response_cache=None):
+        self.llm = llm
+        self.vectorstore = vectorstore
+        self.fragment_index = fragment_index
+        self.response_cache = response_cache
+        self.model_name = getattr(llm, 'model_name', type(llm).__name__)
+        self.temperature = getattr(llm, 'temperature', None)
+
+        # Ekko: retriever y cadena de RetrievalQA sobre los libros
+        self.retriever = vectorstore.as_retriever(search_kwargs={"k": retriever_k})
+        self.ekko_qa_chain = RetrievalQA.from_chain_type(
+            llm=llm,
+            chain_type="stuff",
+            retriever=self.retriever
+        )
+
+        # Jayce: salida estructurada; con el esquema como diccionario se emite
+        # como JSON parcial, así podemos mostrar "response" mientras se genera
+        self.jayce_structured = llm.with_structured_output(JayceResponse.model_json_schema())
+
+    async def cached_reply(self, prompt, semantic_text=None):
+        """
+        Respuesta cacheada para este prompt, o None si no hay caché o no hay acierto
+        """
+        if self.response_cache is None:
+            return None
+        return await self.response_cache.aget(prompt, self.model_name, self.temperature, semantic_text)
+
+    async def store_reply(self, prompt, value, semantic_text=None):
+        if self.response_cache is not None:
+            await self.response_cache.aput(prompt, self.model_name, self.temperature, value, semantic_text)
@@ -0,0 +1,141 @@
+import asyncio
+import time
+from collections import deque
+
+import numpy as np
+
+GREETING = 'greeting'
+MESSAGE = 'message'
+
+
+class NpcChannel:
+    """
+    Estado de las peticiones de diálogo de un NPC
+    """
+
+    def __init__(self, name, latency_window):
+        self.name = name
+        self.task = None
+        self.kind = None
+        self.pending = None  # (respond, encolada en, mensajes agrupados)
+
+        self.started = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.coalesced = 0
+        self.dropped_greetings = 0
+        self.latencies = deque(maxlen=latency_window)
+
+    @property
+    def busy(self):
+        return self.task is not None and not self.task.done()
+
+    @property
+    def queue_depth(self):
+        return self.pending[2] if self.pending else 0
+
+
+class DialogueScheduler:
+    """
+    Como mucho una petición al LLM en curso por NPC.
+
+    - Los mensajes que el jugador escribe mientras hay una petición en curso
+      se agrupan en la siguiente: el NPC responde una vez a todos ellos.
+    - Un mensaje del jugador cancela el saludo en curso (acercarse al NPC),
+      que ya no hace falta.
+    - Un saludo con otra petición en curso se descarta.
+
+    respond es una función sin argumentos que devuelve la corrutina de la
+    respuesta; se llama al lanzar la petición, así que lee la conversación
+    completa en ese momento.
+    """
+
+    def __init__(self, latency_window=100):
+        self.latency_window = latency_window
+        self.channels = {}
+
+    def channel(self, npc):
+        channel = self.channels.get(npc)
+        if channel is None:
+            channel = NpcChannel(npc, self.latency_window)
+            self.channels[npc] = channel
+        return channel
+
+    def submit(self, npc, respond, kind=MESSAGE):
+        """
+        Pide una respuesta del NPC. Devuelve la tarea que la atenderá
+        """
+        channel = self.channel(npc)
+        now = time.perf_counter()
+
+        if not channel.busy:
+            return self._start(channel, kind, respond, now)
+
+        if kind == GREETING:
+            # Ya hay una petición en curso que responderá al jugador
+            channel.dropped_greetings += 1
+            return channel.task
+
+        if channel.kind == GREETING:
+            channel.task.cancel()
+            channel.cancelled += 1
+            return self._start(channel, kind, respond, now)
+
+        if channel.pending is None:
+            channel.pending = (respond, now, 1)
+        else:
+            channel.pending = (respond, channel.pending[1], channel.pending[2] + 1)
+            channel.coalesced += 1
+        return channel.task
+
+    def _start(self, channel, kind, respond, queued_at):
+        channel.kind = kind
+        channel.started += 1
+        channel.task = asyncio.create_task(self._run(channel, respond, queued_at))
+        return channel.task
+
+    async def _run(self, channel, respond, queued_at):
+        try:
+            await respond()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error en la petición de {channel.name}: {e}")
+        channel.completed += 1
+        channel.latencies.append(time.perf_counter() - queued_at)
+
+        # Los mensajes llegados mientras tanto se responden en una sola petición
+        if channel.pending is not None:
+            respond, pending_since, _ = channel.pending
+            channel.pending = None
+            self._start(channel, MESSAGE, respond, pending_since)
+
+    def busy(self, npc):
+        channel = self.channels.get(npc)
+        return channel is not None and channel.busy
+
+    def in_flight(self):
+        return sum(1 for channel in self.channels.values() if channel.busy)
+
+    def cancel_all(self):
+        for channel in self.channels.values():
+            channel.pending = None
+            if channel.busy:
+                channel.task.cancel()
+
+    def stats(self):
+        stats = {}
+        for name, channel in self.channels.items():
+            latencies = np.array(channel.latencies) * 1000
+            stats[name] = {
+                'in_flight': channel.busy,
+                'queue_depth': channel.queue_depth,
+                'started': channel.started,
+                'completed': channel.completed,
+                'cancelled': channel.cancelled,
+                'coalesced': channel.coalesced,
+                'dropped_greetings': channel.dropped_greetings,
+                'latency_p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+                'latency_p95_ms': float(np.percentile(latencies, 95)) if len(latencies) else None
+            }
+        return stats
@@ -0,0 +1,352 @@
+"""
+Servicio de diálogo: los NPCs (Jayce y Ekko) como servidor local compartido
+por varios clientes del juego. El stack de IA (vector store, LLM y caché de
+respuestas) se carga una sola vez y lo comparten todas las sesiones; cada
+sesión tiene su propio libro, memoria de las conversaciones y estado
+(si Jayce ya ha recordado el libro).
+
+    python dialogue_service.py --port 8765
+    DIALOGUE_SERVICE_URL=http://127.0.0.1:8765 python app.py
+
+API (la conversación la envía el cliente en cada turno, el servicio guarda el resto):
+    POST   /sessions                         crea una sesión -> {"session_id", "npcs": {número: nombre}}
+    GET    /sessions/{id}                    estado de la sesión
+    DELETE /sessions/{id}                    cierra la sesión
+    POST   /sessions/{id}/npcs/{npc}/turn    {"messages": [...], "speculative"} -> NDJSON en streaming
+    POST   /sessions/{id}/npcs/{npc}/commit  aplica el "turn" de un turno especulativo ya usado
+    WS     /sessions/{id}/ws                 {"id", "npc", "messages", "speculative"} -> los mismos eventos con "id"
+    GET    /stats                            sesiones, turnos y caché de respuestas
+
+Eventos de un turno: {"delta": texto añadido}, {"text": texto completo} si la
+respuesta se reescribe, y al final {"done": true, "reply", "book_remembered"}
+(o {"done": true, "error"}). Un turno especulativo (saludo anticipado) no
+cambia la sesión: su evento final trae además "turn", lo que hay que enviar
+a /commit si el cliente llega a usar la respuesta.
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import List
+
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+
+import app
+from chat_log import ChatLog
+from telemetry import telemetry
+
+SESSION_TTL = 30 * 60  # Segundos sin actividad antes de descartar una sesión
+MAX_SESSIONS = 1000
+MAX_MESSAGES = 200  # Mensajes por turno; los antiguos ya están en la memoria de la sesión
+# Tras el primer token, los siguientes se envían juntos como mucho cada STREAM_INTERVAL segundos:
+# menos eventos que procesar en el cliente (y en su bucle de frames) sin que se note en el chat
+STREAM_INTERVAL = 0.05
+
+
+class TurnRequest(BaseModel):
+    messages: List[str] = Field(default_factory=list, description="Conversación con el NPC hasta ahora")
+    speculative: bool = Field(False, description="Saludo anticipado: no cambia la sesión hasta /commit")
+
+
+class TurnCommit(BaseModel):
+    fragment: str = ""
+    book_remembered: bool = False
+
+
+class ObservedChatLog(ChatLog):
+    """
+    ChatLog que avisa de cada cambio, para enviar la respuesta del NPC a
+    medida que se escribe sin consultar la lista en bucle
+    """
+
+    def __init__(self, messages, changed):
+        super().__init__(messages)
+        self.changed = changed
+
+    def _mark(self, index):
+        super()._mark(index)
+        self.changed.set()
+
+
+class SessionStore:
+    """
+    Sesiones de diálogo activas. Las que llevan más de ttl segundos sin
+    turnos se descartan al crear sesiones nuevas
+    """
+
+    def __init__(self, engine, fragment_index, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS):
+        self.engine = engine
+        self.fragment_index = fragment_index
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.last_used = {}
+
+        self.created = 0
+        self.expired = 0
+
+    def _expire(self, now):
+        for session_id in [s for s, used in self.last_used.items() if now - used > self.ttl]:
+            self.discard(session_id)
+            self.expired += 1
+
+    def create(self):
+        now = time.monotonic()
+        self._expire(now)
+        if len(self.sessions) >= self.max_sessions:
+            raise HTTPException(503, "Demasiadas sesiones abiertas")
+        session_id = uuid.uuid4().hex
+        self.sessions[session_id] = app.DialogueSession(self.engine, self.fragment_index)
+        self.last_used[session_id] = now
+        self.created += 1
+        return session_id
+
+    def get(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise HTTPException(404, "Sesión desconocida")
+        self.last_used[session_id] = time.monotonic()
+        return session
+
+    def discard(self, session_id):
+        session = self.sessions.pop(session_id, None)
+        self.last_used.pop(session_id, None)
+        if session is not None:
+            # Sin await: solo cancela las tareas de resumen pendientes
+            for memory in session.memories.values():
+                memory.cancel()
+        return session is not None
+
+
+class TurnStats:
+    def __init__(self):
+        self.started = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+
+    @property
+    def active(self):
+        return self.started - self.completed - self.cancelled - self.failed
+
+    def as_dict(self):
+        return {
+            'started': self.started,
+            'completed': self.completed,
+            'cancelled': self.cancelled,
+            'failed': self.failed,
+            'active': self.active
+        }
+
+
+def _reply_text(messages, start, prefix):
+    if len(messages) <= start:
+        return ""
+    return messages[start][len(prefix):] if messages[start].startswith(prefix) else messages[start]
+
+
+async def run_turn(session, npc, messages, stats, interval=STREAM_INTERVAL, speculative=False):
+    """
+    Turno del NPC en la sesión. Genera los eventos de la respuesta a medida
+    que el NPC la escribe; si el cliente se va a mitad, el turno se cancela
+    """
+    prefix = f"{app.NPC_NAMES[npc]}: "
+    changed = asyncio.Event()
+    log = ObservedChatLog(messages[-MAX_MESSAGES:], changed)
+    start = len(log)
+    # La memoria de la sesión cuenta los mensajes desde el principio de la conversación
+    offset = len(messages) - start
+
+    stats.started += 1
+    task = asyncio.create_task(session.respond(npc, log, offset, speculative))
+    task.add_done_callback(lambda _: changed.set())
+    sent = ""
+    try:
+        while True:
+            await changed.wait()
+            changed.clear()
+            text = _reply_text(log, start, prefix)
+            if text != sent:
+                yield {'delta': text[len(sent):]} if text.startswith(sent) else {'text': text}
+                sent = text
+            if task.done():
+                break
+            # Acumula los tokens de este intervalo (o hasta que termine el turno)
+            await asyncio.wait({task}, timeout=interval)
+
+        error = task.exception()
+        if error is not None:
+            stats.failed += 1
+            print(f"Error en el turno de {app.NPC_NAMES[npc]}: {error}")
+            yield {'done': True, 'error': str(error)}
+            return
+
+        stats.completed += 1
+        done = {'done': True, 'reply': sent, 'book_remembered': session.book_remembered}
+        if speculative:
+            turn = task.result()
+            done['turn'] = turn._asdict() if turn is not None else None
+        else:
+            session.remember(npc, log, offset)
+        yield done
+    finally:
+        if not task.done():
+            task.cancel()
+            stats.cancelled += 1
+
+
+def create_app(engine=None, fragment_index=None):
+    """
+    Aplicación FastAPI del servicio. Sin engine, el stack de IA se carga al arrancar
+    """
+    state = {}
+    turns = TurnStats()
+
+    @asynccontextmanager
+    async def lifespan(api):
+        nonlocal engine, fragment_index
+        if engine is None:
+            # En un hilo: la ingesta tiene su propio bucle asyncio
+            engine, fragment_index = await asyncio.to_thread(app.init_dialogue)
+        state['sessions'] = SessionStore(engine, fragment_index)
+        yield
+        for session_id in list(state['sessions'].sessions):
+            state['sessions'].discard(session_id)
+        if engine.response_cache is not None:
+            engine.response_cache.save()
+
+    api = FastAPI(title="Servicio de diálogo", lifespan=lifespan)
+    if telemetry.enabled:
+        try:
+            from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+            FastAPIInstrumentor.instrument_app(api)
+        except ImportError:
+            pass
+
+    def check_npc(npc):
+        if npc not in app.NPC_NAMES:
+            raise HTTPException(404, "NPC desconocido")
+
+    @api.get("/health")
+    async def health():
+        return {'status': 'ok'}
+
+    @api.post("/sessions", status_code=201)
+    async def create_session():
+        return {'session_id': state['sessions'].create(), 'npcs': app.NPC_NAMES}
+
+    @api.get("/sessions/{session_id}")
+    async def get_session(session_id: str):
+        session = state['sessions'].get(session_id)
+        return {'session_id': session_id, 'book_remembered': session.book_remembered}
+
+    @api.delete("/sessions/{session_id}", status_code=204)
+    async def delete_session(session_id: str):
+        if not state['sessions'].discard(session_id):
+            raise HTTPException(404, "Sesión desconocida")
+
+    @api.post("/sessions/{session_id}/npcs/{npc}/turn")
+    async def turn(session_id: str, npc: str, request: TurnRequest):
+        session = state['sessions'].get(session_id)
+        check_npc(npc)
+
+        async def events():
+            async for event in run_turn(session, npc, request.messages, turns, speculative=request.speculative):
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+
+        return StreamingResponse(events(), media_type="application/x-ndjson")
+
+    @api.post("/sessions/{session_id}/npcs/{npc}/commit")
+    async def commit(session_id: str, npc: str, turn: TurnCommit):
+        session = state['sessions'].get(session_id)
+        check_npc(npc)
+        await session.commit(npc, app.NpcTurn(turn.fragment, turn.book_remembered))
+        return {'book_remembered': session.book_remembered}
+
+    @api.websocket("/sessions/{session_id}/ws")
+    async def turn_socket(websocket: WebSocket, session_id: str):
+        """
+        Varios turnos por conexión, también a la vez (un NPC por turno);
+        {"cancel": id} cancela un turno en curso
+        """
+        await websocket.accept()
+        if session_id not in state['sessions'].sessions:
+            await websocket.close(code=4404, reason="Sesión desconocida")
+            return
+
+        running = {}
+        send_lock = asyncio.Lock()
+
+        async def send(turn_id, event):
+            async with send_lock:
+                await websocket.send_json({'id': turn_id, **event})
+
+        async def send_turn(turn_id, session, npc, messages, speculative):
+            async for event in run_turn(session, npc, messages, turns, speculative=speculative):
+                await send(turn_id, event)
+
+        try:
+            while True:
+                request = await websocket.receive_json()
+                if 'cancel' in request:
+                    task = running.pop(request['cancel'], None)
+                    if task is not None:
+                        task.cancel()
+                    continue
+                turn_id, npc = request.get('id'), request.get('npc')
+                if npc not in app.NPC_NAMES:
+                    await send(turn_id, {'done': True, 'error': "NPC desconocido"})
+                    continue
+                # La sesión puede haber caducado o cerrarse con la conexión abierta
+                try:
+                    session = state['sessions'].get(session_id)
+                except HTTPException as e:
+                    await send(turn_id, {'done': True, 'error': e.detail})
+                    continue
+                task = asyncio.create_task(
+                    send_turn(turn_id, session, npc, request.get('messages', []), bool(request.get('speculative')))
+                )
+                running[turn_id] = task
+                task.add_done_callback(lambda _, turn_id=turn_id: running.pop(turn_id, None))
+        except WebSocketDisconnect:
+            pass
+        finally:
+            for task in running.values():
+                task.cancel()
+
+    @api.get("/stats")
+    async def stats():
+        sessions = state['sessions']
+        cache = engine.response_cache
+        return {
+            'sessions': len(sessions.sessions),
+            'sessions_created': sessions.created,
+            'sessions_expired': sessions.expired,
+            'turns': turns.as_dict(),
+            'response_cache': cache.stats() if cache is not None else None
+        }
+
+    return api
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servicio de diálogo de los NPCs")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    # Antes de crear la aplicación, para que FastAPI quede instrumentada
+    telemetry.configure(app.TELEMETRY_EXPORTER, service_name="dialogue-service", path=app.TELEMETRY_FILE)
+    # Un solo proceso: las sesiones, el vector store y la caché viven en memoria
+    uvicorn.run(create_app(), host=args.host, port=args.port, log_level="warning")
+    telemetry.shutdown()
+
+
+if __name__ == "__main__":
+    main()
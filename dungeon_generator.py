@@ -0,0 +1,165 @@
+import numpy as np
+
+WALL = ord('#')
+FLOOR = ord('.')
+
+
+def _place_rooms(rng, cols, rows, min_room, max_room, attempts):
+    """
+    Salas rectangulares (x, y, w, h) sin solaparse, dejando un tile de pared
+    entre ellas y con el borde del mapa
+    """
+    occupied = np.zeros((rows, cols), dtype=bool)
+    widths = rng.integers(min_room, max_room + 1, size=attempts)
+    heights = rng.integers(min_room, max_room + 1, size=attempts)
+    # Las coordenadas se sortean de una vez, ajustadas al tamaño de cada sala
+    xs = (rng.random(attempts) * (cols - widths - 1)).astype(int) + 1
+    ys = (rng.random(attempts) * (rows - heights - 1)).astype(int) + 1
+
+    rooms = []
+    for x, y, w, h in zip(xs, ys, widths, heights):
+        if x + w >= cols or y + h >= rows:
+            continue
+        if occupied[y - 1:y + h + 1, x - 1:x + w + 1].any():
+            continue
+        occupied[y:y + h, x:x + w] = True
+        rooms.append((int(x), int(y), int(w), int(h)))
+    return rooms
+
+
+def _carve_corridor(grid, a, b, horizontal_first):
+    (x0, y0), (x1, y1) = a, b
+    if horizontal_first:
+        grid[y0, min(x0, x1):max(x0, x1) + 1] = FLOOR
+        grid[min(y0, y1):max(y0, y1) + 1, x1] = FLOOR
+    else:
+        grid[min(y0, y1):max(y0, y1) + 1, x0] = FLOOR
+        grid[y1, min(x0, x1):max(x0, x1) + 1] = FLOOR
+
+
+def _floor_neighbours(floor):
+    """
+    Número de vecinos de suelo (vecindad de Moore) de cada celda
+    """
+    padded = np.pad(floor.astype(np.uint8), 1)
+    rows, cols = floor.shape
+    total = np.zeros(floor.shape, dtype=np.uint8)
+    for dy in (0, 1, 2):
+        for dx in (0, 1, 2):
+            if dy != 1 or dx != 1:
+                total += padded[dy:dy + rows, dx:dx + cols]
+    return total
+
+
+def _smooth(grid, iterations):
+    """
+    Autómata celular que solo excava: una pared rodeada de suelo (5 vecinos o
+    más) pasa a ser suelo. Redondea salas y pasillos sin romper la conectividad
+    """
+    for _ in range(iterations):
+        floor = grid == FLOOR
+        carve = ~floor & (_floor_neighbours(floor) >= 5)
+        carve[0, :] = carve[-1, :] = carve[:, 0] = carve[:, -1] = False
+        if not carve.any():
+            break
+        grid[carve] = FLOOR
+
+
+def _random_cell(rng, room, taken):
+    """
+    Celda libre (fila, columna) al azar dentro de la sala. Las salas son
+    enteramente de suelo, solo hay que evitar las celdas ya ocupadas
+    """
+    x, y, w, h = room
+    for index in rng.permutation(w * h):
+        cell = (y + int(index) // w, x + int(index) % w)
+        if cell not in taken:
+            return cell
+    return None
+
+
+def _free_cell(rng, rooms, preferred, taken):
+    """
+    Celda libre en la sala preferida o, si está llena (salas pequeñas), en
+    la primera de las demás que tenga sitio
+    """
+    for room_index in [preferred] + [i for i in range(len(rooms)) if i != preferred]:
+        cell = _random_cell(rng, rooms[room_index], taken)
+        if cell is not None:
+            return cell
+    raise ValueError("Las salas no tienen sitio para el jugador, los NPCs y el cofre")
+
+
+def _snake_order(centers, band_height):
+    """
+    Orden de las salas en serpentina por bandas horizontales: salas
+    consecutivas quedan cerca, así que los pasillos entre ellas son cortos
+    """
+    bands = centers[:, 1] // band_height
+    x_key = np.where(bands % 2 == 0, centers[:, 0], -centers[:, 0])
+    return np.lexsort((x_key, bands))
+
+
+def generate_dungeon(cols, rows, seed=None, min_room=4, max_room=10, smoothing=2, enemies_per_room=0.5):
+    """
+    Genera una mazmorra de salas y pasillos con el mismo formato que level.txt:
+    una lista de filas con '#', '.', 'P', '1', '2', 'W' y 'E'.
+
+    - Las salas se colocan sin solaparse y se recorren en serpentina uniendo
+      cada una con la siguiente por un pasillo en L, así que todo el mapa es
+      accesible.
+    - Un autómata celular (solo excava) suaviza las esquinas.
+    - El jugador empieza en la primera sala y el cofre está en la sala más lejana.
+
+    Con la misma semilla se genera siempre el mismo mapa.
+    """
+    if cols < min_room + 2 or rows < min_room + 2:
+        raise ValueError(f"El mapa debe medir al menos {min_room + 2}x{min_room + 2}")
+
+    rng = np.random.default_rng(seed)
+    grid = np.full((rows, cols), WALL, dtype=np.uint8)
+
+    attempts = max(8, 2 * cols * rows // (max_room * max_room))
+    rooms = _place_rooms(rng, cols, rows, min_room, min(max_room, cols - 2, rows - 2), attempts)
+    if not rooms:
+        raise ValueError(f"No cabe ninguna sala de {min_room}x{min_room} en un mapa de {cols}x{rows}")
+    for x, y, w, h in rooms:
+        grid[y:y + h, x:x + w] = FLOOR
+
+    centers = np.array([(x + w // 2, y + h // 2) for x, y, w, h in rooms])
+    order = _snake_order(centers, 2 * max_room)
+    turns = rng.integers(2, size=len(rooms))
+    for a, b, turn in zip(order[:-1], order[1:], turns):
+        _carve_corridor(grid, tuple(centers[a]), tuple(centers[b]), bool(turn))
+
+    _smooth(grid, smoothing)
+
+    # Entidades: jugador, NPCs, cofre y enemigos
+    start = 0
+    goal = int(np.argmax(np.abs(centers - centers[start]).sum(axis=1)))
+    taken = set()
+    placements = []
+    others = [i for i in range(len(rooms)) if i not in (start, goal)] or [start]
+    for char, room_index in (('P', start), ('W', goal), ('1', rng.choice(others)), ('2', rng.choice(others))):
+        cell = _free_cell(rng, rooms, int(room_index), taken)
+        taken.add(cell)
+        placements.append((char, cell))
+
+    # Enemigos: un número de Poisson por sala (salvo la inicial), sorteados de
+    # una vez; las celdas repetidas u ocupadas se descartan
+    if enemies_per_room and len(rooms) > 1:
+        boxes = np.array([room for i, room in enumerate(rooms) if i != start])
+        counts = rng.poisson(enemies_per_room, size=len(boxes))
+        boxes = np.repeat(boxes, counts, axis=0)
+        cols_e = boxes[:, 0] + (rng.random(len(boxes)) * boxes[:, 2]).astype(int)
+        rows_e = boxes[:, 1] + (rng.random(len(boxes)) * boxes[:, 3]).astype(int)
+        _, first = np.unique(rows_e * cols + cols_e, return_index=True)
+        for i in np.sort(first):
+            cell = (int(rows_e[i]), int(cols_e[i]))
+            if cell not in taken:
+                placements.append(('E', cell))
+
+    for char, (row, col) in placements:
+        grid[row, col] = ord(char)
+
+    return [row.tobytes().decode('ascii') for row in grid]
@@ -0,0 +1,145 @@
+import numpy as np
+
+# Vecinos en orden fijo: derecha, izquierda, abajo, arriba (dx, dy)
+NEIGHBOURS = np.array([(1, 0), (-1, 0), (0, 1), (0, -1)], dtype=np.int8)
+
+
+class FlowField:
+    """
+    Campo de distancias (BFS) desde un tile objetivo, limitado a max_distance
+    tiles alrededor, y la dirección hacia el objetivo en cada celda.
+
+    Se calcula una vez por tile del jugador y lo comparten todos los enemigos.
+    La BFS avanza el frente entero en cada paso con operaciones de numpy sobre
+    la ventana, así que su coste no depende del tamaño del mapa.
+    """
+
+    def __init__(self, walkable, target, max_distance):
+        rows, cols = walkable.shape
+        target_col, target_row = target
+        self.max_distance = max_distance
+        self.row0 = max(0, target_row - max_distance)
+        self.col0 = max(0, target_col - max_distance)
+        row1 = min(rows, target_row + max_distance + 1)
+        col1 = min(cols, target_col + max_distance + 1)
+        window = walkable[self.row0:row1, self.col0:col1]
+
+        distance = np.full(window.shape, -1, dtype=np.int32)
+        frontier = np.zeros(window.shape, dtype=bool)
+        frontier[target_row - self.row0, target_col - self.col0] = True
+        distance[frontier] = 0
+        for step in range(1, max_distance + 1):
+            grown = np.zeros_like(frontier)
+            grown[1:, :] |= frontier[:-1, :]
+            grown[:-1, :] |= frontier[1:, :]
+            grown[:, 1:] |= frontier[:, :-1]
+            grown[:, :-1] |= frontier[:, 1:]
+            frontier = grown & window & (distance < 0)
+            if not frontier.any():
+                break
+            distance[frontier] = step
+        self.distance = distance
+
+        # Dirección de cada celda: el primer vecino que está un paso más cerca
+        padded = np.pad(distance, 1, constant_values=-1)
+        h, w = distance.shape
+        self.direction = np.full(distance.shape, -1, dtype=np.int8)
+        for index, (dx, dy) in enumerate(NEIGHBOURS):
+            neighbour = padded[1 + dy:1 + dy + h, 1 + dx:1 + dx + w]
+            better = (self.direction < 0) & (distance > 0) & (neighbour == distance - 1)
+            self.direction[better] = index
+
+    def lookup(self, cols, rows):
+        """
+        Distancia y dirección para arrays de tiles; -1 fuera de la ventana o sin camino
+        """
+        local_rows = rows - self.row0
+        local_cols = cols - self.col0
+        h, w = self.distance.shape
+        inside = (local_rows >= 0) & (local_rows < h) & (local_cols >= 0) & (local_cols < w)
+        distance = np.full(cols.shape, -1, dtype=np.int32)
+        direction = np.full(cols.shape, -1, dtype=np.int8)
+        distance[inside] = self.distance[local_rows[inside], local_cols[inside]]
+        direction[inside] = self.direction[local_rows[inside], local_cols[inside]]
+        return distance, direction
+
+
+class EnemySwarm:
+    """
+    Enemigos que persiguen al jugador. El estado vive en arrays de numpy
+    (posición en píxeles por enemigo) y cada paso de actualización mueve a
+    todos a la vez siguiendo el mismo FlowField.
+    """
+
+    def __init__(self, positions, walkable, tile_size, speed=2, sight=30, stop_distance=1):
+        self.positions = np.array(positions, dtype=np.float32).reshape(-1, 2)
+        self.walkable = walkable
+        self.tile_size = tile_size
+        self.speed = speed
+        self.sight = sight
+        self.stop_distance = stop_distance
+
+        self.field = None
+        self._target_tile = None
+        self.fields_built = 0
+
+    @classmethod
+    def from_entities(cls, entities, walkable, tile_size, **kwargs):
+        return cls([entity.rect[:2] for entity in entities], walkable, tile_size, **kwargs)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def tiles(self):
+        # Tile de cada enemigo según el centro de su sprite
+        return ((self.positions + self.tile_size / 2) // self.tile_size).astype(np.int32)
+
+    def update(self, player_pos):
+        """
+        Un paso de simulación: recalcula el campo si el jugador ha cambiado de
+        tile y mueve a todos los enemigos un paso hacia el siguiente tile
+        """
+        if not len(self):
+            return
+
+        half = self.tile_size // 2
+        player_tile = ((player_pos[0] + half) // self.tile_size, (player_pos[1] + half) // self.tile_size)
+
+        # Solo se mueven (y solo hace falta el campo) los que están a la vista del jugador
+        tiles = self.tiles()
+        near = np.abs(tiles - np.array(player_tile)).max(axis=1) <= self.sight
+        if not near.any():
+            return
+
+        if player_tile != self._target_tile:
+            self.field = FlowField(self.walkable, player_tile, self.sight)
+            self._target_tile = player_tile
+            self.fields_built += 1
+
+        indices = np.flatnonzero(near)
+        distance, direction = self.field.lookup(tiles[indices, 0], tiles[indices, 1])
+        chasing = (distance > self.stop_distance) & (direction >= 0)
+        if not chasing.any():
+            return
+        indices = indices[chasing]
+
+        # Un eje cada vez, para no cortar las esquinas de las paredes: primero se centran en su
+        # tile en el eje perpendicular al paso, y luego avanzan en línea recta al siguiente tile
+        steps = NEIGHBOURS[direction[chasing]]
+        current = tiles[indices] * self.tile_size
+        positions = self.positions[indices]
+        across = (current - positions) * (steps == 0)
+        along = (current + steps * self.tile_size - positions) * (steps != 0)
+        delta = np.where((np.abs(across) > 1e-3).any(axis=1)[:, None], across, along)
+        length = np.abs(delta).sum(axis=1)
+        scale = np.minimum(1.0, self.speed / np.maximum(length, 1e-6))
+        self.positions[indices] += delta * scale[:, None]
+
+    def visible(self, view_rect):
+        """
+        Posiciones (enteras) de los enemigos que se solapan con la vista
+        """
+        x, y, w, h = view_rect
+        px, py = self.positions[:, 0], self.positions[:, 1]
+        mask = (px > x - self.tile_size) & (px < x + w) & (py > y - self.tile_size) & (py < y + h)
+        return self.positions[mask].astype(np.int32).tolist()
@@ -0,0 +1,173 @@
+import numpy as np
+import pygame
+
+# Transformaciones de los 8 octantes para el shadowcasting (xx, xy, yx, yy)
+OCTANTS = [
+    (1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+    (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1)
+]
+
+
+class FieldOfView:
+    """
+    Campo de visión por shadowcasting recursivo sobre la rejilla del nivel.
+
+    - visible: celdas que el jugador ve ahora mismo.
+    - explored: celdas vistas alguna vez (la memoria del mapa).
+
+    Solo se recalcula cuando el jugador cambia de tile; version cambia con
+    cada recálculo para que las cachés de pintado sepan cuándo rehacerse.
+    """
+
+    def __init__(self, opaque, radius=8):
+        self.rows, self.cols = opaque.shape
+        self.radius = radius
+        self._opaque = opaque.tolist()
+        self.visible = np.zeros(opaque.shape, dtype=bool)
+        self.explored = np.zeros(opaque.shape, dtype=bool)
+        self.origin = None
+        self.version = 0
+        self._cells = []
+
+    def is_visible(self, col, row):
+        return 0 <= row < self.rows and 0 <= col < self.cols and bool(self.visible[row, col])
+
+    def update(self, origin):
+        """
+        Recalcula la visión desde origin (columna, fila). Devuelve True si ha cambiado
+        """
+        if origin == self.origin:
+            return False
+        self.origin = origin
+
+        cells = [(origin[1], origin[0])]
+        for octant in OCTANTS:
+            self._cast_light(origin, 1, 1.0, 0.0, octant, cells)
+
+        if self._cells:
+            rows, cols = zip(*self._cells)
+            self.visible[rows, cols] = False
+        rows, cols = zip(*cells)
+        self.visible[rows, cols] = True
+        self.explored[rows, cols] = True
+        self._cells = cells
+        self.version += 1
+        return True
+
+    def _cast_light(self, origin, row, start, end, octant, cells):
+        if start < end:
+            return
+        origin_col, origin_row = origin
+        xx, xy, yx, yy = octant
+        radius_sq = self.radius * self.radius
+        new_start = start
+
+        for distance in range(row, self.radius + 1):
+            dy = -distance
+            blocked = False
+            for dx in range(-distance, 1):
+                col = origin_col + dx * xx + dy * xy
+                row_ = origin_row + dx * yx + dy * yy
+                left_slope = (dx - 0.5) / (dy + 0.5)
+                right_slope = (dx + 0.5) / (dy - 0.5)
+                if start < right_slope:
+                    continue
+                if end > left_slope:
+                    break
+
+                inside = 0 <= row_ < self.rows and 0 <= col < self.cols
+                if inside and dx * dx + dy * dy <= radius_sq:
+                    cells.append((row_, col))
+                opaque = not inside or self._opaque[row_][col]
+
+                if blocked:
+                    if opaque:
+                        new_start = right_slope
+                    else:
+                        blocked = False
+                        start = new_start
+                elif opaque and distance < self.radius:
+                    # Empieza una sombra: se sigue por la parte visible del octante
+                    blocked = True
+                    self._cast_light(origin, distance + 1, start, left_slope, octant, cells)
+                    new_start = right_slope
+            if blocked:
+                break
+
+
+class DarknessOverlay:
+    """
+    Capa de oscuridad de la niebla de guerra, cacheada.
+
+    Es un mapa de luz del tamaño de la vista (blanco lo visible, gris lo
+    explorado, negro lo desconocido) que se compone sobre el mapa con un
+    solo blit multiplicativo. Entre frames solo se repintan los tiles cuya
+    luz ha cambiado: cuando la cámara pasa a otro tile la superficie se
+    desplaza con scroll() y solo hay que rellenar la franja nueva.
+    """
+
+    def __init__(self, fov, tile_size, view_size, remembered_light=85):
+        self.fov = fov
+        self.tile_size = tile_size
+        self.view_cols = view_size[0] // tile_size + 2
+        self.view_rows = view_size[1] // tile_size + 2
+        self.remembered_light = remembered_light
+
+        self._surface = pygame.Surface((self.view_cols * tile_size, self.view_rows * tile_size)).convert()
+        self._light = None  # Luz de cada tile de la ventana pintada
+        self._origin = None
+        self._version = None
+        self.tiles_filled = 0
+
+    def _window(self, layer, col0, row0):
+        # Ventana de la capa bajo la vista; lo que cae fuera del mapa cuenta como no explorado
+        window = np.zeros((self.view_rows, self.view_cols), dtype=bool)
+        top, left = max(0, -row0), max(0, -col0)
+        part = layer[row0 + top:row0 + self.view_rows, col0 + left:col0 + self.view_cols]
+        window[top:top + part.shape[0], left:left + part.shape[1]] = part
+        return window
+
+    def _light_window(self, col0, row0):
+        visible = self._window(self.fov.visible, col0, row0)
+        explored = self._window(self.fov.explored, col0, row0)
+        return np.where(visible, 255, np.where(explored, self.remembered_light, 0)).astype(np.int16)
+
+    def _refresh(self, col0, row0):
+        light = self._light_window(col0, row0)
+        previous = np.full(light.shape, -1, dtype=np.int16)
+
+        if self._light is not None:
+            # Reutilizamos lo ya pintado, desplazado si la cámara ha cambiado de tile
+            shift_x = self._origin[0] - col0
+            shift_y = self._origin[1] - row0
+            if abs(shift_x) < self.view_cols and abs(shift_y) < self.view_rows:
+                if shift_x or shift_y:
+                    self._surface.scroll(shift_x * self.tile_size, shift_y * self.tile_size)
+                src_rows = slice(max(0, -shift_y), self.view_rows - max(0, shift_y))
+                src_cols = slice(max(0, -shift_x), self.view_cols - max(0, shift_x))
+                dst_rows = slice(max(0, shift_y), self.view_rows - max(0, -shift_y))
+                dst_cols = slice(max(0, shift_x), self.view_cols - max(0, -shift_x))
+                previous[dst_rows, dst_cols] = self._light[src_rows, src_cols]
+
+        size = self.tile_size
+        changed = np.argwhere(light != previous)
+        for row, col in changed:
+            value = int(light[row, col])
+            self._surface.fill((value, value, value), (col * size, row * size, size, size))
+        self.tiles_filled += len(changed)
+
+        self._light = light
+        self._origin = (col0, row0)
+        self._version = self.fov.version
+
+    def draw(self, screen, offset=(0, 0)):
+        offset_x, offset_y = offset
+        col0 = offset_x // self.tile_size
+        row0 = offset_y // self.tile_size
+        if (col0, row0) != self._origin or self.fov.version != self._version:
+            self._refresh(col0, row0)
+        screen.blit(
+            self._surface,
+            (col0 * self.tile_size - offset_x, row0 * self.tile_size - offset_y),
+            special_flags=pygame.BLEND_RGB_MULT
+        )
@@ -0,0 +1,88 @@
+import random
+
+
+def split_sentences(chunks):
+    """
+    Divide los chunks del NLTKTextSplitter en frases, sin líneas vacías ni
+    repetidas (el solapamiento entre chunks duplica frases)
+    """
+    sentences = {}
+    for chunk in chunks:
+        for line in chunk.split("\n"):
+            line = line.strip()
+            if line:
+                sentences[line] = None
+    return list(sentences)
+
+
+class FragmentIndex:
+    """
+    Índice en memoria de las frases de cada libro, construido en la ingesta.
+    Permite elegir fragmentos al azar de todo el libro sin consultar el vector store.
+    """
+
+    def __init__(self):
+        self.books = {}
+
+    @classmethod
+    def from_manifest(cls, manifest):
+        index = cls()
+        for entry in manifest.books.values():
+            # Las entradas de checkpoint (libro a medio ingerir) aún no tienen frases
+            if entry.get('sentences'):
+                index.books[entry['name']] = entry['sentences']
+        return index
+
+    def sampler(self, book_name, no_repeat=False, rng=random):
+        # Un libro sin frases indexadas da un sampler vacío: Jayce responde sin fragmento
+        return FragmentSampler(self.books.get(book_name, []), no_repeat, rng)
+
+
+class FragmentSampler:
+    """
+    Muestreo de frases de un libro durante una conversación.
+
+    Con no_repeat no se repite ninguna frase hasta haber usado todas: cada
+    extracción intercambia la frase elegida con la última del bloque
+    pendiente, así que sigue siendo O(1).
+
+    Un turno especulativo (saludo anticipado) elige con peek, sin gastar la
+    frase; si el saludo se usa, take la da por usada.
+    """
+
+    def __init__(self, sentences, no_repeat=False, rng=random):
+        self.sentences = list(sentences)
+        self.no_repeat = no_repeat
+        self.rng = rng
+        self._remaining = len(self.sentences)
+        self._positions = {sentence: i for i, sentence in enumerate(self.sentences)}
+
+    def next(self, peek=False):
+        if not self.sentences:
+            return ""
+        if not self.no_repeat:
+            return self.sentences[self.rng.randrange(len(self.sentences))]
+
+        if self._remaining == 0:
+            # Ya se han usado todas: empezamos una nueva ronda
+            self._remaining = len(self.sentences)
+
+        i = self.rng.randrange(self._remaining)
+        return self.sentences[i] if peek else self._take(i)
+
+    def take(self, sentence):
+        """
+        Da por usada una frase elegida con peek (si aún estaba pendiente)
+        """
+        i = self._positions.get(sentence)
+        if self.no_repeat and i is not None and i < self._remaining:
+            self._take(i)
+
+    def _take(self, i):
+        last = self._remaining - 1
+        sentences = self.sentences
+        sentences[i], sentences[last] = sentences[last], sentences[i]
+        self._positions[sentences[i]] = i
+        self._positions[sentences[last]] = last
+        self._remaining = last
+        return sentences[last]
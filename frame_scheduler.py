@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+
+class FrameScheduler:
+    """
+    Ritmo de frames compatible con asyncio.
+
+    En lugar de bloquear el bucle de eventos con clock.tick, end_frame espera
+    con await hasta el siguiente deadline, así las tareas pendientes (las
+    peticiones a los NPCs) avanzan durante el tiempo libre de cada frame.
+
+    Si se indica update_hz, la simulación avanza a paso fijo: begin_frame
+    devuelve cuántos pasos de actualización tocan en este frame, de forma
+    independiente a la frecuencia de render.
+    """
+
+    def __init__(self, fps=60, update_hz=None, max_updates_per_frame=5):
+        self.frame_budget = 1.0 / fps
+        self.update_step = 1.0 / update_hz if update_hz else None
+        self.max_updates_per_frame = max_updates_per_frame
+
+        self.frame_start = time.perf_counter()
+        self.next_deadline = self.frame_start + self.frame_budget
+        self.accumulator = 0.0
+
+        # Medidas del último frame, en segundos
+        self.work_time = 0.0
+        self.frame_time = self.frame_budget
+
+    @property
+    def update_dt(self):
+        """
+        Duración simulada de cada paso de actualización, en segundos
+        """
+        return self.update_step if self.update_step is not None else self.frame_budget
+
+    def begin_frame(self):
+        """
+        Marca el inicio del frame y devuelve el número de pasos de simulación
+        """
+        if self.update_step is None:
+            return 1
+
+        self.accumulator += self.frame_time
+        steps = int(self.accumulator // self.update_step)
+        if steps > self.max_updates_per_frame:
+            # Si vamos muy atrasados descartamos tiempo en vez de encadenar pasos
+            steps = self.max_updates_per_frame
+            self.accumulator = 0.0
+        else:
+            self.accumulator -= steps * self.update_step
+        return steps
+
+    async def end_frame(self):
+        """
+        Espera hasta el deadline del siguiente frame cediendo el control a asyncio.
+        Devuelve la duración total del frame en milisegundos, como clock.tick
+        """
+        now = time.perf_counter()
+        self.work_time = now - self.frame_start
+
+        delay = self.next_deadline - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            # Vamos tarde: cedemos igualmente y no intentamos recuperar frames perdidos
+            await asyncio.sleep(0)
+            if -delay > self.frame_budget:
+                self.next_deadline = now
+
+        end = time.perf_counter()
+        self.frame_time = end - self.frame_start
+        self.frame_start = end
+        self.next_deadline += self.frame_budget
+        return self.frame_time * 1000
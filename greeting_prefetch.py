@@ -0,0 +1,151 @@
+import asyncio
+import time
+
+from chat_log import ChatLog
+
+
+class Prefetch:
+    def __init__(self, task, snapshot, scratch):
+        self.task = task
+        self.snapshot = snapshot
+        self.scratch = scratch
+        self.started = time.perf_counter()
+        self.finished = None
+
+    @property
+    def done(self):
+        return self.task.done()
+
+    def reply(self):
+        # Entradas que añadió la respuesta del NPC sobre la conversación de partida
+        return self.scratch[len(self.snapshot):]
+
+    def result(self):
+        # Lo que devolvió respond: los cambios en la sesión que hay que aplicar al usar el saludo
+        return self.task.result()
+
+
+class GreetingPrefetcher:
+    """
+    Genera el saludo de un NPC en segundo plano cuando el jugador se acerca,
+    para que al tocarlo la respuesta ya esté (o esté a medias).
+
+    - La respuesta se escribe en una copia de la conversación y solo se pasa
+      al chat al tocar al NPC, si la conversación no ha cambiado entretanto.
+      La petición es especulativa: no cambia la sesión de diálogo, y quien
+      reclama el saludo aplica su resultado (Prefetch.result).
+    - Si el jugador se aleja (radius + 1 tiles) con la petición en curso, se
+      cancela: el gasto máximo es lo generado mientras estaba cerca. Un
+      saludo ya terminado se guarda para la próxima vez.
+    - Como mucho una petición especulativa por NPC, y no se repite antes de
+      cooldown segundos.
+    """
+
+    def __init__(self, radius=3, cooldown=5.0):
+        self.radius = radius
+        self.cooldown = cooldown
+        self.entries = {}
+        self._last_start = {}
+
+        self.started = 0
+        self.committed = 0
+        self.cancelled = 0
+        self.stale = 0
+        self.wasted_seconds = 0.0
+        self.wasted_chars = 0
+        self.saved_seconds = 0.0
+
+    def _discard(self, npc, reason):
+        entry = self.entries.pop(npc)
+        if not entry.done:
+            entry.task.cancel()
+        end = entry.finished or time.perf_counter()
+        self.wasted_seconds += end - entry.started
+        self.wasted_chars += sum(len(message) for message in entry.reply())
+        if reason == 'cancelled':
+            self.cancelled += 1
+        else:
+            self.stale += 1
+
+    def update(self, npc, distance, messages, respond):
+        """
+        Llamar en cada paso con la distancia (en tiles) del jugador al NPC.
+        respond(scratch) devuelve la corrutina que genera la respuesta sobre scratch
+        """
+        if not self.radius:
+            return
+        entry = self.entries.get(npc)
+
+        if distance > self.radius + 1:
+            if entry is not None and not entry.done:
+                self._discard(npc, 'cancelled')
+            return
+        if distance > self.radius:
+            return
+
+        if entry is not None:
+            if tuple(messages) == entry.snapshot:
+                return
+            # La conversación ha cambiado: el saludo preparado ya no vale
+            self._discard(npc, 'stale')
+
+        now = time.perf_counter()
+        if now - self._last_start.get(npc, -self.cooldown) < self.cooldown:
+            return
+
+        scratch = ChatLog(messages)
+        entry = Prefetch(asyncio.create_task(respond(scratch)), tuple(messages), scratch)
+        entry.task.add_done_callback(lambda _: setattr(entry, 'finished', time.perf_counter()))
+        self.entries[npc] = entry
+        self._last_start[npc] = now
+        self.started += 1
+
+    async def claim(self, npc, messages):
+        """
+        Al tocar al NPC: pasa el saludo preparado al chat y devuelve su
+        Prefetch. Devuelve None si no había ninguno válido y hay que pedirlo
+        de la forma normal
+        """
+        entry = self.entries.get(npc)
+        if entry is None:
+            return None
+        if tuple(messages) != entry.snapshot:
+            self._discard(npc, 'stale')
+            return None
+
+        # Si aún se está generando, esperamos lo que falta
+        try:
+            await asyncio.shield(entry.task)
+        except asyncio.CancelledError:
+            # El saludo se ha sustituido por un mensaje del jugador
+            if self.entries.get(npc) is entry:
+                self._discard(npc, 'stale')
+            raise
+        if self.entries.get(npc) is not entry or entry.task.cancelled() or entry.task.exception():
+            return None
+        if tuple(messages) != entry.snapshot:
+            self._discard(npc, 'stale')
+            return None
+
+        del self.entries[npc]
+        messages.extend(entry.reply())
+        self.committed += 1
+        # Tiempo de respuesta que el jugador se ha ahorrado
+        self.saved_seconds += entry.finished - entry.started
+        return entry
+
+    def cancel_all(self):
+        for npc in list(self.entries):
+            if not self.entries[npc].done:
+                self._discard(npc, 'cancelled')
+
+    def stats(self):
+        return {
+            'started': self.started,
+            'committed': self.committed,
+            'cancelled': self.cancelled,
+            'stale': self.stale,
+            'wasted_seconds': round(self.wasted_seconds, 3),
+            'wasted_chars': self.wasted_chars,
+            'saved_seconds': round(self.saved_seconds, 3)
+        }
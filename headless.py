@@ -0,0 +1,280 @@
+"""
+Modo headless: ejecuta el juego sin ventana (driver de vídeo dummy de SDL),
+con la entrada sacada de una traza o de un piloto automático con semilla, y
+mide el tiempo de cada fase del frame.
+
+    python headless.py --frames 2000 --size 120x80
+    python headless.py --level level.txt --trace trace.json --json report.json
+    python headless.py --hud    con el overlay de rendimiento (mide su coste en la fase hud)
+    python headless.py --service http://127.0.0.1:8765    NPCs en el servicio de diálogo
+
+Formato de la traza (lista JSON de pasos, se ejecutan en orden):
+    {"hold": ["LEFT", "UP"], "frames": 30}   mantiene teclas pulsadas N frames
+    {"wait": 30}                             N frames sin pulsar nada
+    {"type": "hola"}                         escribe texto en el chat
+    {"press": "RETURN"}                      pulsa una tecla (RETURN, ESCAPE...)
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+# Sin red por defecto: los NPCs usan los modelos locales
+os.environ.setdefault('LLM_BACKEND', 'offline')
+
+import numpy as np
+import pygame
+
+import app
+from dungeon_generator import generate_dungeon
+
+PHASES = ('events', 'update', 'map', 'chat', 'hud', 'frame')
+DIRECTIONS = ('LEFT', 'RIGHT', 'UP', 'DOWN')
+
+
+class HeldKeys:
+    """
+    Sustituto de pygame.key.get_pressed() con las teclas de la traza
+    """
+
+    def __init__(self, names=()):
+        self.codes = {getattr(pygame, f"K_{name}") for name in names}
+
+    def __getitem__(self, key):
+        return key in self.codes
+
+
+def _key_event(name, unicode=''):
+    return pygame.event.Event(pygame.KEYDOWN, key=getattr(pygame, f"K_{name}"), unicode=unicode, mod=0)
+
+
+def _type_events(text):
+    return [pygame.event.Event(pygame.KEYDOWN, key=0, unicode=char, mod=0) for char in text]
+
+
+class TraceInput:
+    """
+    Reproduce una traza de entrada paso a paso
+    """
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self.index = 0
+        self.remaining = None
+
+    def next_frame(self, game):
+        if self.index >= len(self.steps):
+            return None
+
+        step = self.steps[self.index]
+        if 'type' in step or 'press' in step:
+            self.index += 1
+            events = _type_events(step['type']) if 'type' in step else [_key_event(step['press'])]
+            return events, HeldKeys()
+
+        if self.remaining is None:
+            self.remaining = step.get('frames', step.get('wait', 1))
+        self.remaining -= 1
+        if self.remaining <= 0:
+            self.index += 1
+            self.remaining = None
+        return [], HeldKeys(step.get('hold', ()))
+
+
+class AutopilotInput:
+    """
+    Entrada generada con semilla: paseo aleatorio por el mapa y, cada vez que
+    se abre un chat, escribe un mensaje, espera y lo cierra
+    """
+
+    def __init__(self, seed=0, chat_frames=90, message="¿Qué libro es?"):
+        self.rng = random.Random(seed)
+        self.chat_frames = chat_frames
+        self.message = message
+        self.direction = None
+        self.direction_frames = 0
+        self.chat_frame = 0
+
+    def next_frame(self, game):
+        if game.chat_active:
+            self.chat_frame += 1
+            if self.chat_frame == 10:
+                return _type_events(self.message) + [_key_event('RETURN', '\r')], HeldKeys()
+            if self.chat_frame >= self.chat_frames:
+                self.chat_frame = 0
+                return [_key_event('ESCAPE', '\x1b')], HeldKeys()
+            return [], HeldKeys()
+
+        if self.direction_frames <= 0:
+            self.direction = self.rng.choice(DIRECTIONS)
+            self.direction_frames = self.rng.randint(10, 60)
+        self.direction_frames -= 1
+        return [], HeldKeys([self.direction])
+
+
+async def run_headless(level_data, input_source, frames, hud=False, service_url=None):
+    pygame.init()
+    rows = len(level_data)
+    cols = len(level_data[0]) if rows > 0 else 0
+    screen = pygame.display.set_mode(app.window_size(level_data))
+
+    # Aquí el motor de diálogo se carga (o la sesión del servicio se abre) antes de
+    # empezar, para que todas las ejecuciones midan lo mismo
+    client = None
+    if service_url:
+        from dialogue_client import DialogueClient
+        client = DialogueClient(service_url)
+        engine, fragment_index = None, None
+    else:
+        # En un hilo: la ingesta tiene su propio bucle asyncio
+        engine, fragment_index = await asyncio.to_thread(app.init_dialogue)
+    # Reloj simulado a app.FPS: los frames headless van más rápido que el tiempo
+    # real y los tiempos de animación y de espera de los NPCs deben ser los del juego
+    frame = 0
+    game = app.Game(screen, level_data, engine, fragment_index, clock=lambda: frame * 1000 // app.FPS)
+    if client is not None:
+        game.set_remote_dialogue(await client.create_session())
+    if hud != game.perf_hud.visible:
+        game.perf_hud.toggle()
+
+    timings = {phase: [] for phase in PHASES}
+    chat_frames = 0
+
+    for frame in range(frames):
+        frame_start = time.perf_counter()
+
+        # Fase 1: eventos
+        scripted = input_source.next_frame(game)
+        if scripted is None:
+            break
+        events, keys = scripted
+        for event in pygame.event.get() + events:
+            game.handle_event(event)
+        t_events = time.perf_counter()
+        if not game.running or game.game_over:
+            break
+
+        # Fase 2: actualización
+        if not game.chat_active:
+            game.update(keys, game.clock())
+        t_update = time.perf_counter()
+
+        # Fase 3: mapa
+        game.draw_map()
+        t_map = time.perf_counter()
+
+        # Fase 4: chat
+        if game.chat_active:
+            game.draw_chat()
+            timings['chat'].append(time.perf_counter() - t_map)
+            chat_frames += 1
+
+        # Fase 5: overlay de rendimiento
+        if game.perf_hud.visible:
+            t_hud = time.perf_counter()
+            game.draw_hud()
+            timings['hud'].append(time.perf_counter() - t_hud)
+
+        pygame.display.flip()
+        frame_end = time.perf_counter()
+        game.perf_hud.record_frame((frame_end - frame_start) * 1000, (frame_end - frame_start) * 1000)
+
+        timings['events'].append(t_events - frame_start)
+        timings['update'].append(t_update - t_events)
+        timings['map'].append(t_map - t_update)
+        timings['frame'].append(frame_end - frame_start)
+
+        # Dejamos avanzar las tareas de los NPCs sin esperar al ritmo de 60 FPS
+        await asyncio.sleep(0)
+
+    dialogue = game.dialogue_scheduler.stats()
+    game.dialogue_scheduler.cancel_all()
+    game.greetings.cancel_all()
+    prefetch = game.greetings.stats()
+    pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    await game.dialogue.close()
+    if client is not None:
+        await client.aclose()
+
+    pygame.quit()
+    return summarize(timings, cols, rows, chat_frames, dialogue, prefetch)
+
+
+def summarize(timings, cols, rows, chat_frames, dialogue=None, prefetch=None):
+    report = {
+        'map_size': [cols, rows],
+        'frames': len(timings['frame']),
+        'chat_frames': chat_frames,
+        'phases': {},
+        'dialogue': dialogue or {},
+        'greeting_prefetch': prefetch or {}
+    }
+    for phase, values in timings.items():
+        if not values:
+            continue
+        ms = np.array(values) * 1000
+        report['phases'][phase] = {
+            'p50': float(np.percentile(ms, 50)),
+            'p95': float(np.percentile(ms, 95)),
+            'p99': float(np.percentile(ms, 99)),
+            'max': float(ms.max()),
+            'samples': len(values)
+        }
+    return report
+
+
+def print_report(report):
+    cols, rows = report['map_size']
+    print(f"Mapa {cols}x{rows}, {report['frames']} frames ({report['chat_frames']} con chat)")
+    print(f"{'fase':<8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}   (ms)")
+    for phase in PHASES:
+        stats = report['phases'].get(phase)
+        if stats:
+            print(f"{phase:<8}{stats['p50']:>10.3f}{stats['p95']:>10.3f}{stats['p99']:>10.3f}{stats['max']:>10.3f}")
+    for npc, stats in report['dialogue'].items():
+        print(f"NPC {npc}: {stats}")
+    if report['greeting_prefetch']:
+        print(f"Saludos anticipados: {report['greeting_prefetch']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulación headless con medición de tiempos por fase")
+    parser.add_argument('--frames', type=int, default=1800)
+    parser.add_argument('--level', help="Fichero de nivel; si no se indica se genera un mapa")
+    parser.add_argument('--size', default='34x13', help="Tamaño de la mazmorra generada, COLSxROWS")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--trace', help="Traza de entrada en JSON; sin ella se usa el piloto automático")
+    parser.add_argument('--json', help="Guarda el informe en este fichero")
+    parser.add_argument('--hud', action='store_true', help="Dibuja el overlay de rendimiento (F3)")
+    parser.add_argument('--service', help="URL del servicio de diálogo; sin ella los NPCs se ejecutan aquí")
+    args = parser.parse_args()
+
+    if args.level:
+        level_data = app.load_map(args.level)
+    else:
+        cols, rows = (int(v) for v in args.size.lower().split('x'))
+        level_data = generate_dungeon(cols, rows, seed=args.seed)
+
+    if args.trace:
+        with open(args.trace, 'r', encoding='utf-8') as f:
+            input_source = TraceInput(json.load(f))
+    else:
+        input_source = AutopilotInput(args.seed)
+
+    random.seed(args.seed)
+    report = asyncio.run(run_headless(level_data, input_source, args.frames, args.hud, args.service))
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+
+
+MANIFEST_FILE = 'ingestion_manifest.json'
+
+
+def file_hash(file_path):
+    """
+    Calcula el hash SHA-256 del contenido de un fichero
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def settings_fingerprint(splitter_settings, embedding_model):
+    """
+    Huella de la configuración de ingesta: si cambia el splitter o el modelo
+    de embeddings, todos los chunks indexados dejan de ser válidos
+    """
+    payload = json.dumps(
+        {'splitter': splitter_settings, 'embedding_model': embedding_model},
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def chunk_ids(book_name, docs):
+    """
+    IDs estables para los chunks de un libro: dependen del libro y del
+    contenido del chunk, no de su posición, así que los chunks que no
+    cambian conservan su ID entre versiones del fichero
+    """
+    book_key = hashlib.sha1(book_name.encode('utf-8')).hexdigest()[:12]
+    seen = {}
+    ids = []
+    for doc in docs:
+        content_key = hashlib.sha1(doc.page_content.encode('utf-8')).hexdigest()[:16]
+        # Chunks con el mismo texto dentro del libro se distinguen por su ocurrencia
+        occurrence = seen.get(content_key, 0)
+        seen[content_key] = occurrence + 1
+        ids.append(f"{book_key}-{content_key}-{occurrence}")
+    return ids
+
+
+class IngestionManifest:
+    """
+    Registro persistente de lo que ya está indexado en el vector store,
+    indexado por fichero de libro
+    """
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.books = {}
+
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.books = json.load(f).get('books', {})
+
+    def is_reusable(self, book_file):
+        """
+        Los chunks de un libro solo se reutilizan si se indexaron con la
+        misma configuración de splitter y modelo de embeddings
+        """
+        entry = self.books.get(book_file)
+        return entry is not None and entry['fingerprint'] == self.fingerprint
+
+    def is_current(self, book_file, content_hash, book_name):
+        entry = self.books.get(book_file)
+        return (
+            self.is_reusable(book_file)
+            and 'sentences' in entry
+            and entry['hash'] == content_hash
+            and entry['name'] == book_name
+        )
+
+    def indexed_ids(self, book_file):
+        entry = self.books.get(book_file)
+        return set(entry['ids']) if entry else set()
+
+    def all_ids(self):
+        return {chunk_id for entry in self.books.values() for chunk_id in entry['ids']}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(
+                {'books': self.books},
+                f,
+                ensure_ascii=False,
+                indent=2
+            )
+        # Escritura atómica: un cierre a medias no deja el manifiesto corrupto
+        os.replace(tmp_path, self.path)
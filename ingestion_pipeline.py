@@ -0,0 +1,274 @@
+import asyncio
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from conversation_memory import approx_tokens
+from fragment_index import split_sentences
+from ingestion_manifest import chunk_ids, file_hash
+
+
+# Lo mínimo de un Document que necesita chunk_ids
+Chunk = namedtuple('Chunk', 'page_content')
+
+
+def split_book(book_file, book_name, splitter_settings):
+    """
+    Lee y divide un libro en chunks. Se ejecuta en los procesos del pool
+    (la división por frases de NLTK es CPU), así que solo devuelve textos
+    """
+    from langchain_text_splitters import NLTKTextSplitter
+
+    with open(book_file, 'r', encoding='utf-8') as f:
+        full_text = f.read()
+    text_splitter = NLTKTextSplitter(**splitter_settings)
+    return [doc.page_content for doc in text_splitter.create_documents([full_text], [{"book": book_name}])]
+
+
+def make_batches(texts, batch_size, max_batch_tokens):
+    """
+    Agrupa los textos en lotes de como mucho batch_size textos y max_batch_tokens tokens
+    """
+    batch = []
+    tokens = 0
+    for text in texts:
+        size = approx_tokens(text)
+        if batch and (len(batch) == batch_size or tokens + size > max_batch_tokens):
+            yield batch
+            batch = []
+            tokens = 0
+        batch.append(text)
+        tokens += size
+    if batch:
+        yield batch
+
+
+def write_embeddings(vectorstore, ids, texts, embeddings, metadatas):
+    """
+    Escribe en bloque chunks ya embebidos, sin que el vector store los vuelva a embeber
+    """
+    if hasattr(vectorstore, 'add_embeddings'):
+        vectorstore.add_embeddings(texts, embeddings, metadatas, ids)
+    else:
+        upsert_chroma_embeddings(vectorstore, ids, texts, embeddings, metadatas)
+
+
+def upsert_chroma_embeddings(vectorstore, ids, texts, embeddings, metadatas, max_batch=5000):
+    """
+    Único acceso a la colección interna de Chroma (vectorstore._collection).
+
+    Chroma.add_texts y add_documents siempre embeben los textos con su
+    embedding_function y no aceptan embeddings calculados; la ingesta ya los
+    ha pedido en lotes concurrentes con reintentos, y pasar por la API
+    pública los volvería a pedir todos. La colección de chromadb sí los
+    acepta, con un upsert que sustituye los IDs existentes (como add_texts
+    con ids=).
+    """
+    # Lotes por debajo del máximo que admite Chroma en una sola llamada
+    for i in range(0, len(ids), max_batch):
+        vectorstore._collection.upsert(
+            ids=ids[i:i + max_batch],
+            embeddings=embeddings[i:i + max_batch],
+            documents=texts[i:i + max_batch],
+            metadatas=metadatas[i:i + max_batch]
+        )
+
+
+class IngestionPipeline:
+    """
+    Ingesta de libros en streaming, para bibliotecas grandes:
+
+    - Los libros se leen y dividen en un pool de procesos; cada libro pasa
+      a embeberse en cuanto termina su división, sin esperar a los demás.
+    - Los embeddings se piden en lotes (por número de textos y por tokens)
+      con como mucho `concurrency` peticiones a la vez, reintentando con
+      backoff exponencial los fallos.
+    - Los chunks embebidos se escriben en bloque en el vector store, de
+      flush_size en flush_size. El manifiesto hace de checkpoint: tras cada
+      escritura guarda los IDs ya escritos (después de persistir el vector
+      store, si lo necesita), y un arranque interrumpido retoma el libro sin
+      volver a embeber esos chunks.
+
+    Los libros sin cambios no se vuelven a dividir ni a embeber, los
+    modificados solo embeben los chunks nuevos y borran los obsoletos, y los
+    eliminados de la lista se borran del vector store.
+    """
+
+    def __init__(self, vectorstore, embeddings, manifest, splitter_settings, workers=None,
+                 batch_size=64, max_batch_tokens=8000, concurrency=4, flush_size=1024, max_retries=5, backoff=1.0):
+        self.vectorstore = vectorstore
+        self.embeddings = embeddings
+        self.manifest = manifest
+        self.splitter_settings = splitter_settings
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.concurrency = concurrency
+        self.flush_size = flush_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self.stats = {'skipped': 0, 'added': 0, 'deleted': 0, 'batches': 0, 'retries': 0}
+
+    async def _embed_batch(self, semaphore, batch):
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    embeddings = await self.embeddings.aembed_documents(batch)
+                    self.stats['batches'] += 1
+                    return embeddings
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        raise
+                    self.stats['retries'] += 1
+                    delay = self.backoff * 2 ** attempt
+                    print(f"Error al embeber un lote ({e}); reintento en {delay:.1f} s")
+                    await asyncio.sleep(delay)
+
+    def _save(self):
+        # Primero el vector store (NumpyVectorIndex solo escribe en disco al persistir) y luego el
+        # manifiesto, que así nunca da por escritos chunks que no están guardados
+        if hasattr(self.vectorstore, 'persist'):
+            self.vectorstore.persist()
+        self.manifest.save()
+
+    def _forget_missing(self):
+        # Libros del manifiesto con chunks que el vector store no tiene (por ejemplo, un índice
+        # descartado al cargarlo): se vuelven a indexar enteros
+        stored = set(self.vectorstore.get(include=[])['ids'])
+        for book_file, entry in list(self.manifest.books.items()):
+            if not stored.issuperset(entry['ids']):
+                del self.manifest.books[book_file]
+
+    def _remove_deleted_books(self, books):
+        current_files = {book['file'] for book in books}
+        for book_file in list(self.manifest.books):
+            if book_file not in current_files:
+                removed = list(self.manifest.indexed_ids(book_file))
+                if removed:
+                    self.vectorstore.delete(ids=removed)
+                self.stats['deleted'] += len(removed)
+                del self.manifest.books[book_file]
+
+    async def _ingest_book(self, semaphore, book, content_hash, texts):
+        manifest = self.manifest
+        ids = chunk_ids(book['name'], [Chunk(text) for text in texts])
+
+        old_ids = manifest.indexed_ids(book['file'])
+        # Con otra configuración de ingesta no se reutiliza ningún chunk
+        known_ids = old_ids & set(ids) if manifest.is_reusable(book['file']) else set()
+        stale_ids = old_ids - known_ids
+        if stale_ids:
+            self.vectorstore.delete(ids=list(stale_ids))
+            self.stats['deleted'] += len(stale_ids)
+
+        new = [(chunk_id, text) for chunk_id, text in zip(ids, texts) if chunk_id not in known_ids]
+        written = [chunk_id for chunk_id in ids if chunk_id in known_ids]
+
+        # Los lotes de cada libro se embeben a la vez (hasta el límite del
+        # semáforo) y se recogen en orden para escribirlos en bloque
+        tasks = [
+            asyncio.create_task(self._embed_batch(semaphore, batch))
+            for batch in make_batches([text for _, text in new], self.batch_size, self.max_batch_tokens)
+        ]
+        done = 0
+        buffer = []
+        try:
+            for task in tasks:
+                buffer.extend(await task)
+                if len(buffer) >= self.flush_size or task is tasks[-1]:
+                    chunk = new[done:done + len(buffer)]
+                    write_embeddings(
+                        self.vectorstore,
+                        [chunk_id for chunk_id, _ in chunk],
+                        [text for _, text in chunk],
+                        buffer,
+                        [{"book": book['name']}] * len(chunk)
+                    )
+                    written.extend(chunk_id for chunk_id, _ in chunk)
+                    done += len(chunk)
+                    self.stats['added'] += len(chunk)
+                    buffer = []
+                    self._checkpoint(book, content_hash, written)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        manifest.books[book['file']] = {
+            'name': book['name'],
+            'hash': content_hash,
+            'fingerprint': manifest.fingerprint,
+            'ids': ids,
+            # Frases del libro para elegir fragmentos sin consultar el vector store
+            'sentences': split_sentences(texts)
+        }
+        self._save()
+
+    def _checkpoint(self, book, content_hash, written):
+        # Entrada sin 'sentences': el libro no está completo, pero sus IDs se reutilizan al retomarlo
+        self.manifest.books[book['file']] = {
+            'name': book['name'],
+            'hash': content_hash,
+            'fingerprint': self.manifest.fingerprint,
+            'ids': list(written)
+        }
+        self._save()
+
+    def _remove_orphans(self):
+        # Chunks que el manifiesto no conoce (por ejemplo, de arranques anteriores a que existiera)
+        known = self.manifest.all_ids()
+        orphan_ids = [chunk_id for chunk_id in self.vectorstore.get(include=[])['ids'] if chunk_id not in known]
+        if orphan_ids:
+            self.vectorstore.delete(ids=orphan_ids)
+            self.stats['deleted'] += len(orphan_ids)
+
+    async def run(self, books):
+        """
+        Sincroniza el vector store con la lista de libros. Devuelve las estadísticas de la ingesta
+        """
+        started = time.perf_counter()
+        self._forget_missing()
+        self._remove_deleted_books(books)
+
+        pending = []
+        for book in books:
+            content_hash = file_hash(book['file'])
+            if self.manifest.is_current(book['file'], content_hash, book['name']):
+                self.stats['skipped'] += 1
+            else:
+                pending.append((book, content_hash))
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        workers = min(self.workers or os.cpu_count() or 1, len(pending))
+        loop = asyncio.get_running_loop()
+        if workers > 1:
+            # spawn: el juego tiene hilos y SDL abiertos, mejor no hacer fork
+            executor = ProcessPoolExecutor(workers, mp_context=get_context('spawn'))
+        else:
+            executor = None
+
+        async def split(book, content_hash):
+            texts = await loop.run_in_executor(executor, split_book, book['file'], book['name'], self.splitter_settings)
+            return book, content_hash, texts
+
+        ingests = []
+        try:
+            # Cada libro empieza a embeberse en cuanto termina su división
+            for next_split in asyncio.as_completed([split(book, content_hash) for book, content_hash in pending]):
+                book, content_hash, texts = await next_split
+                ingests.append(asyncio.create_task(self._ingest_book(semaphore, book, content_hash, texts)))
+            await asyncio.gather(*ingests)
+        finally:
+            for task in ingests:
+                task.cancel()
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+        self._remove_orphans()
+        self._save()
+
+        self.stats['seconds'] = time.perf_counter() - started
+        self.stats['chunks_per_sec'] = self.stats['added'] / self.stats['seconds'] if self.stats['seconds'] else 0.0
+        return self.stats
@@ -0,0 +1,139 @@
+from collections import OrderedDict
+
+import pygame
+
+
+class MapRenderer:
+    """
+    Pinta el mapa a partir de trozos (chunks) pre-renderizados.
+
+    El mapa se divide en chunks de chunk_tiles x chunk_tiles tiles. Cada chunk
+    se dibuja (suelo y tiles estáticos) la primera vez que entra en la vista y
+    se guarda en una caché LRU de max_chunks superficies, así que el coste de
+    un frame depende del tamaño de la ventana y no del tamaño del mapa.
+
+    Los tiles condicionales (por ejemplo el cofre 'W', que solo aparece cuando
+    Jayce recuerda el libro) van en una capa aparte que solo se recalcula
+    cuando cambia el conjunto de tiles condicionales visibles.
+    """
+
+    def __init__(self, level_data, tile_mapping, floor_tile, tile_size, conditional_tiles=(),
+                 chunk_tiles=8, max_chunks=48):
+        self.tile_mapping = tile_mapping
+        self.floor_tile = floor_tile
+        self.tile_size = tile_size
+        self.conditional_tiles = frozenset(conditional_tiles)
+        self.chunk_tiles = chunk_tiles
+        self.chunk_size = chunk_tiles * tile_size
+        self.max_chunks = max_chunks
+
+        self._chunks = OrderedDict()
+        self._overlay = []
+        self._overlay_key = None
+        self.chunks_built = 0
+        self.set_level(level_data)
+
+    def set_level(self, level_data):
+        """
+        Cambia el mapa e invalida las cachés
+        """
+        self.level_data = level_data
+        self.rows = len(level_data)
+        self.cols = len(level_data[0]) if self.rows > 0 else 0
+
+        # Posiciones de los tiles condicionales, para no recorrer el mapa al cambiar la capa
+        self._conditional_positions = {char: [] for char in self.conditional_tiles}
+        for row_index, row in enumerate(level_data):
+            for col_index, tile_char in enumerate(row):
+                if tile_char in self._conditional_positions:
+                    self._conditional_positions[tile_char].append(
+                        (col_index * self.tile_size, row_index * self.tile_size)
+                    )
+        self.invalidate()
+
+    def invalidate(self):
+        self._chunks.clear()
+        self._overlay_key = None
+
+    @property
+    def world_size(self):
+        return self.cols * self.tile_size, self.rows * self.tile_size
+
+    def _build_chunk(self, chunk_x, chunk_y):
+        col0 = chunk_x * self.chunk_tiles
+        row0 = chunk_y * self.chunk_tiles
+        col1 = min(col0 + self.chunk_tiles, self.cols)
+        row1 = min(row0 + self.chunk_tiles, self.rows)
+        surface = pygame.Surface(((col1 - col0) * self.tile_size, (row1 - row0) * self.tile_size)).convert()
+
+        for row_index in range(row0, row1):
+            row = self.level_data[row_index]
+            for col_index in range(col0, col1):
+                tile_char = row[col_index]
+                x = (col_index - col0) * self.tile_size
+                y = (row_index - row0) * self.tile_size
+
+                # Siempre dibujamos el suelo
+                surface.blit(self.floor_tile, (x, y))
+
+                # Los tiles condicionales van en la capa superior
+                if tile_char in self.tile_mapping and tile_char not in self.conditional_tiles:
+                    surface.blit(self.tile_mapping[tile_char], (x, y))
+
+        self.chunks_built += 1
+        return surface
+
+    def _chunk(self, chunk_x, chunk_y):
+        key = (chunk_x, chunk_y)
+        surface = self._chunks.get(key)
+        if surface is not None:
+            self._chunks.move_to_end(key)
+            return surface
+
+        surface = self._build_chunk(chunk_x, chunk_y)
+        self._chunks[key] = surface
+        while len(self._chunks) > self.max_chunks:
+            self._chunks.popitem(last=False)
+        return surface
+
+    def _build_overlay(self, visible_conditional):
+        overlay = []
+        for tile_char in visible_conditional:
+            if tile_char in self.tile_mapping:
+                overlay.extend((self.tile_mapping[tile_char], pos) for pos in self._conditional_positions[tile_char])
+        self._overlay = overlay
+        self._overlay_key = visible_conditional
+
+    def draw(self, screen, visible_conditional=frozenset(), offset=(0, 0)):
+        """
+        Dibuja la parte del mapa que cabe en screen, con la esquina superior
+        izquierda en offset (coordenadas del mundo). visible_conditional indica
+        qué tiles condicionales deben mostrarse en este frame. Devuelve el
+        número de blits
+        """
+        view_width, view_height = screen.get_size()
+        offset_x, offset_y = offset
+
+        # Solo los chunks que se solapan con la vista
+        first_x = max(0, offset_x // self.chunk_size)
+        first_y = max(0, offset_y // self.chunk_size)
+        last_x = min((self.cols - 1) // self.chunk_tiles, (offset_x + view_width - 1) // self.chunk_size)
+        last_y = min((self.rows - 1) // self.chunk_tiles, (offset_y + view_height - 1) // self.chunk_size)
+        blits = 0
+        for chunk_y in range(first_y, last_y + 1):
+            for chunk_x in range(first_x, last_x + 1):
+                screen.blit(
+                    self._chunk(chunk_x, chunk_y),
+                    (chunk_x * self.chunk_size - offset_x, chunk_y * self.chunk_size - offset_y)
+                )
+                blits += 1
+
+        visible_conditional = frozenset(visible_conditional) & self.conditional_tiles
+        if visible_conditional != self._overlay_key:
+            self._build_overlay(visible_conditional)
+
+        for sprite, (x, y) in self._overlay:
+            if offset_x - self.tile_size < x < offset_x + view_width and offset_y - self.tile_size < y < offset_y + view_height:
+                screen.blit(sprite, (x - offset_x, y - offset_y))
+                blits += 1
+        return blits
@@ -0,0 +1,301 @@
+import json
+import os
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+VECTORS_FILE = 'vectors.npy'
+METADATA_FILE = 'metadata.json'
+
+
+class NumpyVectorIndex(VectorStore):
+    """
+    Vector store en proceso para un corpus pequeño, alternativa a Chroma sin
+    SQLite: los embeddings (float32, normalizados) van en un .npy que se abre
+    con mmap y los textos y metadatos en un JSON al lado.
+
+    - La búsqueda es similitud coseno por fuerza bruta con NumPy (un producto
+      matriz-vector y argpartition), también por lotes de consultas.
+    - filter admite igualdad por metadato ($eq y $in); el filtro por 'book'
+      usa un array de códigos precalculado, sin recorrer los metadatos en
+      Python.
+    - Tiene la misma interfaz que usa el juego de Chroma: as_retriever,
+      add_documents, delete y get.
+    - Las escrituras solo cambian la memoria; persist() guarda el índice
+      entero en disco, así que quien escribe en muchos lotes (la ingesta)
+      lo llama en sus checkpoints y no tras cada lote.
+    """
+
+    def __init__(self, embedding_function, persist_directory=None):
+        self.embedding_function = embedding_function
+        self.persist_directory = persist_directory
+
+        self._ids = []
+        self._texts = []
+        self._metadatas = []
+        self._vectors = None
+        self._book_codes = np.zeros(0, dtype=np.int32)
+        self._book_names = {}
+        self._positions = {}
+        self._dirty = False
+        # Memoria reservada para las filas que se añaden; _vectors y _book_codes son vistas de sus primeras filas
+        self._vector_buffer = None
+        self._code_buffer = None
+
+        if persist_directory and os.path.exists(os.path.join(persist_directory, METADATA_FILE)):
+            self._load()
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    def __len__(self):
+        return len(self._ids)
+
+    # Persistencia
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.persist_directory, METADATA_FILE), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            count = data['count']
+            vectors = None
+            if count:
+                # Solo se leen de disco las páginas que tocan las consultas
+                vectors = np.load(os.path.join(self.persist_directory, VECTORS_FILE), mmap_mode='r')
+            rows = vectors.shape[0] if vectors is not None and vectors.ndim == 2 else 0
+            if not count == rows == len(data['ids']) == len(data['texts']) == len(data['metadatas']):
+                raise ValueError(f"{rows} vectores para {count} chunks")
+        except (OSError, ValueError, KeyError) as e:
+            # Un cierre entre la escritura de los dos ficheros deja el índice a medias: se empieza vacío
+            # y la ingesta vuelve a indexar los libros que faltan
+            print(f"Índice de vectores no válido en {self.persist_directory} ({e}); se empieza vacío")
+            return
+        self._ids = data['ids']
+        self._texts = data['texts']
+        self._metadatas = data['metadatas']
+        self._vectors = vectors
+        self._index_books()
+
+    def persist(self):
+        """
+        Guarda el índice en disco si ha cambiado desde el último persist
+        """
+        if self._dirty:
+            self._save()
+            self._dirty = False
+
+    def _save(self):
+        if not self.persist_directory:
+            return
+        os.makedirs(self.persist_directory, exist_ok=True)
+        vectors_path = os.path.join(self.persist_directory, VECTORS_FILE)
+        metadata_path = os.path.join(self.persist_directory, METADATA_FILE)
+
+        # Escritura atómica de cada fichero; el JSON va al final con el número de filas,
+        # y _load descarta el índice si no coincide con el .npy
+        with open(vectors_path + '.tmp', 'wb') as f:
+            np.save(f, self._vector_matrix())
+        os.replace(vectors_path + '.tmp', vectors_path)
+        with open(metadata_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(
+                {'count': len(self._ids), 'ids': self._ids, 'texts': self._texts, 'metadatas': self._metadatas},
+                f,
+                ensure_ascii=False
+            )
+        os.replace(metadata_path + '.tmp', metadata_path)
+
+    def _vector_matrix(self):
+        if self._vectors is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self._vectors
+
+    def _index_books(self):
+        # Posición de cada ID y código de libro de cada chunk, desde cero (al cargar y tras borrar);
+        # al añadir solo se indexan las filas nuevas
+        self._positions = {chunk_id: i for i, chunk_id in enumerate(self._ids)}
+        self._book_names = {}
+        codes = np.empty(len(self._metadatas), dtype=np.int32)
+        for i, metadata in enumerate(self._metadatas):
+            codes[i] = self._book_names.setdefault(metadata.get('book'), len(self._book_names))
+        self._book_codes = codes
+        # Las vistas ya no apuntan a los buffers: el siguiente add reserva otros
+        self._vector_buffer = None
+        self._code_buffer = None
+
+    def _append_rows(self, vectors, metadatas):
+        # Las filas nuevas se copian en buffers que crecen al doble, así añadir por lotes
+        # cuesta lo que el lote y no lo que el índice entero
+        start = len(self._book_codes)
+        end = start + len(vectors)
+        if self._vector_buffer is None or len(self._vector_buffer) < end:
+            capacity = max(end, 2 * start)
+            vector_buffer = np.empty((capacity, vectors.shape[1]), dtype=np.float32)
+            code_buffer = np.empty(capacity, dtype=np.int32)
+            if start:
+                vector_buffer[:start] = self._vectors
+                code_buffer[:start] = self._book_codes
+            self._vector_buffer = vector_buffer
+            self._code_buffer = code_buffer
+
+        self._vector_buffer[start:end] = vectors
+        for i, metadata in enumerate(metadatas, start):
+            self._code_buffer[i] = self._book_names.setdefault(metadata.get('book'), len(self._book_names))
+        self._vectors = self._vector_buffer[:end]
+        self._book_codes = self._code_buffer[:end]
+
+    # Escritura
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None):
+        """
+        Añade textos ya embebidos; los IDs existentes se sustituyen
+        """
+        texts = list(texts)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        ids = list(ids) if ids is not None else [f"{len(self._ids) + i}" for i in range(len(texts))]
+        if not texts:
+            return []
+
+        replaced = {chunk_id for chunk_id in ids if chunk_id in self._positions}
+        if replaced:
+            self._remove(replaced)
+            self._index_books()
+
+        metadatas = [dict(metadata) for metadata in metadatas]
+        self._append_rows(self._normalize(embeddings), metadatas)
+        self._positions.update((chunk_id, i) for i, chunk_id in enumerate(ids, len(self._ids)))
+        self._ids.extend(ids)
+        self._texts.extend(texts)
+        self._metadatas.extend(metadatas)
+        self._dirty = True
+        return ids
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        return self.add_embeddings(texts, self.embedding_function.embed_documents(texts), metadatas, ids)
+
+    def _remove(self, ids):
+        keep = [i for i, chunk_id in enumerate(self._ids) if chunk_id not in ids]
+        self._vectors = np.asarray(self._vector_matrix()[keep])
+        self._ids = [self._ids[i] for i in keep]
+        self._texts = [self._texts[i] for i in keep]
+        self._metadatas = [self._metadatas[i] for i in keep]
+        if not self._ids:
+            self._vectors = None
+
+    def delete(self, ids=None, **kwargs):
+        if ids:
+            self._remove(set(ids))
+            self._index_books()
+            self._dirty = True
+        return True
+
+    def get(self, ids=None, include=None):
+        """
+        Como Chroma.get: IDs (y opcionalmente textos y metadatos) de los chunks guardados
+        """
+        include = ['documents', 'metadatas'] if include is None else include
+        positions = range(len(self._ids)) if ids is None else [self._positions[i] for i in ids if i in self._positions]
+        result = {'ids': [self._ids[i] for i in positions]}
+        if 'documents' in include:
+            result['documents'] = [self._texts[i] for i in positions]
+        if 'metadatas' in include:
+            result['metadatas'] = [self._metadatas[i] for i in positions]
+        return result
+
+    # Búsqueda
+
+    @staticmethod
+    def _filter_values(key, value):
+        # Valores admitidos para un metadato: igualdad ({'book': x} o {'$eq': x}) o pertenencia ({'$in': [...]})
+        if key.startswith('$'):
+            raise ValueError(f"Filtro no soportado: {key}")
+        if not isinstance(value, dict):
+            return [value]
+        if len(value) == 1 and '$eq' in value:
+            return [value['$eq']]
+        if len(value) == 1 and '$in' in value:
+            return list(value['$in'])
+        raise ValueError(f"Operador de filtro no soportado para '{key}': {', '.join(value)} (solo $eq y $in)")
+
+    def _filter_mask(self, filter):
+        if not filter:
+            return None
+        mask = np.ones(len(self._ids), dtype=bool)
+        for key, value in filter.items():
+            values = self._filter_values(key, value)
+            if key == 'book':
+                codes = [self._book_names[v] for v in values if v in self._book_names]
+                mask &= np.isin(self._book_codes, codes)
+            else:
+                mask &= np.array([metadata.get(key) in values for metadata in self._metadatas], dtype=bool)
+        return mask
+
+    def search_by_vectors(self, query_vectors, k=4, filter=None):
+        """
+        Top-k por similitud coseno para un lote de consultas.
+        Devuelve, por consulta, una lista de (posición, similitud) ordenada
+        """
+        if not self._ids:
+            return [[] for _ in query_vectors]
+        queries = self._normalize(np.atleast_2d(query_vectors))
+
+        mask = self._filter_mask(filter)
+        if mask is None:
+            candidates = None
+            scores = queries @ self._vectors.T
+        else:
+            candidates = np.flatnonzero(mask)
+            if not len(candidates):
+                return [[] for _ in queries]
+            scores = queries @ self._vectors[candidates].T
+
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, positions in enumerate(top):
+            positions = positions[np.argsort(-scores[row, positions])]
+            indices = positions if candidates is None else candidates[positions]
+            results.append([(int(i), float(scores[row, p])) for i, p in zip(indices, positions)])
+        return results
+
+    def _documents(self, hits):
+        return [
+            (Document(page_content=self._texts[i], metadata=self._metadatas[i], id=self._ids[i]), score)
+            for i, score in hits
+        ]
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None, **kwargs):
+        return self._documents(self.search_by_vectors([embedding], k, filter)[0])
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector_with_score(self.embedding_function.embed_query(query), k, filter)
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    async def asimilarity_search(self, query, k=4, filter=None, **kwargs):
+        embedding = await self.embedding_function.aembed_query(query)
+        return self.similarity_search_by_vector(embedding, k, filter)
+
+    def _select_relevance_score_fn(self):
+        # La similitud coseno de vectores normalizados ya está en [-1, 1]
+        return lambda score: (score + 1) / 2
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, persist_directory=None, **kwargs):
+        index = cls(embedding, persist_directory)
+        index.add_texts(texts, metadatas, ids)
+        index.persist()
+        return index
@@ -0,0 +1,199 @@
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import time
+import unicodedata
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.output_parsers import JsonOutputParser, PydanticOutputParser
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import BaseModel
+
+EKKO_LINES = [
+    "¡Hola! Me encantan los misterios de libros. ¿Qué fragmentos recuerdas?",
+    "Mmm, eso me suena a una historia de bosques y susurros. ¿Recuerdas algo más?",
+    "Puede que hables de un archivo perdido en otro planeta. ¿Te dice algo?",
+    "Interesante... cuéntame más detalles, creo que estoy cerca.",
+]
+
+JAYCE_LINES = [
+    "Hola... estoy intentando recordar un libro, pero el título se me escapa.",
+    "Recuerdo algo así: \"{fragment}\" ¿Te suena de algo?",
+    "¡Sí, sí! Eso me suena mucho... sigue, por favor.",
+    "Uf, tengo el título en la punta de la lengua.",
+]
+
+
+def _normalize(text):
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def _tag(text, name):
+    match = re.search(rf"<{name}>\s*(.*?)\s*</{name}>", text, re.S)
+    return match.group(1).strip() if match else ""
+
+
+def _prompt_text(messages):
+    return "\n".join(str(message.content) for message in messages)
+
+
+def _stable_seed(*parts):
+    digest = hashlib.sha256("\x00".join(str(p) for p in parts).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'little')
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Embeddings deterministas sin red: hashing de palabras y trigramas de
+    caracteres sobre un vector de tamaño fijo, normalizado (L2).
+    Textos parecidos dan vectores parecidos, así que la recuperación y la
+    caché semántica se comportan de forma razonable.
+    """
+
+    def __init__(self, size=256, latency=0.0):
+        self.size = size
+        self.latency = latency
+        self.model = f"hashing-{size}"
+
+    def _embed(self, text):
+        vector = [0.0] * self.size
+        text = _normalize(text)
+        features = re.findall(r"\w+", text)
+        padded = f" {text} "
+        features += [padded[i:i + 3] for i in range(len(padded) - 2)]
+        for feature in features:
+            h = _stable_seed(feature)
+            sign = 1.0 if h & 1 else -1.0
+            vector[(h >> 1) % self.size] += sign
+        norm = math.sqrt(sum(v * v for v in vector))
+        return [v / norm for v in vector] if norm else vector
+
+    def embed_documents(self, texts):
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Modelo de chat local con respuestas de plantilla, para pruebas de carga
+    y profiling sin red.
+
+    - Respeta el contrato de JayceResponse: con salida estructurada genera un
+      JSON con "response" y "book_remembered" (True si el último mensaje del
+      jugador contiene el nombre del libro).
+    - Simula latencia: `latency` segundos hasta el primer token (± `jitter`)
+      y `token_delay` segundos entre tokens en streaming.
+    - Es determinista: la respuesta y la latencia dependen del prompt y de `seed`.
+    """
+
+    model_name: str = "offline-scripted"
+    temperature: float = 0
+    latency: float = 0.5
+    jitter: float = 0.2
+    token_delay: float = 0.02
+    seed: int = 0
+
+    @property
+    def _llm_type(self):
+        return "offline-scripted"
+
+    def _rng(self, prompt):
+        return random.Random(_stable_seed(self.seed, prompt))
+
+    def _first_token_delay(self, rng):
+        return max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter))
+
+    def _reply(self, prompt, structured, rng):
+        if structured:
+            book_name = _tag(prompt, "book_name")
+            conversation = _tag(prompt, "conversation")
+            fragment = _tag(prompt, "fragment")
+            player_lines = [line for line in conversation.splitlines() if line.strip().startswith("Jugador:")]
+            remembered = bool(book_name) and bool(player_lines) and _normalize(book_name) in _normalize(player_lines[-1])
+            if remembered:
+                response = f"¡Eso es! ¡El libro es {book_name}! Mira, ha aparecido un portal en la esquina superior derecha."
+            else:
+                response = rng.choice(JAYCE_LINES).format(fragment=fragment)
+            return json.dumps({"response": response, "book_remembered": remembered}, ensure_ascii=False)
+
+        if "<new_messages>" in prompt:
+            return self._summary(_tag(prompt, "summary"), _tag(prompt, "new_messages"))
+
+        return rng.choice(EKKO_LINES)
+
+    def _summary(self, summary, new_messages, max_chars=400):
+        # Resumen extractivo: el anterior más el principio de cada mensaje nuevo, acotado
+        points = [line.strip()[:80] for line in new_messages.splitlines() if line.strip()]
+        if summary and summary != "(vacío)":
+            points.insert(0, summary)
+        return " / ".join(points)[-max_chars:]
+
+    def _tokens(self, text):
+        return re.findall(r"\S+\s*|\s+", text)
+
+    def _prepare(self, messages, kwargs):
+        """
+        Texto de la respuesta y retardo hasta el primer token para estos mensajes
+        """
+        prompt = _prompt_text(messages)
+        rng = self._rng(prompt)
+        text = self._reply(prompt, 'response_format' in kwargs, rng)
+        return text, self._first_token_delay(rng)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text, delay = self._prepare(messages, kwargs)
+        time.sleep(delay + self.token_delay * len(self._tokens(text)))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        text, delay = self._prepare(messages, kwargs)
+        await asyncio.sleep(delay + self.token_delay * len(self._tokens(text)))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        text, delay = self._prepare(messages, kwargs)
+        time.sleep(delay)
+        for token in self._tokens(text):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+            time.sleep(self.token_delay)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        text, delay = self._prepare(messages, kwargs)
+        await asyncio.sleep(delay)
+        for token in self._tokens(text):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+            await asyncio.sleep(self.token_delay)
+
+    def with_structured_output(self, schema, *, include_raw=False, **kwargs):
+        """
+        Igual que en ChatOpenAI: con un modelo pydantic devuelve instancias, con
+        un esquema en diccionario devuelve diccionarios (y JSON parcial en streaming)
+        """
+        bound = self.bind(response_format={"type": "json_object"})
+        if isinstance(schema, type) and issubclass(schema, BaseModel):
+            return bound | PydanticOutputParser(pydantic_object=schema)
+        return bound | JsonOutputParser()
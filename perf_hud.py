@@ -0,0 +1,120 @@
+from collections import deque
+
+import pygame
+
+BACKGROUND = (0, 0, 0)
+TEXT_COLOR = (230, 230, 230)
+GOOD_COLOR = (80, 200, 80)
+SLOW_COLOR = (230, 200, 60)
+HITCH_COLOR = (230, 70, 70)
+BUDGET_COLOR = (120, 120, 120)
+
+
+class PerfHud:
+    """
+    Overlay de rendimiento (se muestra y oculta con F3): FPS, gráfica de
+    tiempos de frame y estadísticas del juego (blits, caché del chat,
+    peticiones a los NPCs).
+
+    Está cacheado para que pintarlo cueste dos blits por frame:
+
+    - La gráfica es una superficie que se desplaza un píxel por frame con
+      scroll() y solo se pinta la columna nueva.
+    - El texto se vuelve a componer como mucho cada refresh_ms, y solo si
+      ha cambiado; cada línea se renderiza solo si su texto es nuevo.
+    """
+
+    def __init__(self, font, budget_ms, history=160, graph_height=48, refresh_ms=250, alpha=200):
+        self.font = font
+        self.budget_ms = budget_ms
+        self.graph_height = graph_height
+        self.refresh_ms = refresh_ms
+        self.alpha = alpha
+        self.visible = False
+
+        self.frame_times = deque(maxlen=history)
+        self.work_times = deque(maxlen=history)
+
+        self._graph = pygame.Surface((history, graph_height)).convert()
+        self._graph.set_alpha(alpha)
+        self._graph_stale = True
+        self._text = None
+        self._lines = None
+        self._line_surfaces = {}
+        self._last_refresh = None
+
+    def toggle(self):
+        self.visible = not self.visible
+        # La gráfica se rehace entera al mostrarse; mientras está oculta solo se guardan los tiempos
+        self._graph_stale = True
+        self._last_refresh = None
+
+    def record_frame(self, frame_ms, work_ms):
+        self.frame_times.append(frame_ms)
+        self.work_times.append(work_ms)
+        if self.visible and not self._graph_stale:
+            self._graph.scroll(-1, 0)
+            self._draw_bar(self._graph.get_width() - 1, frame_ms)
+
+    def _draw_bar(self, x, frame_ms):
+        # La escala llega a dos veces el presupuesto; la línea gris marca el presupuesto
+        height = self.graph_height
+        bar = min(height, round(frame_ms / (self.budget_ms * 2) * height))
+        color = GOOD_COLOR if frame_ms <= self.budget_ms * 1.05 else SLOW_COLOR if frame_ms <= self.budget_ms * 2 else HITCH_COLOR
+        self._graph.fill(BACKGROUND, (x, 0, 1, height))
+        if bar:
+            self._graph.fill(color, (x, height - bar, 1, bar))
+        self._graph.set_at((x, height - height // 2), BUDGET_COLOR)
+
+    def _rebuild_graph(self):
+        self._graph.fill(BACKGROUND)
+        width = self._graph.get_width()
+        for i, frame_ms in enumerate(self.frame_times):
+            self._draw_bar(width - len(self.frame_times) + i, frame_ms)
+        self._graph_stale = False
+
+    def summary_lines(self, stats):
+        frames = self.frame_times
+        average = sum(frames) / len(frames) if frames else 0.0
+        work = sum(self.work_times) / len(self.work_times) if self.work_times else 0.0
+        lines = [
+            f"FPS {1000 / average if average else 0:.0f}  frame {average:.1f} ms (máx {max(frames, default=0):.1f})",
+            f"trabajo {work:.2f} ms ({work / self.budget_ms:.0%} del frame)"
+        ]
+        lines.extend(f"{key} {value}" for key, value in stats.items())
+        return lines
+
+    def draw(self, screen, now_ms, stats):
+        """
+        stats() devuelve un diccionario etiqueta -> valor con las estadísticas del juego;
+        solo se llama al refrescar el texto
+        """
+        if not self.visible:
+            return
+        if self._graph_stale:
+            self._rebuild_graph()
+
+        if self._last_refresh is None or now_ms - self._last_refresh >= self.refresh_ms:
+            self._last_refresh = now_ms
+            lines = self.summary_lines(stats())
+            if lines != self._lines:
+                self._lines = lines
+                self._text = self._render_text(lines)
+
+        screen.blit(self._text, (8, 8))
+        screen.blit(self._graph, (8, 8 + self._text.get_height()))
+
+    def _render_text(self, lines):
+        # Solo se guardan las líneas del último texto, así la caché no crece
+        self._line_surfaces = {
+            line: self._line_surfaces.get(line) or self.font.render(line, True, TEXT_COLOR)
+            for line in lines
+        }
+        line_height = self.font.get_linesize()
+        width = max(self._line_surfaces[line].get_width() for line in lines) + 8
+        surface = pygame.Surface((max(width, self._graph.get_width()), line_height * len(lines) + 4)).convert()
+        surface.fill(BACKGROUND)
+        for i, line in enumerate(lines):
+            surface.blit(self._line_surfaces[line], (4, 2 + i * line_height))
+        surface.set_alpha(self.alpha)
+        return surface
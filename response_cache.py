@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ResponseCache:
+    """
+    Caché de respuestas de los NPCs delante de las llamadas al LLM.
+
+    - Nivel exacto: clave = prompt renderizado + modelo + temperatura.
+    - Nivel semántico (opcional): si se pasan embeddings, se reutiliza la
+      respuesta de una entrada cuyo texto de consulta sea suficientemente
+      parecido (similitud coseno >= similarity_threshold).
+
+    Solo se cachean llamadas deterministas (temperatura 0). Las entradas
+    caducan tras ttl segundos y se descartan por LRU al superar max_entries.
+    """
+
+    def __init__(self, max_entries=256, ttl=24 * 3600, embeddings=None, similarity_threshold=0.97, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.path = path
+
+        self._entries = OrderedDict()
+        self._matrix = None  # Embeddings normalizados de las entradas, en orden
+        self._matrix_keys = []
+        self._last_query = None
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+        if path and os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def make_key(prompt, model, temperature):
+        payload = json.dumps([prompt, model, temperature], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def cacheable(temperature):
+        return temperature == 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'exact_hits': self.exact_hits,
+            'semantic_hits': self.semantic_hits,
+            'misses': self.misses
+        }
+
+    def _expired(self, entry, now):
+        return self.ttl is not None and now - entry['created'] > self.ttl
+
+    def _evict(self, now):
+        removed = False
+        for key in [key for key, entry in self._entries.items() if self._expired(entry, now)]:
+            del self._entries[key]
+            removed = True
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            removed = True
+        if removed:
+            self._matrix = None
+
+    def _semantic_matrix(self, scope):
+        if self._matrix is None:
+            keys = [key for key, entry in self._entries.items() if entry.get('embedding') is not None]
+            self._matrix_keys = keys
+            self._matrix = (
+                np.array([self._entries[key]['embedding'] for key in keys], dtype=np.float32)
+                if keys else np.zeros((0, 0), dtype=np.float32)
+            )
+        mask = [self._entries[key]['scope'] == scope for key in self._matrix_keys]
+        return self._matrix, mask
+
+    async def _embed(self, text):
+        # Un fallo de caché seguido de aput embebe el mismo texto: lo reutilizamos
+        if self._last_query is not None and self._last_query[0] == text:
+            return self._last_query[1]
+        vector = np.asarray(await self.embeddings.aembed_query(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        vector = vector / norm if norm > 0 else vector
+        self._last_query = (text, vector)
+        return vector
+
+    async def aget(self, prompt, model, temperature, semantic_text=None):
+        """
+        Devuelve la respuesta cacheada o None. semantic_text es el texto que se
+        compara en el nivel semántico (por ejemplo, la conversación)
+        """
+        if not self.cacheable(temperature):
+            return None
+
+        now = time.time()
+        key = self.make_key(prompt, model, temperature)
+        entry = self._entries.get(key)
+        if entry is not None and not self._expired(entry, now):
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            return entry['value']
+
+        if self.embeddings is not None and semantic_text:
+            self._evict(now)
+            scope = [model, temperature]
+            matrix, mask = self._semantic_matrix(scope)
+            if len(self._matrix_keys) and any(mask):
+                query = await self._embed(semantic_text)
+                scores = matrix @ query
+                scores[~np.array(mask)] = -1.0
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity_threshold:
+                    best_key = self._matrix_keys[best]
+                    self._entries.move_to_end(best_key)
+                    self.semantic_hits += 1
+                    return self._entries[best_key]['value']
+
+        self.misses += 1
+        return None
+
+    async def aput(self, prompt, model, temperature, value, semantic_text=None):
+        if not self.cacheable(temperature):
+            return
+
+        embedding = None
+        if self.embeddings is not None and semantic_text:
+            embedding = (await self._embed(semantic_text)).tolist()
+
+        key = self.make_key(prompt, model, temperature)
+        self._entries[key] = {
+            'value': value,
+            'scope': [model, temperature],
+            'created': time.time(),
+            'embedding': embedding
+        }
+        self._entries.move_to_end(key)
+        self._matrix = None
+        self._evict(time.time())
+
+    def load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        self._entries = OrderedDict(entries)
+        self._matrix = None
+        self._evict(time.time())
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
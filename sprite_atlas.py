@@ -0,0 +1,129 @@
+import glob
+import hashlib
+import json
+import math
+import os
+import re
+
+import pygame
+
+
+class SpriteAtlas:
+    """
+    Atlas con solo los tiles que usa el juego, ya recortados y escalados a
+    tile_size, empaquetados en una única superficie.
+
+    - sheets: nombre -> (ruta de la hoja, ancho del tile, alto del tile).
+    - preload(refs) carga el atlas de disco o lo construye. La caché se
+      identifica por el hash de las hojas de origen, el tamaño de tile y la
+      lista de tiles, así que se rehace sola si cambia cualquiera de ellos.
+      Al guardar uno nuevo se borran los atlas anteriores de las mismas hojas.
+    - tile() devuelve un tile del atlas; los que no están en él se recortan
+      bajo demanda de su hoja.
+    """
+
+    def __init__(self, sheets, tile_size, cache_dir):
+        self.sheets = sheets
+        self.tile_size = tile_size
+        self.cache_dir = cache_dir
+
+        self._tiles = {}
+        self._sheet_surfaces = {}
+        self.loaded_from_cache = False
+        self.lazy_loads = 0
+
+    @staticmethod
+    def _file_hash(path):
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def cache_key(self, refs):
+        payload = {
+            'tile_size': self.tile_size,
+            'sheets': {
+                name: [*self.sheets[name], self._file_hash(self.sheets[name][0])]
+                for name in sorted({sheet for sheet, _, _ in refs})
+            },
+            'refs': sorted(refs)
+        }
+        return hashlib.sha256(json.dumps(payload).encode('utf-8')).hexdigest()[:16]
+
+    def _sheet(self, name):
+        surface = self._sheet_surfaces.get(name)
+        if surface is None:
+            surface = pygame.image.load(self.sheets[name][0]).convert_alpha()
+            self._sheet_surfaces[name] = surface
+        return surface
+
+    def _cut(self, name, row, col):
+        _, tile_width, tile_height = self.sheets[name]
+        rect = pygame.Rect(col * tile_width, row * tile_height, tile_width, tile_height)
+        image = self._sheet(name).subsurface(rect)
+        if tile_width != self.tile_size or tile_height != self.tile_size:
+            return pygame.transform.scale(image, (self.tile_size, self.tile_size))
+        return image.copy()
+
+    def preload(self, refs):
+        """
+        Carga (o construye y guarda) el atlas con los tiles refs = [(hoja, fila, columna)]
+        """
+        refs = sorted({tuple(ref) for ref in refs})
+        prefix = os.path.join(self.cache_dir, f"atlas-{'+'.join(sorted({sheet for sheet, _, _ in refs}))}-")
+        key = self.cache_key(refs)
+        image_path = f"{prefix}{key}.png"
+        index_path = f"{prefix}{key}.json"
+
+        if os.path.exists(image_path) and os.path.exists(index_path):
+            atlas = pygame.image.load(image_path).convert_alpha()
+            with open(index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            self.loaded_from_cache = True
+        else:
+            atlas, index = self._build(refs)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            pygame.image.save(atlas, image_path)
+            tmp_path = index_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, index_path)
+            self._prune(prefix, key)
+            # Las hojas completas ya no hacen falta en memoria
+            self._sheet_surfaces.clear()
+
+        for entry in index:
+            x, y = entry['pos']
+            rect = pygame.Rect(x, y, self.tile_size, self.tile_size)
+            self._tiles[(entry['sheet'], entry['row'], entry['col'])] = atlas.subsurface(rect)
+
+    @staticmethod
+    def _prune(prefix, key):
+        # Atlas de las mismas hojas con otra clave: hojas, tamaño o tiles que ya no se usan
+        for path in glob.glob(glob.escape(prefix) + '*'):
+            stem = path[len(prefix):].split('.', 1)[0]
+            # Solo claves: 'atlas-floor-…' no debe tocar los de una hoja 'floor-2'
+            if stem != key and re.fullmatch(r'[0-9a-f]{16}', stem):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _build(self, refs):
+        # Todos los tiles miden lo mismo: se empaquetan en una rejilla casi cuadrada
+        columns = max(1, math.ceil(math.sqrt(len(refs))))
+        rows = max(1, math.ceil(len(refs) / columns))
+        atlas = pygame.Surface((columns * self.tile_size, rows * self.tile_size), pygame.SRCALPHA)
+        index = []
+        for i, (name, row, col) in enumerate(refs):
+            pos = ((i % columns) * self.tile_size, (i // columns) * self.tile_size)
+            atlas.blit(self._cut(name, row, col), pos)
+            index.append({'sheet': name, 'row': row, 'col': col, 'pos': pos})
+        return atlas, index
+
+    def tile(self, sheet, row, col):
+        key = (sheet, row, col)
+        surface = self._tiles.get(key)
+        if surface is None:
+            surface = self._cut(sheet, row, col)
+            self._tiles[key] = surface
+            self.lazy_loads += 1
+        return surface
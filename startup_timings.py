@@ -0,0 +1,41 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupTimings:
+    """
+    Tiempos de cada fase del arranque. Las fases pueden medirse desde
+    varios hilos (la carga del stack de IA va en segundo plano).
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = []  # (fase, duración, fin desde el arranque, hilo)
+        self._lock = threading.Lock()
+
+    def _record(self, name, duration):
+        with self._lock:
+            self.phases.append((name, duration, time.perf_counter() - self.start, threading.current_thread().name))
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, time.perf_counter() - started)
+
+    def mark(self, name):
+        """
+        Hito sin duración propia (por ejemplo, el primer frame)
+        """
+        self._record(name, 0.0)
+
+    def report(self):
+        with self._lock:
+            phases = sorted(self.phases, key=lambda phase: phase[2])
+        print(f"{'fase':<24}{'duración':>12}{'desde inicio':>15}  hilo")
+        for name, duration, end, thread in phases:
+            duration_text = f"{duration * 1e3:.1f} ms" if duration else "-"
+            print(f"{name:<24}{duration_text:>12}{end * 1e3:>12.1f} ms  {thread}")
@@ -0,0 +1,185 @@
+import os
+import time
+from contextlib import contextmanager
+
+EXPORTERS = ('none', 'console', 'file', 'otlp')
+
+
+class _NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+    def add_event(self, name, attributes=None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Measurement:
+    """
+    Span en curso y su duración. first_token() registra el tiempo desde el
+    inicio hasta el primer token de una respuesta en streaming
+    """
+
+    def __init__(self, telemetry, name, span, attributes):
+        self.telemetry = telemetry
+        self.name = name
+        self.span = span
+        self.attributes = attributes
+        self.started = time.perf_counter()
+        self.ttft_ms = None
+
+    @property
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def set(self, key, value):
+        self.span.set_attribute(key, value)
+
+    def first_token(self):
+        if self.ttft_ms is None:
+            self.ttft_ms = self.elapsed_ms
+            self.telemetry.record(f"{self.name}.ttft", self.ttft_ms, **self.attributes)
+            self.span.add_event("first_token")
+
+
+class Telemetry:
+    """
+    Trazas y métricas con OpenTelemetry.
+
+    Desactivada por defecto: sin configure(), o sin el SDK instalado, todo
+    son operaciones vacías y el bucle de frames no paga nada. Exportadores:
+
+    - console: spans y métricas en JSON por la salida estándar.
+    - file: lo mismo, una línea JSON por registro en un fichero (sin red).
+    - otlp: a un collector por gRPC (OTEL_EXPORTER_OTLP_ENDPOINT).
+
+    Cada measure(nombre) crea un span y un histograma nombre.duration en ms.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.exporter = 'none'
+        self._tracer = None
+        self._meter = None
+        self._histograms = {}
+        self._providers = []
+        self._file = None
+
+    def _exporters(self, exporter, path):
+        if exporter == 'otlp':
+            from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
+            from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+            return OTLPSpanExporter(), OTLPMetricExporter()
+
+        from opentelemetry.sdk.metrics.export import ConsoleMetricExporter
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+        if exporter == 'console':
+            return ConsoleSpanExporter(), ConsoleMetricExporter()
+
+        self._file = open(path, 'a', encoding='utf-8')
+        return (
+            ConsoleSpanExporter(out=self._file, formatter=lambda span: span.to_json(indent=None) + os.linesep),
+            ConsoleMetricExporter(out=self._file, formatter=lambda data: data.to_json(indent=None) + os.linesep)
+        )
+
+    def configure(self, exporter='none', service_name='roguelike', path='telemetry.jsonl', export_interval=10.0):
+        """
+        Activa la telemetría con el exportador indicado. Devuelve False si queda desactivada
+        """
+        if exporter not in EXPORTERS:
+            raise ValueError(f"Exportador de telemetría desconocido: {exporter} (opciones: {', '.join(EXPORTERS)})")
+        if exporter == 'none':
+            return False
+
+        try:
+            from opentelemetry import metrics, trace
+            from opentelemetry.sdk.metrics import MeterProvider
+            from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+            span_exporter, metric_exporter = self._exporters(exporter, path)
+        except ImportError as e:
+            print(f"Telemetría desactivada, falta OpenTelemetry: {e}")
+            return False
+
+        resource = Resource.create({"service.name": service_name})
+        tracer_provider = TracerProvider(resource=resource)
+        tracer_provider.add_span_processor(BatchSpanProcessor(span_exporter))
+        meter_provider = MeterProvider(
+            resource=resource,
+            metric_readers=[PeriodicExportingMetricReader(metric_exporter, export_interval_millis=export_interval * 1000)]
+        )
+        # Globales, para que otra instrumentación del proceso (FastAPI, httpx) use los mismos
+        trace.set_tracer_provider(tracer_provider)
+        metrics.set_meter_provider(meter_provider)
+
+        self._tracer = tracer_provider.get_tracer(service_name)
+        self._meter = meter_provider.get_meter(service_name)
+        self._providers = [tracer_provider, meter_provider]
+        self.exporter = exporter
+        self.enabled = True
+        return True
+
+    def record(self, name, value_ms, **attributes):
+        if not self.enabled:
+            return
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self._meter.create_histogram(name, unit="ms")
+            self._histograms[name] = histogram
+        histogram.record(value_ms, attributes)
+
+    @contextmanager
+    def measure(self, name, **attributes):
+        """
+        Span con la duración del bloque, que también se registra en el histograma name.duration
+        """
+        if not self.enabled:
+            yield Measurement(self, name, NOOP_SPAN, attributes)
+            return
+        with self._tracer.start_as_current_span(name, attributes=attributes) as span:
+            measurement = Measurement(self, name, span, attributes)
+            try:
+                yield measurement
+            finally:
+                self.record(f"{name}.duration", measurement.elapsed_ms, **attributes)
+
+    def interval(self, name, start_ns, end_ns, **attributes):
+        """
+        Span de algo ya terminado que se ha medido por fuera (time.time_ns())
+        """
+        if not self.enabled:
+            return
+        span = self._tracer.start_span(name, start_time=start_ns, attributes=attributes)
+        span.end(end_time=end_ns)
+        self.record(f"{name}.duration", (end_ns - start_ns) / 1e6, **attributes)
+
+    def frame(self, phases, hitch_ms):
+        """
+        Tiempos de las fases de un frame (ms). Los frames de más de hitch_ms
+        dejan además un span con el desglose, para localizar los tirones
+        """
+        if not self.enabled:
+            return
+        for phase, value in phases.items():
+            self.record("frame.phase.duration", value, phase=phase)
+        total = phases.get('frame', 0.0)
+        if total > hitch_ms:
+            end = time.time_ns()
+            self.interval("frame.hitch", end - int(total * 1e6), end, **{f"{phase}_ms": value for phase, value in phases.items()})
+
+    def shutdown(self):
+        for provider in self._providers:
+            provider.shutdown()
+        self._providers = []
+        self.enabled = False
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# Instancia compartida por el juego y el servicio de diálogo
+telemetry = Telemetry()